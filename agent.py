@@ -1,8 +1,21 @@
 import json
+import logging
 import os
 import re
+import time
+from typing import Iterator, Sequence
 from dotenv import load_dotenv
-from searcher import google_search, collect_for_llm
+from langchain_core.documents import Document
+from context_builder import ContextBuilder
+from executors import BoundedExecutor
+from router import ROUTE_LOCAL, ROUTE_SEARCH, Router
+from searcher import WEB_SEPARATOR, google_search, collect_pages
+from web_passages import WebPassageRanker
+
+logger = logging.getLogger(__name__)
+
+# Ограничение длины поискового запроса, формулируемого на маршруте поиска, в токенах
+SEARCH_QUERY_MAX_TOKENS = 32
 
 # Загружаем переменные из .env файла
 load_dotenv()
@@ -24,14 +37,47 @@ class Agent:
     - повторно обращается к LLM с расширенным контекстом.
     """
 
-    def __init__(self, llm):
+    def __init__(self, llm, router: Router | None = None, constrained_tool_calls: bool = False,
+                 context_builder: ContextBuilder | None = None, web_max_tokens: int | None = None,
+                 web_ranker: WebPassageRanker | None = None, network_executor: BoundedExecutor | None = None,
+                 web_prompt_stats: bool = False):
         """
         Инициализация класса
 
         Args:
             llm: LLM-модель
+            router: маршрутизатор, решающий без LLM, нужен ли поиск в интернете (если не задан, решение всегда
+                принимает LLM)
+            constrained_tool_calls: ограничить декодирование вызова инструмента схемой web_search
+            context_builder: сборщик контекста, ограничивающий текст интернет источников бюджетом токенов (если не
+                задан, текст добавляется целиком)
+            web_max_tokens: бюджет токенов текста интернет источников (по умолчанию — бюджет сборщика контекста)
+            web_ranker: отбор фрагментов интернет страниц, релевантных вопросу (если не задан, страницы передаются
+                целиком)
+            network_executor: исполнитель сетевых запросов поиска (если не задан, запросы выполняются в текущем
+                потоке)
+            web_prompt_stats: считать размер промпта с интернет источниками до и после отбора текста (требует
+                повторной токенизации полного текста страниц на каждом ответе, поэтому по умолчанию выключено)
         """
         self.llm = llm
+        self.router = router
+        self.constrained_tool_calls = constrained_tool_calls
+        self.context_builder = context_builder
+        self.web_max_tokens = web_max_tokens
+        self.web_ranker = web_ranker
+        self.network_executor = network_executor
+        self.web_prompt_stats = web_prompt_stats
+        # Размер промпта финального ответа с полным текстом страниц и с отобранным текстом
+        self.web_answers = 0
+        self.web_prompt_tokens_before = 0
+        self.web_prompt_tokens_after = 0
+        # Среднее время прохода LLM, принимающего решение о вызове инструмента (для оценки экономии)
+        self.tool_pass_seconds = 0.0
+        self.tool_passes = 0
+        self.skipped_tool_passes = 0
+        # Проходы LLM, формулирующие поисковый запрос на маршруте поиска
+        self.search_query_seconds = 0.0
+        self.search_query_passes = 0
         self.default_system_prompt = (
             "Ты — интеллектуальный помощник, задача которого — отвечать на вопросы пользователя строго на основе "
             "предоставленного контекста и истории диалога. Ты не должен придумывать информацию, которой нет в "
@@ -40,6 +86,10 @@ class Agent:
             "создавать любой другой творческий контент. Твои ответы должны быть строго основаны на фактах, данных "
             "и предоставленном контексте."
         )
+        self.search_query_prompt = (
+            "Сформулируй по вопросу пользователя короткий поисковый запрос для поисковой системы. "
+            "Ответь только текстом запроса, без пояснений и кавычек."
+        )
         self.agent_system_prompt = (
             "Ты — интеллектуальный помощник, задача которого — отвечать на вопросы пользователя строго на основе "
             "предоставленного контекста и истории диалога. "
@@ -68,6 +118,10 @@ class Agent:
             "Твои ответы должны быть строго основаны на фактах, данных и предоставленном контексте."
         )
 
+        # Системные промпты статичны: их KV-кэш вычисляется один раз и переиспользуется в каждом запросе
+        self.llm.register_prefix(self.default_system_prompt)
+        self.llm.register_prefix(self.agent_system_prompt)
+
     @staticmethod
     def _parse_tool_call(text: str) -> dict | None:
         """
@@ -112,31 +166,51 @@ class Agent:
         Returns:
             str: Ответ LLM-модели
         """
-        prompt = self.llm.tokenizer.apply_chat_template(
+        return self.llm.generate(self._prompt(messages), tool_call_mode)
+
+    def _call_llm_stream(self, messages: list[dict], tool_call_mode: bool = False) -> Iterator[str]:
+        """
+        Формирует промт и выполняет потоковый запрос к LLM-модели
+
+        Args:
+            messages: Список сообщений
+            tool_call_mode: Флаг вызова инструмента. Если True — модель ожидается к вызову инструмента
+
+        Yields:
+            str: Очередной фрагмент ответа LLM-модели
+        """
+        return self.llm.generate_stream(self._prompt(messages), tool_call_mode)
+
+    def _prompt(self, messages: list[dict]) -> str:
+        """
+        Формирует промт по шаблону чата LLM-модели
+
+        Args:
+            messages: Список сообщений
+
+        Returns:
+            str: Промт
+        """
+        return self.llm.tokenizer.apply_chat_template(
             messages,
             tokenize=False,
             add_generation_prompt=True
         )
-        return self.llm.generate(prompt, tool_call_mode)
 
-    def run(self, query: str, context: str = "") -> str:
+    def _messages(self, system_prompt: str, query: str, context: str) -> list[dict]:
         """
-        Запускает агентный цикл обработки запроса
-
-        1. Передаёт запрос и контекст в LLM-модель с агентным промптом
-        2. Проверяет, требуется ли вызов инструмента
-        3. При необходимости выполняет web-поиск и расширяет контекст
-        4. Повторно обращается к LLM для получения финального ответа
+        Формирует сообщения для LLM-модели
 
         Args:
+            system_prompt: Системный промпт
             query: Вопрос пользователя
             context: Контекст, на основе которого нужно отвечать
 
         Returns:
-            str: Итоговый ответ LLM-модели
+            list[dict]: Список сообщений
         """
-        messages = [
-            {"role": "system", "content": self.agent_system_prompt},
+        return [
+            {"role": "system", "content": system_prompt},
             {
                 "role": "user",
                 "content": (
@@ -146,27 +220,267 @@ class Agent:
             }
         ]
 
-        first_response = self._call_llm(messages, tool_call_mode=True)
+    def _prompt_tokens(self, query: str, context: str) -> int:
+        """Количество токенов промпта финального ответа"""
+        prompt = self._prompt(self._messages(self.default_system_prompt, query, context))
+        return len(self.llm.tokenizer(prompt, add_special_tokens=False)["input_ids"])
+
+    def _network(self, fn, *args):
+        """Выполнение сетевого запроса в исполнителе сетевых запросов"""
+        if self.network_executor is None:
+            return fn(*args)
+        return self.network_executor.call(fn, *args)
+
+    def _web_context(self, context: str, search_query: str, query: str) -> str:
+        """
+        Выполняет web-поиск и расширяет контекст его результатами
+
+        Если задан отбор фрагментов, в контекст попадают только фрагменты страниц, наиболее релевантные вопросу,
+        каждый со ссылкой на источник
+
+        Args:
+            context: Контекст, на основе которого нужно отвечать
+            search_query: Поисковый запрос
+            query: Вопрос пользователя
+
+        Returns:
+            str: Расширенный контекст
+        """
+        search_result = self._network(google_search, search_query, search_id, api_key)
+        pages = self._network(collect_pages, search_result)
+
+        if self.web_ranker is not None and pages:
+            passages = self.web_ranker.select(query, pages)
+            if self.context_builder is not None:
+                web_text = self.context_builder.build(passages, max_tokens=self.web_max_tokens, with_source=True)
+            else:
+                web_text = WEB_SEPARATOR.join(f"Источник: {doc.metadata['source']}\n{doc.page_content}"
+                                              for doc in passages)
+        elif self.context_builder is not None and pages:
+            # Страницы идут в порядке поисковой выдачи: дубликаты удаляются, остальное обрезается по бюджету
+            documents = [Document(page_content=f"Источник: {url}\n{text}", metadata={"source": url})
+                         for url, text in pages]
+            web_text = self.context_builder.build(documents, max_tokens=self.web_max_tokens)
+        else:
+            web_text = WEB_SEPARATOR.join(f"Источник: {url}\n{text}" for url, text in pages)
+
+        extended = context + f"\n===========\nИнформация из интернет источников\n{web_text}\n===========\n"
+        if self.web_prompt_stats and pages and (self.web_ranker is not None or self.context_builder is not None):
+            full_text = WEB_SEPARATOR.join(f"Источник: {url}\n{text}" for url, text in pages)
+            before = self._prompt_tokens(
+                query, context + f"\n===========\nИнформация из интернет источников\n{full_text}\n===========\n")
+            after = self._prompt_tokens(query, extended)
+            self.web_answers += 1
+            self.web_prompt_tokens_before += before
+            self.web_prompt_tokens_after += after
+            logger.info("Промпт с интернет источниками: %d -> %d токенов", before, after)
+        return extended
+
+    def _search_and_answer(self, query: str, context: str, search_query: str) -> str:
+        """
+        Выполняет web-поиск, расширяет контекст и запрашивает финальный ответ LLM-модели
+
+        Args:
+            query: Вопрос пользователя
+            context: Контекст, на основе которого нужно отвечать
+            search_query: Поисковый запрос
+
+        Returns:
+            str: Итоговый ответ LLM-модели
+        """
+        context = self._web_context(context, search_query, query)
+        messages = self._messages(self.default_system_prompt, query, context)
+
+        final_response = self._call_llm(messages, tool_call_mode=False)
+        return final_response
+
+    def _search_query(self, query: str) -> str:
+        """
+        Формулировка поискового запроса по вопросу пользователя для маршрута поиска
+
+        Маршрутизатор пропускает проход LLM с вызовом инструмента, в котором модель сама формулирует запрос.
+        Промпт этого прохода содержит только вопрос, без контекста, поэтому он намного короче. Если модель вернула
+        пустой ответ, используется сам вопрос
+
+        Args:
+            query: Вопрос пользователя
+
+        Returns:
+            str: Поисковый запрос
+        """
+        started = time.perf_counter()
+        messages = [{"role": "system", "content": self.search_query_prompt}, {"role": "user", "content": query}]
+        response = self.llm.generate(self._prompt(messages), tool_call_mode=True,
+                                     max_new_tokens=SEARCH_QUERY_MAX_TOKENS)
+        self.search_query_passes += 1
+        self.search_query_seconds += time.perf_counter() - started
+
+        lines = response.strip().splitlines()
+        search_query = lines[0].strip().strip('"«»').strip() if lines else ""
+        return search_query or query
+
+    def _route(self, query: str, documents: Sequence[Document] | None) -> str | None:
+        """
+        Выбор маршрута маршрутизатором
+
+        Args:
+            query: Вопрос пользователя
+            documents: Документы после реранкинга
+
+        Returns:
+            str | None: ROUTE_LOCAL или ROUTE_SEARCH, если проход LLM для решения о вызове инструмента не нужен,
+            иначе None
+        """
+        if self.router is None or documents is None:
+            return None
+
+        decision = self.router.route(query, documents)
+        logger.info("Маршрутизатор: %s (%s, оценка %s)", decision.route, decision.reason, decision.top_score)
+        if decision.route in (ROUTE_LOCAL, ROUTE_SEARCH):
+            self._log_skipped_tool_pass(decision.route, decision.reason)
+            return decision.route
+        return None
+
+    def _record_tool_pass(self, elapsed: float) -> None:
+        """Учитывает время прохода LLM для решения о вызове инструмента"""
+        self.tool_passes += 1
+        self.tool_pass_seconds += (elapsed - self.tool_pass_seconds) / self.tool_passes
+
+    def _log_skipped_tool_pass(self, route: str, reason: str) -> None:
+        """Учитывает пропущенный проход LLM для решения о вызове инструмента"""
+        self.skipped_tool_passes += 1
+        logger.info("Маршрут '%s' (%s): проход LLM для вызова инструмента пропущен, сэкономлено ~%.1f с",
+                    route, reason, self.tool_pass_seconds)
+
+    def run(self, query: str, context: str = "", documents: Sequence[Document] | None = None) -> str:
+        """
+        Запускает агентный цикл обработки запроса
+
+        0. Если задан маршрутизатор, он по документам решает без LLM, отвечать ли по контексту или сразу искать
+        1. Передаёт запрос и контекст в LLM-модель с агентным промптом
+        2. Проверяет, требуется ли вызов инструмента
+        3. При необходимости выполняет web-поиск и расширяет контекст
+        4. Повторно обращается к LLM для получения финального ответа
+
+        Args:
+            query: Вопрос пользователя
+            context: Контекст, на основе которого нужно отвечать
+            documents: Документы после реранкинга, из которых собран контекст (для маршрутизатора)
+
+        Returns:
+            str: Итоговый ответ LLM-модели
+        """
+        route = self._route(query, documents)
+        if route == ROUTE_LOCAL:
+            messages = self._messages(self.default_system_prompt, query, context)
+            return self._call_llm(messages, tool_call_mode=False)
+        if route == ROUTE_SEARCH:
+            return self._search_and_answer(query, context, search_query=self._search_query(query))
+
+        messages = self._messages(self.agent_system_prompt, query, context)
+
+        started = time.perf_counter()
+        # Генерация обрывается сразу после JSON вызова инструмента, а ответ без инструмента дописывается без
+        # повторного prefill
+        first_response = self.llm.generate_tool_call(self._prompt(messages), self.constrained_tool_calls)
+        self._record_tool_pass(time.perf_counter() - started)
 
         tool_args = self._parse_tool_call(first_response)
 
         if not tool_args:
             return first_response
 
-        search_result = google_search(tool_args["query"], search_id, api_key)
-        search_result = collect_for_llm(search_result)
+        return self._search_and_answer(query, context, search_query=tool_args["query"])
 
-        context += f"\n===========\nИнформация из интернет источников\n{search_result}\n===========\n"
-        messages = [
-            {"role": "system", "content": self.default_system_prompt},
-            {
-                "role": "user",
-                "content": (
-                    f"Контекст:\n{context}\n\n"
-                    f"Вопрос:\n{query}"
-                )
-            }
-        ]
+    def run_stream(self, query: str, context: str = "",
+                   documents: Sequence[Document] | None = None) -> Iterator[tuple[str, str]]:
+        """
+        Потоковый вариант агентного цикла
 
-        final_response = self._call_llm(messages, tool_call_mode=False)
-        return final_response
+        Ответ без вызова инструмента отдаётся по мере генерации. Пока первый непробельный символ ответа в режиме
+        вызова инструмента не известен, фрагменты буферизуются; если ответ начинается с `{`, он целиком
+        накапливается и разбирается как вызов инструмента
+
+        Args:
+            query: Вопрос пользователя
+            context: Контекст, на основе которого нужно отвечать
+            documents: Документы после реранкинга, из которых собран контекст (для маршрутизатора)
+
+        Yields:
+            tuple[str, str]: События ("status", этап) при смене этапа и ("token", фрагмент ответа)
+        """
+        route = self._route(query, documents)
+        if route == ROUTE_LOCAL:
+            messages = self._messages(self.default_system_prompt, query, context)
+            for text in self._call_llm_stream(messages, tool_call_mode=False):
+                yield "token", text
+            return
+
+        if route == ROUTE_SEARCH:
+            search_query = self._search_query(query)
+        else:
+            yield "status", "tool_decision"
+            messages = self._messages(self.agent_system_prompt, query, context)
+
+            started = time.perf_counter()
+            buffer = ""
+            streaming = False
+            for text in self._call_llm_stream(messages, tool_call_mode=True):
+                if streaming:
+                    yield "token", text
+                    continue
+                buffer += text
+                stripped = buffer.lstrip()
+                if stripped and not stripped.startswith("{"):
+                    # Это не вызов инструмента — отдаём накопленное и дальше передаём фрагменты сразу
+                    streaming = True
+                    yield "token", stripped
+            self._record_tool_pass(time.perf_counter() - started)
+
+            if streaming:
+                return
+
+            tool_args = self._parse_tool_call(buffer)
+            if not tool_args:
+                yield "token", buffer.strip()
+                return
+            search_query = tool_args["query"]
+
+        yield "status", "web_search"
+        context = self._web_context(context, search_query, query)
+        messages = self._messages(self.default_system_prompt, query, context)
+
+        yield "status", "answer"
+        for text in self._call_llm_stream(messages, tool_call_mode=False):
+            yield "token", text
+
+    def stats(self) -> dict:
+        """
+        Статистика агента
+
+        Returns:
+            dict[str, float]: количество выполненных и пропущенных проходов LLM для решения о вызове инструмента,
+            среднее время такого прохода, количество и среднее время проходов, формулирующих поисковый запрос на
+            маршруте поиска, средний размер промпта с интернет источниками до и после отбора текста
+            (если включён web_prompt_stats) и решения маршрутизатора
+        """
+        stats = {
+            "tool_passes": self.tool_passes,
+            "skipped_tool_passes": self.skipped_tool_passes,
+            "tool_pass_avg_seconds": round(self.tool_pass_seconds, 3),
+            "estimated_saved_seconds": round(self.skipped_tool_passes * self.tool_pass_seconds
+                                             - self.search_query_seconds, 1),
+            "search_query_passes": self.search_query_passes,
+            "search_query_avg_seconds": round(self.search_query_seconds / self.search_query_passes, 3)
+            if self.search_query_passes else 0.0,
+            "web_answers": self.web_answers,
+            "web_prompt_avg_tokens_before": round(self.web_prompt_tokens_before / self.web_answers, 1)
+            if self.web_answers else 0.0,
+            "web_prompt_avg_tokens_after": round(self.web_prompt_tokens_after / self.web_answers, 1)
+            if self.web_answers else 0.0,
+        }
+        if self.web_ranker is not None:
+            stats["web_passages"] = self.web_ranker.stats()
+        if self.router is not None:
+            stats["router"] = self.router.stats()
+        return stats
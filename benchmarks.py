@@ -0,0 +1,458 @@
+import argparse
+import os
+import random
+import requests
+import resource
+import time
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sentence_transformers import CrossEncoder
+from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from ingestion import IncrementalSplitter
+from llm_model import LLMModel
+from onnx_embeddings import OnnxEmbeddings, recall_parity
+from pdf_to_db import PDFVecDataBase
+from reranker import Rerank
+from searcher import ExtractionPool, FetchEngine, extract_main_text
+from tests.stand_in import start_stand_in
+
+
+def load_chunks(file_path: str, start_page: int = 1, limit: int | None = None) -> list[str]:
+    """
+    Разбиение PDF файла на чанки так же, как при загрузке в сервисе
+
+    Args:
+        file_path: путь к PDF файлу
+        start_page: номер страницы с которой начинать извлечение
+        limit: максимальное количество чанков
+
+    Returns:
+        list[str]: тексты чанков
+    """
+    splitter = IncrementalSplitter(RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=1500,
+                                                                  separators=["\n\n", "\n", ",", " ", ""]))
+    chunks = []
+    for page_no, page_text in PDFVecDataBase.iter_pages_from_pdf(file_path, start_page=start_page):
+        chunks.extend(chunk for chunk, _ in splitter.feed(page_no, page_text))
+        if limit and len(chunks) >= limit:
+            return chunks[:limit]
+    chunks.extend(chunk for chunk, _ in splitter.flush())
+    return chunks[:limit] if limit else chunks
+
+
+def bench_extract(file_path: str, start_page: int, workers: list[int], pages_per_task: int) -> None:
+    """
+    Сравнение пропускной способности последовательного и параллельного извлечения текста из PDF
+
+    Args:
+        file_path: путь к PDF файлу
+        start_page: номер страницы с которой начинать извлечение
+        workers: список количеств процессов для сравнения (1 — последовательный режим)
+        pages_per_task: количество страниц в одной задаче для процесса
+    """
+    for n in workers:
+        started = time.perf_counter()
+        first_page_at = None
+        pages = 0
+        chars = 0
+        for _, page_text in PDFVecDataBase.iter_pages_from_pdf(file_path, start_page=start_page, workers=n,
+                                                               pages_per_task=pages_per_task):
+            if first_page_at is None:
+                first_page_at = time.perf_counter() - started
+            pages += 1
+            chars += len(page_text)
+        elapsed = time.perf_counter() - started
+        print(f"workers={n:<3} pages={pages:<6} chars={chars:<10} time={elapsed:.2f}s "
+              f"pages/s={pages / elapsed:.1f} first_page={first_page_at or 0:.3f}s")
+
+
+def bench_embed(file_path: str, model_name: str, limit: int, threads: int | None) -> None:
+    """
+    Сравнение пропускной способности и качества поиска PyTorch и ONNX бэкендов модели эмбеддингов
+
+    Args:
+        file_path: путь к PDF файлу с корпусом
+        model_name: имя модели эмбеддингов
+        limit: максимальное количество чанков
+        threads: количество потоков ONNX Runtime
+    """
+    chunks = load_chunks(file_path, limit=limit)
+    # Запросы — начала части чанков, чтобы у каждого запроса был заведомо релевантный документ
+    queries = [chunk[:200] for chunk in chunks[::10]]
+
+    reference = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": "cpu"})
+    backends = {
+        "torch": reference,
+        "onnx": OnnxEmbeddings(model_name, intra_op_threads=threads),
+        "onnx-int8": OnnxEmbeddings(model_name, quantize=True, intra_op_threads=threads),
+    }
+
+    for name, embeddings in backends.items():
+        embeddings.embed_documents(chunks[:8])  # Прогрев
+        started = time.perf_counter()
+        embeddings.embed_documents(chunks)
+        elapsed = time.perf_counter() - started
+        parity = recall_parity(reference, embeddings, chunks, queries) if name != "torch" else 1.0
+        print(f"{name:<10} chunks={len(chunks):<6} time={elapsed:.2f}s chunks/s={len(chunks) / elapsed:.1f} "
+              f"recall@10_parity={parity:.3f}")
+
+
+def _percentiles(latencies: list[float]) -> str:
+    values = np.array(latencies) * 1000
+    return " ".join(f"p{p}={np.percentile(values, p):.1f}ms" for p in (50, 90, 99))
+
+
+def bench_rerank(file_path: str, model_name: str, requests: int, docs_per_request: int, repeat_ratio: float) -> None:
+    """
+    Сравнение задержки реранкинга: один несортированный вызов CrossEncoder.predict против корзин по длине
+    с кэшем оценок
+
+    Args:
+        file_path: путь к PDF файлу с корпусом
+        model_name: имя модели реранкера
+        requests: количество запросов
+        docs_per_request: количество документов на запрос (как k при поиске)
+        repeat_ratio: доля повторных запросов
+    """
+    chunks = load_chunks(file_path)
+    rng = random.Random(0)
+    workload = []
+    for _ in range(requests):
+        if workload and rng.random() < repeat_ratio:
+            workload.append(rng.choice(workload))
+        else:
+            docs = rng.sample(chunks, min(docs_per_request, len(chunks)))
+            workload.append((docs[0][:200], docs))
+
+    baseline = CrossEncoder(model_name, device="cpu")
+    latencies = []
+    for query, docs in workload:
+        started = time.perf_counter()
+        baseline.predict([[query, doc] for doc in docs])
+        latencies.append(time.perf_counter() - started)
+    print(f"baseline  {_percentiles(latencies)}")
+
+    for truncation in ("head", "head_tail"):
+        reranker = Rerank(model_name, truncation=truncation)
+        latencies = []
+        for query, docs in workload:
+            started = time.perf_counter()
+            reranker.rerank(query, docs)
+            latencies.append(time.perf_counter() - started)
+        print(f"{truncation:<9} {_percentiles(latencies)} score_cache={reranker.score_cache.stats()}")
+
+
+def bench_llm_load(model_name: str, clients: int, requests: int, max_new_tokens: int, max_batch_size: int) -> None:
+    """
+    Нагрузочный тест генерации: параллельные запросы без пакетирования и через движок непрерывного пакетирования
+
+    Половина запросов выполняется в режиме вызова инструмента (жадная генерация), половина — в режиме ответа
+    (сэмплирование), как в агентном цикле
+
+    Args:
+        model_name: имя LLM модели
+        clients: количество параллельных клиентов
+        requests: количество запросов
+        max_new_tokens: максимальное количество генерируемых токенов на запрос
+        max_batch_size: максимальный размер пакета движка
+    """
+    llm = LLMModel(model_name)
+    llm.load_model()
+    llm.max_new_tokens = max_new_tokens
+
+    topics = ["векторные базы данных", "реранкинг документов", "KV-кэш трансформера", "квантизация моделей",
+              "извлечение текста из PDF", "поиск в интернете", "пакетная обработка запросов", "эмбеддинги"]
+    rng = random.Random(0)
+    workload = []
+    for i in range(requests):
+        messages = [{"role": "system", "content": llm.default_system_prompt},
+                    {"role": "user", "content": f"Кратко объясни, что такое {rng.choice(topics)}."}]
+        prompt = llm.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        workload.append((prompt, i % 2 == 0))
+
+    def run(item: tuple[str, bool]) -> tuple[float, int]:
+        started = time.perf_counter()
+        output = llm.generate(item[0], tool_call_mode=item[1])
+        return time.perf_counter() - started, len(llm.tokenizer(output, add_special_tokens=False)["input_ids"])
+
+    for mode in ("sequential", "continuous"):
+        if mode == "continuous":
+            llm.enable_continuous_batching(max_batch_size=max_batch_size)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(run, workload))
+        elapsed = time.perf_counter() - started
+        tokens = sum(count for _, count in results)
+        print(f"{mode:<10} tokens/s={tokens / elapsed:.1f} requests/s={len(results) / elapsed:.2f} "
+              f"latency={_percentiles([latency for latency, _ in results])}")
+        if mode == "continuous":
+            print(f"engine {llm.engine.stats()}")
+
+
+def bench_assisted(model_name: str, draft_models: list[str], lookaheads: list[int], requests: int,
+                   max_new_tokens: int) -> None:
+    """
+    Подбор черновой модели и количества предлагаемых токенов для ассистированного декодирования
+
+    Args:
+        model_name: имя основной LLM модели
+        draft_models: имена черновых моделей
+        lookaheads: количества токенов, предлагаемых черновой моделью за шаг
+        requests: количество запросов на каждую конфигурацию
+        max_new_tokens: максимальное количество генерируемых токенов на запрос
+    """
+    prompts = [f"Подробно объясни, что такое {topic}." for topic in
+               ("векторная база данных", "реранкинг", "KV-кэш", "квантизация", "эмбеддинг", "токенизатор")]
+
+    configs = [(None, 0)] + [(draft, lookahead) for draft in draft_models for lookahead in lookaheads]
+    for draft, lookahead in configs:
+        # Отключение по низкой доле принятых токенов не должно влиять на замер
+        llm = LLMModel(model_name, draft_model_name=draft, num_assistant_tokens=max(lookahead, 1), min_acceptance=0.0)
+        llm.load_model()
+        llm.max_new_tokens = max_new_tokens
+        for i in range(requests):
+            messages = [{"role": "user", "content": prompts[i % len(prompts)]}]
+            llm.generate(llm.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+        stats = llm.stats().get("assisted_decoding", {})
+        speed = stats.get("tokens_per_second", {}).get("assisted") or llm.tokens_per_second["plain"]
+        print(f"draft={draft or '-':<40} lookahead={lookahead:<3} tokens/s={speed or 0:.1f} "
+              f"acceptance={stats.get('acceptance_ema')}")
+
+
+def _rss_mb() -> float:
+    """Текущий объём резидентной памяти процесса в МБ"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _precision_worker(model_name: str, precision: str, prompts: list[str], max_new_tokens: int,
+                      reference: list[tuple[list[int], int]] | None) -> tuple[dict, list[tuple[list[int], int]]]:
+    """
+    Замер одного режима точности (выполняется в отдельном процессе, чтобы замеры памяти не влияли друг на друга)
+
+    Returns:
+        tuple[dict, list[tuple[list[int], int]]]: метрики режима и сгенерированные последовательности с длинами
+        промптов
+    """
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    llm = LLMModel(model_name, precision=precision)
+    llm.load_model()
+    load_seconds = time.perf_counter() - started
+    memory_mb = _rss_mb() - rss_before
+
+    sequences = []
+    tokens = 0
+    generate_seconds = 0.0
+    for prompt in prompts:
+        text = llm.tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False,
+                                                 add_generation_prompt=True)
+        input_ids = llm.tokenizer(text, return_tensors="pt", add_special_tokens=False)["input_ids"]
+        started = time.perf_counter()
+        output = llm.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                    max_new_tokens=max_new_tokens, do_sample=False)
+        generate_seconds += time.perf_counter() - started
+        tokens += output.shape[1] - input_ids.shape[1]
+        sequences.append((output[0].tolist(), input_ids.shape[1]))
+
+    # Проверка качества: доля позиций эталонного (fp32) ответа, где жадный выбор модели совпадает с эталоном
+    agreement = None
+    if reference:
+        matches = total = 0
+        with torch.no_grad():
+            for sequence, prompt_length in reference:
+                ids = torch.tensor([sequence])
+                predicted = llm.model(input_ids=ids).logits[0, prompt_length - 1:-1].argmax(dim=-1)
+                matches += int((predicted == ids[0, prompt_length:]).sum())
+                total += len(sequence) - prompt_length
+        agreement = matches / total if total else 1.0
+
+    metrics = {
+        "dtype": str(llm.model.dtype),
+        "load_seconds": round(load_seconds, 1),
+        "memory_mb": round(memory_mb),
+        "tokens_per_second": round(tokens / generate_seconds, 2) if generate_seconds else 0.0,
+        "top1_agreement": round(agreement, 4) if agreement is not None else None,
+    }
+    return metrics, sequences
+
+
+def bench_precision(model_name: str, precisions: list[str], max_new_tokens: int) -> None:
+    """
+    Сравнение режимов точности LLM на CPU с fp32: время загрузки, память, скорость генерации и совпадение
+    жадных предсказаний с fp32 на ответах fp32
+
+    Для int8 первый запуск включает квантизацию, повторный — загрузку квантованной модели с диска
+
+    Args:
+        model_name: имя LLM модели
+        precisions: проверяемые режимы точности
+        max_new_tokens: максимальное количество генерируемых токенов на запрос
+    """
+    prompts = ["Что такое векторная база данных?", "Объясни, как работает KV-кэш трансформера.",
+               "Кратко перескажи принцип работы реранкера.", "Чем квантизация весов полезна при инференсе на CPU?"]
+    reference = None
+    for precision in ["fp32"] + [p for p in precisions if p != "fp32"]:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            metrics, sequences = pool.submit(_precision_worker, model_name, precision, prompts, max_new_tokens,
+                                             reference).result()
+        if reference is None:
+            reference = sequences
+        print(f"{precision:<5} {metrics}")
+
+
+def bench_fetch(pages: int, slow_delay: float, deadline: float, per_host: int) -> None:
+    """
+    Сравнение последовательной загрузки страниц (requests, 10 с на страницу) и FetchEngine на локальном стенде
+    с быстрыми, медленными, зависающими, неработающими и слишком большими страницами
+
+    Args:
+        pages: количество быстрых страниц
+        slow_delay: задержка медленных страниц в секундах
+        deadline: общий срок загрузки FetchEngine в секундах
+        per_host: лимит соединений на хост (все страницы стенда находятся на одном хосте)
+    """
+    server, base = start_stand_in()
+
+    urls = [f"{base}/page?delay=0.05&n={i}" for i in range(pages)]
+    urls += [f"{base}/page?delay={slow_delay}", f"{base}/page?delay=60", f"{base}/fail",
+             f"{base}/page?size={20 * 2 ** 20}"]
+
+    started = time.perf_counter()
+    loaded = 0
+    for url in urls:
+        try:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+            loaded += 1
+        except requests.RequestException:
+            pass
+    print(f"sequential time={time.perf_counter() - started:.2f}s loaded={loaded}/{len(urls)}")
+
+    engine = FetchEngine(deadline=deadline, per_host_limit=per_host)
+    started = time.perf_counter()
+    first_at = None
+    loaded = 0
+    for _ in engine.fetch_iter(urls):
+        if first_at is None:
+            first_at = time.perf_counter() - started
+        loaded += 1
+    print(f"engine     time={time.perf_counter() - started:.2f}s loaded={loaded}/{len(urls)} "
+          f"first_page={first_at or 0:.3f}s stats={engine.stats()}")
+
+    engine.close()
+    server.shutdown()
+    server.server_close()
+
+
+def bench_html(directory: str, workers: list[int]) -> None:
+    """
+    Сравнение последовательного извлечения текста trafilatura и пула процессов на сохранённых HTML-страницах
+
+    Args:
+        directory: директория с сохранёнными страницами (*.html, *.htm)
+        workers: список количеств процессов для сравнения
+    """
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                pages[name] = f.read()
+    if not pages:
+        raise ValueError(f"В директории {directory} нет HTML-страниц")
+
+    started = time.perf_counter()
+    extracted = sum(bool(extract_main_text(html)) for html in pages.values())
+    elapsed = time.perf_counter() - started
+    print(f"sequential pages={len(pages)} extracted={extracted} time={elapsed:.2f}s pages/s={len(pages) / elapsed:.1f}")
+
+    for n in workers:
+        pool = ExtractionPool(workers=n)
+        # Запуск процессов пула не входит в замер
+        pool.extract_many({"warmup": next(iter(pages.values()))})
+        started = time.perf_counter()
+        extracted = len(pool.extract_many(pages))
+        elapsed = time.perf_counter() - started
+        print(f"workers={n:<3} pages={len(pages)} extracted={extracted} time={elapsed:.2f}s "
+              f"pages/s={len(pages) / elapsed:.1f} stats={pool.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки узких мест сервиса")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract = subparsers.add_parser("extract", help="извлечение текста из PDF")
+    extract.add_argument("file_path")
+    extract.add_argument("--start-page", type=int, default=1)
+    extract.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    extract.add_argument("--pages-per-task", type=int, default=16)
+
+    embed = subparsers.add_parser("embed", help="бэкенды модели эмбеддингов")
+    embed.add_argument("file_path")
+    embed.add_argument("--model", default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    embed.add_argument("--limit", type=int, default=2000)
+    embed.add_argument("--threads", type=int, default=None)
+
+    rerank = subparsers.add_parser("rerank", help="задержка реранкинга")
+    rerank.add_argument("file_path")
+    rerank.add_argument("--model", required=True)
+    rerank.add_argument("--requests", type=int, default=200)
+    rerank.add_argument("--docs", type=int, default=10)
+    rerank.add_argument("--repeat-ratio", type=float, default=0.3)
+
+    llm = subparsers.add_parser("llm", help="нагрузочный тест генерации LLM")
+    llm.add_argument("--model", required=True)
+    llm.add_argument("--clients", type=int, default=8)
+    llm.add_argument("--requests", type=int, default=32)
+    llm.add_argument("--max-new-tokens", type=int, default=128)
+    llm.add_argument("--max-batch-size", type=int, default=8)
+
+    assisted = subparsers.add_parser("assisted", help="ассистированное декодирование с черновой моделью")
+    assisted.add_argument("--model", required=True)
+    assisted.add_argument("--drafts", nargs="+", required=True)
+    assisted.add_argument("--lookaheads", type=int, nargs="+", default=[3, 5, 8])
+    assisted.add_argument("--requests", type=int, default=6)
+    assisted.add_argument("--max-new-tokens", type=int, default=256)
+
+    precision = subparsers.add_parser("precision", help="режимы точности LLM на CPU")
+    precision.add_argument("--model", required=True)
+    precision.add_argument("--precisions", nargs="+", default=["bf16", "int8"])
+    precision.add_argument("--max-new-tokens", type=int, default=64)
+
+    fetch = subparsers.add_parser("fetch", help="загрузка страниц на локальном стенде")
+    fetch.add_argument("--pages", type=int, default=8)
+    fetch.add_argument("--slow-delay", type=float, default=3.0)
+    fetch.add_argument("--deadline", type=float, default=5.0)
+    fetch.add_argument("--per-host", type=int, default=8)
+
+    html = subparsers.add_parser("html", help="извлечение текста из сохранённых HTML-страниц")
+    html.add_argument("directory")
+    html.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        bench_extract(args.file_path, args.start_page, args.workers, args.pages_per_task)
+    elif args.command == "embed":
+        bench_embed(args.file_path, args.model, args.limit, args.threads)
+    elif args.command == "rerank":
+        bench_rerank(args.file_path, args.model, args.requests, args.docs, args.repeat_ratio)
+    elif args.command == "llm":
+        bench_llm_load(args.model, args.clients, args.requests, args.max_new_tokens, args.max_batch_size)
+    elif args.command == "assisted":
+        bench_assisted(args.model, args.drafts, args.lookaheads, args.requests, args.max_new_tokens)
+    elif args.command == "precision":
+        bench_precision(args.model, args.precisions, args.max_new_tokens)
+    elif args.command == "fetch":
+        bench_fetch(args.pages, args.slow_delay, args.deadline, args.per_host)
+    elif args.command == "html":
+        bench_html(args.directory, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+
+
+def _systems() -> dict[str, Any]:
+    """
+    Общий кэш систем chromadb по пути к директории (приватный атрибут SharedSystemClient)
+
+    Raises:
+        RuntimeError: если в установленной версии chromadb кэша нет: без него пул не может закрывать коллекции
+    """
+    systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+    if not isinstance(systems, dict):
+        raise RuntimeError("Установленная версия chromadb не поддерживается пулом коллекций: отсутствует "
+                           "SharedSystemClient._identifier_to_system")
+    return systems
+
+
+@dataclass
+class _Handle:
+    """Открытая коллекция и количество её текущих пользователей"""
+
+    db: Chroma
+    system: Any
+    users: int = 0
+    # Коллекция вытеснена из пула или закрыта: система chromadb останавливается, когда уйдёт последний пользователь
+    retired: bool = False
+
+
+class CollectionHandlePool:
+    """
+    LRU-пул открытых коллекций Chroma
+
+    Повторные обращения к коллекции используют уже открытый клиент вместо повторного чтения SQLite/HNSW файлов
+    с диска. Одна коллекция открывается не более одного раза, даже при одновременных запросах.
+    При вытеснении или закрытии коллекции останавливается и её система chromadb (соединение SQLite и сегменты
+    HNSW), но только после того, как коллекцию перестанут использовать все взявшие её через acquire.
+    Используемые коллекции не вытесняются, поэтому при одновременной работе с большим числом коллекций пул может
+    временно превысить max_size
+    """
+
+    def __init__(self, open_collection: Callable[[str], Chroma], max_size: int = 16) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            open_collection: функция открытия коллекции по пути к её директории
+            max_size: максимальное количество одновременно открытых коллекций
+        """
+        if max_size < 1:
+            raise ValueError("Размер пула должен быть положительным числом")
+        # Проверка при запуске, а не при первом вытеснении
+        _systems()
+
+        self.open_collection = open_collection
+        self.max_size = max_size
+        self._handles: OrderedDict[str, _Handle] = OrderedDict()
+        self._opening: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.cold_loads = 0
+        self.cold_seconds = 0.0
+        self.warm_loads = 0
+        self.warm_seconds = 0.0
+        # Запросы, дождавшиеся открытия коллекции другим запросом
+        self.coalesced_loads = 0
+        self.coalesced_seconds = 0.0
+        self.evictions = 0
+
+    @staticmethod
+    def _stop(collection_path: str, system) -> None:
+        """Остановка системы chromadb с удалением её из общего кэша клиентов"""
+        if system is None:
+            return
+        registry = _systems()
+        if registry.get(collection_path) is system:
+            registry.pop(collection_path, None)
+        system.stop()
+
+    def _retire(self, collection_path: str, handle: _Handle) -> bool:
+        """
+        Пометка коллекции как закрытой (под блокировкой)
+
+        Returns:
+            bool: True, если коллекцию никто не использует и её систему можно остановить сразу
+        """
+        handle.retired = True
+        # Новые обращения к той же директории должны открыть новую систему, а не получить закрываемую
+        registry = _systems()
+        if registry.get(collection_path) is handle.system:
+            registry.pop(collection_path, None)
+        return handle.users == 0
+
+    def _evict(self) -> list[tuple[str, _Handle]]:
+        """Вытеснение давно не использованных свободных коллекций сверх max_size (под блокировкой)"""
+        stopped = []
+        for path in list(self._handles):
+            if len(self._handles) <= self.max_size:
+                break
+            handle = self._handles[path]
+            if handle.users:
+                continue
+            del self._handles[path]
+            self.evictions += 1
+            if self._retire(path, handle):
+                stopped.append((path, handle))
+        return stopped
+
+    def _checkout(self, collection_path: str) -> _Handle:
+        """Получение открытой коллекции с увеличением счётчика её пользователей"""
+        started = time.perf_counter()
+        with self._lock:
+            handle = self._handles.get(collection_path)
+            if handle is not None:
+                self._handles.move_to_end(collection_path)
+                handle.users += 1
+                self.warm_loads += 1
+                self.warm_seconds += time.perf_counter() - started
+                return handle
+            opening = self._opening.setdefault(collection_path, threading.Lock())
+
+        # Открытие выполняется вне общей блокировки, чтобы не задерживать обращения к другим коллекциям
+        stopped = []
+        with opening:
+            with self._lock:
+                handle = self._handles.get(collection_path)
+                if handle is not None:
+                    self._handles.move_to_end(collection_path)
+                    handle.users += 1
+                    self.coalesced_loads += 1
+                    self.coalesced_seconds += time.perf_counter() - started
+            if handle is None:
+                db = self.open_collection(collection_path)
+                with self._lock:
+                    handle = _Handle(db=db, system=_systems().get(collection_path),
+                                     users=1)
+                    self._handles[collection_path] = handle
+                    stopped = self._evict()
+                    self.cold_loads += 1
+                    self.cold_seconds += time.perf_counter() - started
+
+        with self._lock:
+            self._opening.pop(collection_path, None)
+        for path, evicted in stopped:
+            self._stop(path, evicted.system)
+        return handle
+
+    def _release(self, collection_path: str, handle: _Handle) -> None:
+        with self._lock:
+            handle.users -= 1
+            stop = handle.retired and handle.users == 0
+            stopped = [] if stop else self._evict()
+        if stop:
+            self._stop(collection_path, handle.system)
+        for path, evicted in stopped:
+            self._stop(path, evicted.system)
+
+    @contextmanager
+    def acquire(self, collection_path: str) -> Iterator[Chroma]:
+        """
+        Использование открытой коллекции: пока контекст не завершён, коллекция не вытесняется и не закрывается
+
+        Args:
+            collection_path: путь к директории коллекции
+
+        Yields:
+            Chroma: объект векторной базы данных
+        """
+        handle = self._checkout(collection_path)
+        try:
+            yield handle.db
+        finally:
+            self._release(collection_path, handle)
+
+    def invalidate(self, collection_path: str) -> None:
+        """
+        Закрытие коллекции перед удалением или перезаписью её файлов
+
+        Кроме удаления из пула, из общего кэша chromadb убирается система, связанная с директорией коллекции.
+        Иначе после удаления и повторного создания директории клиент продолжит работать с удалёнными файлами.
+        Если коллекцию ещё используют запросы, система останавливается после завершения последнего из них
+
+        Args:
+            collection_path: путь к директории коллекции
+        """
+        with self._lock:
+            handle = self._handles.pop(collection_path, None)
+            stop = handle is not None and self._retire(collection_path, handle)
+            # Система, открытая в обход пула
+            orphan = None
+            if handle is None:
+                orphan = _systems().pop(collection_path, None)
+
+        if stop:
+            self._stop(collection_path, handle.system)
+        if orphan is not None:
+            orphan.stop()
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика пула
+
+        Returns:
+            dict[str, float]: количество открытых и используемых коллекций, количество и среднее время холодных,
+            тёплых и совмещённых (дождавшихся открытия другим запросом) загрузок и количество вытеснений
+        """
+        with self._lock:
+            return {
+                "open": len(self._handles),
+                "in_use": sum(1 for handle in self._handles.values() if handle.users),
+                "cold_loads": self.cold_loads,
+                "cold_avg_ms": round(1000 * self.cold_seconds / self.cold_loads, 3) if self.cold_loads else 0.0,
+                "warm_loads": self.warm_loads,
+                "warm_avg_ms": round(1000 * self.warm_seconds / self.warm_loads, 3) if self.warm_loads else 0.0,
+                "coalesced_loads": self.coalesced_loads,
+                "coalesced_avg_ms": round(1000 * self.coalesced_seconds / self.coalesced_loads, 3)
+                if self.coalesced_loads else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,205 @@
+import logging
+import re
+import threading
+from typing import Sequence
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def merge_overlapping(first: str, second: str, min_overlap: int = 64) -> str | None:
+    """
+    Склейка двух фрагментов, если один содержит другой или конец первого совпадает с началом второго
+
+    Args:
+        first: первый фрагмент
+        second: второй фрагмент
+        min_overlap: минимальная длина совпадающей части в символах
+
+    Returns:
+        str | None: склеенный текст или None, если фрагменты не перекрываются
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+
+    probe = second[:min_overlap]
+    if len(probe) < min_overlap:
+        return None
+    start = first.find(probe)
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+        start = first.find(probe, start + 1)
+    return None
+
+
+class ContextBuilder:
+    """
+    Сборка контекста для LLM из найденных фрагментов в пределах бюджета токенов
+
+    1. Перекрывающиеся фрагменты одного источника склеиваются (чанки нарезаются с перекрытием, поэтому соседние
+       чанки из top-k часто содержат один и тот же текст)
+    2. Почти дубликаты (по коэффициенту Жаккара шинглов слов) удаляются, остаётся более релевантный фрагмент
+    3. Фрагменты добавляются по убыванию релевантности, пока не исчерпан бюджет токенов; фрагмент, который не
+       помещается целиком, обрезается
+
+    Токены считаются токенизатором LLM-модели
+    """
+
+    def __init__(self, tokenizer, max_tokens: int = 4096, dedup_threshold: float = 0.8, shingle_size: int = 5,
+                 min_overlap: int = 64, min_tail_tokens: int = 64, separator: str = "\n===========\n") -> None:
+        """
+        Инициализация класса
+
+        Args:
+            tokenizer: токенизатор LLM-модели
+            max_tokens: бюджет токенов контекста по умолчанию
+            dedup_threshold: коэффициент Жаккара шинглов, начиная с которого фрагменты считаются дубликатами
+            shingle_size: количество слов в шингле
+            min_overlap: минимальная длина перекрытия фрагментов для склейки в символах
+            min_tail_tokens: минимальный остаток бюджета, ради которого последний фрагмент добавляется обрезанным
+            separator: разделитель фрагментов в контексте
+        """
+        if max_tokens < 1 or not 0 < dedup_threshold <= 1:
+            raise ValueError("Бюджет токенов должен быть положительным, а порог дубликатов — в диапазоне (0, 1]")
+
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.shingle_size = shingle_size
+        self.min_overlap = min_overlap
+        self.min_tail_tokens = min_tail_tokens
+        self.separator = separator
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self._lock = threading.Lock()
+
+    def _token_ids(self, text: str) -> list[int]:
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def _merge(self, documents: Sequence[Document]) -> list[tuple[int, Document]]:
+        """Склейка перекрывающихся фрагментов одного источника (с сохранением лучшей позиции и оценки)"""
+        passages = list(enumerate(documents))
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(passages)):
+                for j in range(i + 1, len(passages)):
+                    (rank_a, a), (rank_b, b) = passages[i], passages[j]
+                    if a.metadata.get("source") != b.metadata.get("source"):
+                        continue
+                    text = (merge_overlapping(a.page_content, b.page_content, self.min_overlap)
+                            or merge_overlapping(b.page_content, a.page_content, self.min_overlap))
+                    if text is None:
+                        continue
+
+                    metadata = {**b.metadata, **a.metadata}
+                    pages = [doc.metadata["page"] for doc in (a, b) if doc.metadata.get("page") is not None]
+                    if pages:
+                        metadata["page"] = min(pages)
+                    scores = [doc.metadata["relevance_score"] for doc in (a, b) if "relevance_score" in doc.metadata]
+                    if scores:
+                        metadata["relevance_score"] = max(scores)
+                    passages[i] = (min(rank_a, rank_b), Document(page_content=text, metadata=metadata))
+                    del passages[j]
+                    merged = True
+                    break
+                if merged:
+                    break
+        return passages
+
+    def _shingles(self, text: str) -> set[tuple[str, ...]]:
+        words = [word.lower() for word in WORD_PATTERN.findall(text)]
+        if len(words) <= self.shingle_size:
+            return {tuple(words)}
+        return {tuple(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def _deduplicate(self, documents: list[Document]) -> list[Document]:
+        """Удаление почти дубликатов: документы должны быть упорядочены по убыванию релевантности"""
+        kept, kept_shingles = [], []
+        for doc in documents:
+            shingles = self._shingles(doc.page_content)
+            if any(len(shingles & other) / len(shingles | other) >= self.dedup_threshold for other in kept_shingles):
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def _render(doc: Document, with_source: bool) -> str:
+        if with_source and doc.metadata.get("source"):
+            return f"Источник: {doc.metadata['source']}\n{doc.page_content}"
+        return doc.page_content
+
+    def build(self, documents: Sequence[Document], max_tokens: int | None = None, with_source: bool = False) -> str:
+        """
+        Сборка контекста
+
+        Args:
+            documents: найденные фрагменты (оценка релевантности берётся из metadata["relevance_score"], при её
+                отсутствии сохраняется исходный порядок)
+            max_tokens: бюджет токенов (по умолчанию — заданный при инициализации)
+            with_source: предварять каждый фрагмент строкой с его источником (metadata["source"]); строка
+                учитывается в бюджете
+
+        Returns:
+            str: контекст
+        """
+        if not documents:
+            return ""
+        max_tokens = max_tokens or self.max_tokens
+
+        passages = self._merge(documents)
+        passages.sort(key=lambda item: (-item[1].metadata.get("relevance_score", float("-inf")), item[0]))
+        passages = self._deduplicate([doc for _, doc in passages])
+
+        separator_tokens = len(self._token_ids(self.separator))
+        tokens_in = (sum(len(self._token_ids(self._render(doc, with_source))) for doc in documents)
+                     + separator_tokens * (len(documents) - 1))
+
+        parts = []
+        used = 0
+        for doc in passages:
+            text = self._render(doc, with_source)
+            ids = self._token_ids(text)
+            cost = len(ids) + (separator_tokens if parts else 0)
+            if used + cost <= max_tokens:
+                parts.append(text)
+                used += cost
+                continue
+
+            remaining = max_tokens - used - (separator_tokens if parts else 0)
+            if remaining >= self.min_tail_tokens:
+                parts.append(self.tokenizer.decode(ids[:remaining], skip_special_tokens=True))
+                used += remaining + (separator_tokens if len(parts) > 1 else 0)
+            break
+
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += used
+        logger.info("Контекст: %d фрагментов -> %d, %d -> %d токенов (сэкономлено %d)",
+                    len(documents), len(parts), tokens_in, used, tokens_in - used)
+        return self.separator.join(parts)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика сборки контекста
+
+        Returns:
+            dict[str, float]: количество собранных контекстов, токенов до и после сборки и средняя экономия токенов
+            на запрос
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "avg_tokens_saved": round((self.tokens_in - self.tokens_out) / self.requests, 1)
+                if self.requests else 0.0,
+            }
@@ -0,0 +1,196 @@
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Iterator
+from langchain_core.embeddings import Embeddings
+from ingestion import chunk_id
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Дисковый кэш эмбеддингов поверх модели эмбеддингов
+
+    Векторы хранятся в SQLite с ключом (имя модели, хеш текста чанка), поэтому кэш общий для всех коллекций и
+    переживает удаление и перезапись коллекций. При превышении max_entries вытесняются записи, к которым дольше
+    всего не обращались (LRU). Эмбеддинги запросов не кэшируются
+    """
+
+    # Ограничение SQLite на количество параметров в одном запросе
+    _SQL_BATCH = 500
+
+    def __init__(self, embeddings: Embeddings, model_name: str, path: str, max_entries: int = 1_000_000) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            embeddings: модель эмбеддингов, результаты которой кэшируются
+            model_name: имя модели эмбеддингов (часть ключа кэша)
+            path: путь к файлу базы данных кэша
+            max_entries: максимальное количество векторов в кэше
+        """
+        if max_entries < 1:
+            raise ValueError("Размер кэша должен быть положительным числом")
+
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        # Количество записей считается один раз при открытии и дальше поддерживается при вставке и вытеснении,
+        # чтобы не сканировать таблицу на каждом пакете
+        (self.entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    def _lookup(self, hashes: list[str]) -> dict[str, list[float]]:
+        """Поиск векторов в кэше с обновлением времени последнего обращения"""
+        found = {}
+        now = time.time()
+        for i in range(0, len(hashes), self._SQL_BATCH):
+            part = hashes[i:i + self._SQL_BATCH]
+            placeholders = ",".join("?" * len(part))
+            rows = self._conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [self.model_name, *part],
+            ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = array("f", blob).tolist()
+            self._conn.execute(
+                f"UPDATE embeddings SET last_access = ? WHERE model = ? AND hash IN ({placeholders})",
+                [now, self.model_name, *part],
+            )
+        return found
+
+    def _store(self, vectors: dict[str, list[float]]) -> None:
+        """Сохранение векторов в кэш с вытеснением самых старых записей"""
+        now = time.time()
+        # Вектор текста не зависит от того, кто его вычислил, поэтому уже сохранённые параллельным вызовом записи
+        # пропускаются, а rowcount даёт количество действительно добавленных
+        inserted = self._conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_access) VALUES (?, ?, ?, ?)",
+            [(self.model_name, text_hash, array("f", vector).tobytes(), now) for text_hash, vector in vectors.items()],
+        ).rowcount
+        self.entries += max(inserted, 0)
+        if self.entries > self.max_entries:
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                (self.entries - self.max_entries,),
+            ).rowcount
+            self.entries -= deleted
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Эмбеддинги документов: из кэша, а для отсутствующих в кэше — вычисленные моделью
+
+        Args:
+            texts: список текстов
+
+        Returns:
+            list[list[float]]: эмбеддинги в порядке исходных текстов
+        """
+        hashes = [chunk_id(text) for text in texts]
+        with self._lock:
+            vectors = self._lookup(list(dict.fromkeys(hashes)))
+            self._conn.commit()
+
+        missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in vectors}
+        hits = len(texts) - sum(text_hash in missing for text_hash in hashes)
+
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            vectors.update(computed)
+            with self._lock:
+                self._store(computed)
+                self._conn.commit()
+
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Эмбеддинг запроса (без кэширования)
+
+        Args:
+            text: текст запроса
+
+        Returns:
+            list[float]: эмбеддинг запроса
+        """
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика попаданий в кэш
+
+        Returns:
+            dict[str, float]: количество попаданий и промахов, доля попаданий и количество записей в кэше
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "entries": self.entries,
+            }
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """
+    Модель эмбеддингов, отдающая уже вычисленные векторы
+
+    Конвейер загрузки вычисляет эмбеддинги отдельной стадией, а запись в Chroma через публичный add_texts снова
+    вызывает функцию эмбеддингов коллекции. Внутри provide() для переданных текстов возвращаются готовые векторы
+    (только в текущем потоке), остальные тексты вычисляются исходной моделью
+    """
+
+    def __init__(self, embeddings: Embeddings) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            embeddings: исходная модель эмбеддингов
+        """
+        self.embeddings = embeddings
+        self._local = threading.local()
+
+    @contextmanager
+    def provide(self, texts: list[str], vectors: list[list[float]]) -> Iterator[None]:
+        """
+        Готовые векторы для текстов на время контекста
+
+        Args:
+            texts: тексты
+            vectors: их эмбеддинги
+        """
+        self._local.vectors = dict(zip(texts, vectors))
+        try:
+            yield
+        finally:
+            self._local.vectors = None
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        known = getattr(self._local, "vectors", None) or {}
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        if missing:
+            known = {**known, **dict(zip(missing, self.embeddings.embed_documents(missing)))}
+        return [known[text] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
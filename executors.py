@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Callable, Iterator
+from metrics import LatencyWindow
+
+_DONE = object()
+
+
+class QueueFullError(RuntimeError):
+    """Очередь исполнителя заполнена, задача отклонена без ожидания"""
+
+
+class QueueTimeoutError(RuntimeError):
+    """Задача ждала в очереди исполнителя дольше допустимого и не была выполнена"""
+
+
+class BoundedExecutor:
+    """
+    Пул потоков для одного класса ресурсов (эмбеддинги, реранкинг, LLM, сеть) с ограниченной очередью
+
+    Одновременно выполняется не больше workers задач, ещё не больше max_queue задач ждут в очереди. Задача, для
+    которой нет места, сразу отклоняется (QueueFullError), а задача, прождавшая в очереди дольше max_queue_wait,
+    снимается без выполнения (QueueTimeoutError). Так при перегрузке задержка растёт предсказуемо, а лишние
+    запросы быстро получают отказ вместо накопления
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int = 32, max_queue_wait: float | None = None) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            name: имя исполнителя (префикс имён потоков и ключ статистики)
+            workers: количество одновременно выполняемых задач
+            max_queue: максимальное количество задач, ожидающих выполнения
+            max_queue_wait: максимальное время ожидания задачи в очереди в секундах (без ограничения, если не задано)
+        """
+        if workers < 1 or max_queue < 0 or (max_queue_wait is not None and max_queue_wait <= 0):
+            raise ValueError("Количество потоков и время ожидания должны быть положительными, а размер очереди — "
+                             "неотрицательным")
+
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.queue_wait = LatencyWindow()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Интеграл количества выполняемых задач по времени для расчёта средней загрузки
+        self._busy_seconds = 0.0
+        self._changed = time.perf_counter()
+        self._started = self._changed
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def _account(self, now: float) -> None:
+        """Учёт загрузки за время с последнего изменения количества выполняемых задач (под блокировкой)"""
+        self._busy_seconds += self.active * (now - self._changed)
+        self._changed = now
+
+    def _on_done(self, future: Future) -> None:
+        """Задача, отменённая до начала выполнения, покидает очередь"""
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def _expire(self, future: Future) -> bool:
+        """
+        Снятие задачи, не начавшей выполняться за max_queue_wait
+
+        Returns:
+            bool: True, если задача ещё ждала в очереди и снята
+        """
+        if not future.cancel():
+            return False
+        with self._lock:
+            self.timed_out += 1
+        return True
+
+    def _timeout_error(self) -> QueueTimeoutError:
+        return QueueTimeoutError(f"Задача ожидала в очереди '{self.name}' дольше {self.max_queue_wait:.1f} с")
+
+    async def _wait(self, future: Future):
+        """Ожидание результата задачи; задача, не начавшая выполняться за max_queue_wait, снимается сразу"""
+        wrapped = asyncio.wrap_future(future)
+        if self.max_queue_wait is None:
+            return await wrapped
+
+        expired = False
+
+        def expire() -> None:
+            nonlocal expired
+            expired = self._expire(future)
+
+        timer = asyncio.get_running_loop().call_later(self.max_queue_wait, expire)
+        try:
+            return await wrapped
+        except asyncio.CancelledError:
+            if expired:
+                raise self._timeout_error() from None
+            raise
+        finally:
+            timer.cancel()
+
+    def _run(self, submitted: float, fn: Callable, args: tuple, kwargs: dict):
+        started = time.perf_counter()
+        waited = started - submitted
+        self.queue_wait.add(waited)
+        with self._lock:
+            self.queued -= 1
+            if self.max_queue_wait is not None and waited > self.max_queue_wait:
+                self.timed_out += 1
+                raise QueueTimeoutError(f"Задача ожидала в очереди '{self.name}' {waited:.1f} с")
+            self._account(started)
+            self.active += 1
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._account(time.perf_counter())
+                self.active -= 1
+                self.completed += 1
+
+    def saturated(self) -> bool:
+        """Заняты все потоки и заполнена очередь: новая задача будет отклонена"""
+        with self._lock:
+            return self.active + self.queued >= self.workers + self.max_queue
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Постановка задачи в очередь
+
+        Args:
+            fn: функция
+            *args: позиционные аргументы функции
+            **kwargs: именованные аргументы функции
+
+        Returns:
+            Future: результат функции; завершается с QueueTimeoutError, если задача прождала в очереди слишком долго
+
+        Raises:
+            QueueFullError: если все потоки заняты и очередь заполнена
+        """
+        with self._lock:
+            if self.active + self.queued >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"Очередь '{self.name}' заполнена")
+            self.queued += 1
+        future = self._executor.submit(self._run, time.perf_counter(), fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Синхронное выполнение функции в исполнителе (для вызова из других потоков)"""
+        future = self.submit(fn, *args, **kwargs)
+        if self.max_queue_wait is not None:
+            try:
+                return future.result(timeout=self.max_queue_wait)
+            except FutureTimeoutError:
+                if self._expire(future):
+                    raise self._timeout_error() from None
+        return future.result()
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Выполнение функции в исполнителе без блокировки цикла событий
+
+        Raises:
+            QueueFullError: если все потоки заняты и очередь заполнена
+            QueueTimeoutError: если задача не начала выполняться за max_queue_wait (ошибка возникает сразу по
+                истечении срока, а не когда освободится поток)
+        """
+        return await self._wait(self.submit(fn, *args, **kwargs))
+
+    async def iterate(self, fn: Callable[..., Iterator], *args, **kwargs) -> AsyncIterator:
+        """
+        Перебор синхронного генератора в исполнителе без блокировки цикла событий
+
+        Поток исполнителя занят, пока генератор не исчерпан. Если перебор прерван (например, клиент отключился),
+        генератор закрывается после следующего элемента
+
+        Args:
+            fn: функция, возвращающая генератор
+            *args: позиционные аргументы функции
+            **kwargs: именованные аргументы функции
+
+        Yields:
+            элементы генератора
+        """
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def produce() -> None:
+            generator = fn(*args, **kwargs)
+            try:
+                for item in generator:
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+                    if stopped.is_set():
+                        break
+            finally:
+                generator.close()
+
+        waiter = asyncio.ensure_future(self._wait(self.submit(produce)))
+        waiter.add_done_callback(lambda _: items.put_nowait(_DONE))
+        try:
+            while (item := await items.get()) is not _DONE:
+                yield item
+            await waiter
+        finally:
+            stopped.set()
+            # Задача, ещё ждущая в очереди, снимается без выполнения
+            if not waiter.done():
+                waiter.cancel()
+
+    def stats(self) -> dict:
+        """
+        Статистика исполнителя
+
+        Returns:
+            dict: количество потоков, выполняемых и ожидающих задач, текущая и средняя загрузка, количество
+            выполненных, отклонённых и снятых по времени ожидания задач и перцентили ожидания в очереди
+        """
+        with self._lock:
+            now = time.perf_counter()
+            self._account(now)
+            elapsed = now - self._started
+            return {
+                "workers": self.workers,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queue": self.max_queue,
+                "occupancy": round(self.active / self.workers, 3),
+                "avg_occupancy": round(self._busy_seconds / (elapsed * self.workers), 3) if elapsed else 0.0,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "queue_wait_ms": self.queue_wait.percentiles(),
+            }
+
+    def close(self) -> None:
+        """Остановка пула потоков после завершения поставленных задач"""
+        self._executor.shutdown(wait=True)
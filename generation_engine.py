@@ -0,0 +1,414 @@
+import inspect
+import threading
+import time
+import torch
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from transformers import DynamicCache
+from metrics import LatencyWindow
+
+
+@dataclass(frozen=True)
+class SamplingParams:
+    """Параметры генерации одной последовательности"""
+
+    max_new_tokens: int = 8192
+    do_sample: bool = False
+    temperature: float = 1.0
+    top_p: float = 1.0
+    top_k: int = 0
+    repetition_penalty: float = 1.0
+
+
+@dataclass
+class GenerationResult:
+    """Результат генерации последовательности"""
+
+    tokens: list[int]
+    # KV-кэш последовательности (покрывает все токены, кроме последнего сгенерированного)
+    past_key_values: DynamicCache | None = None
+
+
+@dataclass
+class _Sequence:
+    """Последовательность в очереди или в текущем пакете"""
+
+    input_ids: torch.Tensor
+    params: SamplingParams
+    future: Future
+    submitted_at: float
+    past_key_values: DynamicCache | None = None
+    stopping_criteria: object = None
+    logits_processor: object = None
+    streamer: object = None
+    return_cache: bool = False
+    tokens: list[int] = field(default_factory=list)
+    # Количество токенов последовательности в KV-кэше
+    length: int = 0
+    finished: bool = False
+    # Генерация отменена (например, клиент отключился): последовательность удаляется из пакета на следующем шаге
+    cancelled: bool = False
+
+    def history(self) -> torch.Tensor:
+        """Промпт и сгенерированные токены"""
+        return torch.cat([self.input_ids, torch.tensor(self.tokens, dtype=self.input_ids.dtype)])
+
+
+def _cache_layers(cache: DynamicCache) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    """Тензоры ключей и значений KV-кэша по слоям"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _build_cache(layers: list[tuple[torch.Tensor, torch.Tensor]]) -> DynamicCache:
+    """KV-кэш из тензоров ключей и значений по слоям"""
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def _pad_left(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    """Дополнение тензора нулями слева по измерению dim до длины length"""
+    pad = length - tensor.shape[dim]
+    if pad <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class GenerationEngine:
+    """
+    Движок генерации с непрерывным пакетированием (continuous batching)
+
+    Все активные последовательности декодируются одним прямым проходом модели на каждом шаге. Новая
+    последовательность проходит prefill отдельно и сразу добавляется в текущий пакет, не дожидаясь завершения
+    остальных; завершившиеся последовательности удаляются из пакета на том же шаге, освобождая место. Каждая
+    последовательность генерируется со своими параметрами сэмплирования
+
+    KV-кэши последовательностей разной длины хранятся в общем DynamicCache с выравниванием слева и маской внимания,
+    позиции токенов передаются явно. Поддерживаются модели с обычным DynamicCache (без скользящего окна)
+    """
+
+    def __init__(self, model, eos_token_ids: list[int], max_batch_size: int = 8) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            model: Загруженная LLM-модель
+            eos_token_ids: Идентификаторы токенов конца генерации
+            max_batch_size: Максимальное количество последовательностей в пакете
+        """
+        if max_batch_size < 1:
+            raise ValueError("Размер пакета должен быть положительным")
+
+        self.model = model
+        self.eos_token_ids = set(eos_token_ids)
+        self.max_batch_size = max_batch_size
+        # При prefill нужны логиты только последнего токена: не храним логиты всего промпта
+        parameters = inspect.signature(model.forward).parameters
+        self._logits_kwargs = next(({name: 1} for name in ("logits_to_keep", "num_logits_to_keep")
+                                    if name in parameters), {})
+
+        self._waiting: deque[_Sequence] = deque()
+        self._active: list[_Sequence] = []
+        self._admitting: list[_Sequence] = []
+        self._cache: DynamicCache | None = None
+        self._mask: torch.Tensor | None = None
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self.queue_wait = LatencyWindow()
+        self.completed = 0
+        self.cancelled = 0
+        self.generated_tokens = 0
+        self.decode_steps = 0
+        self.batch_rows = 0
+        self.busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._loop, name="generation-engine", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids: torch.Tensor, params: SamplingParams, past_key_values: DynamicCache | None = None,
+               stopping_criteria=None, logits_processor=None, streamer=None,
+               return_cache: bool = False) -> Future:
+        """
+        Постановка последовательности в очередь генерации
+
+        Args:
+            input_ids: Токены промпта (одномерный тензор)
+            params: Параметры сэмплирования
+            past_key_values: KV-кэш начала промпта (например, статического префикса)
+            stopping_criteria: Дополнительный критерий остановки (StoppingCriteriaList)
+            logits_processor: Обработчик логитов (LogitsProcessorList)
+            streamer: Стример, получающий токены по мере генерации
+            return_cache: Вернуть KV-кэш последовательности для продолжения генерации
+
+        Returns:
+            Future: Future с GenerationResult
+        """
+        sequence = _Sequence(
+            input_ids=input_ids.detach().reshape(-1).cpu(),
+            params=params,
+            future=Future(),
+            submitted_at=time.perf_counter(),
+            past_key_values=past_key_values,
+            stopping_criteria=stopping_criteria,
+            logits_processor=logits_processor,
+            streamer=streamer,
+            return_cache=return_cache,
+        )
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Движок генерации остановлен")
+            self._waiting.append(sequence)
+            self._condition.notify()
+        return sequence.future
+
+    def cancel(self, future: Future) -> bool:
+        """
+        Отмена генерации последовательности: ожидающая последовательность снимается с очереди, активная удаляется из
+        пакета перед следующим шагом декодирования. Future последовательности отменяется, стример завершается
+
+        Args:
+            future: Future, возвращённый submit
+
+        Returns:
+            bool: True, если последовательность ещё не была завершена
+        """
+        with self._condition:
+            for sequence in self._waiting:
+                if sequence.future is future:
+                    self._waiting.remove(sequence)
+                    sequence.cancelled = True
+                    self._finish(sequence)
+                    return True
+            for sequence in (*self._admitting, *self._active):
+                if sequence.future is future and not sequence.finished:
+                    sequence.cancelled = True
+                    return True
+        return False
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and not self._waiting and not self._active:
+                    self._condition.wait()
+                if self._closed:
+                    break
+                admitted = []
+                while self._waiting and len(self._active) + len(admitted) < self.max_batch_size:
+                    admitted.append(self._waiting.popleft())
+                # Последовательности на prefill видны cancel: отмена применяется после их добавления в пакет
+                self._admitting = admitted
+
+            started = time.perf_counter()
+            with torch.no_grad():
+                for sequence in admitted:
+                    try:
+                        self._admit(sequence)
+                    except Exception as e:
+                        self._finish(sequence, error=e)
+
+                if self._active:
+                    try:
+                        self._drop_cancelled()
+                        if self._active:
+                            self._step()
+                    except Exception as e:
+                        for sequence in self._active:
+                            self._finish(sequence, error=e)
+                        self._reset()
+
+            with self._condition:
+                self.busy_seconds += time.perf_counter() - started
+
+        error = RuntimeError("Движок генерации остановлен")
+        for sequence in list(self._waiting) + self._active:
+            self._finish(sequence, error=error)
+        self._reset()
+
+    def _admit(self, sequence: _Sequence) -> None:
+        """Prefill новой последовательности и добавление её в текущий пакет"""
+        self.queue_wait.add(time.perf_counter() - sequence.submitted_at)
+        cache = sequence.past_key_values if sequence.past_key_values is not None else DynamicCache()
+        sequence.past_key_values = None
+        cached = cache.get_seq_length()
+        if sequence.streamer is not None:
+            sequence.streamer.put(sequence.input_ids[None])
+
+        input_ids = sequence.input_ids[cached:][None].to(self.model.device)
+        output = self.model(input_ids=input_ids, past_key_values=cache, use_cache=True, **self._logits_kwargs)
+        sequence.length = sequence.input_ids.shape[0]
+        self._append(sequence, self._sample(sequence, output.logits[0, -1]))
+
+        if sequence.finished:
+            self._finish(sequence, cache=output.past_key_values)
+            return
+
+        layers = _cache_layers(output.past_key_values)
+        mask = torch.ones((1, sequence.length), dtype=torch.long, device=self.model.device)
+        if self._cache is None:
+            self._cache = _build_cache(layers)
+            self._mask = mask
+        else:
+            length = max(self._mask.shape[1], sequence.length)
+            self._cache = _build_cache([
+                (torch.cat([_pad_left(keys, length, 2), _pad_left(new_keys, length, 2)]),
+                 torch.cat([_pad_left(values, length, 2), _pad_left(new_values, length, 2)]))
+                for (keys, values), (new_keys, new_values) in zip(_cache_layers(self._cache), layers)
+            ])
+            self._mask = torch.cat([_pad_left(self._mask, length, 1), _pad_left(mask, length, 1)])
+        self._active.append(sequence)
+
+    def _step(self) -> None:
+        """Шаг декодирования всех последовательностей пакета и удаление завершившихся"""
+        device = self.model.device
+        input_ids = torch.tensor([[sequence.tokens[-1]] for sequence in self._active], device=device)
+        positions = torch.tensor([[sequence.length] for sequence in self._active], device=device)
+        mask = torch.cat([self._mask, self._mask.new_ones((len(self._active), 1))], dim=1)
+
+        output = self.model(input_ids=input_ids, attention_mask=mask, position_ids=positions,
+                            past_key_values=self._cache, use_cache=True)
+        self._cache = output.past_key_values
+        self._mask = mask
+        self.decode_steps += 1
+        self.batch_rows += len(self._active)
+
+        for row, sequence in enumerate(self._active):
+            sequence.length += 1
+            self._append(sequence, self._sample(sequence, output.logits[row, -1]))
+
+        self._evict()
+
+    def _drop_cancelled(self) -> None:
+        """Удаление отменённых последовательностей из пакета"""
+        with self._condition:
+            cancelled = [sequence for sequence in self._active if sequence.cancelled]
+        if cancelled:
+            for sequence in cancelled:
+                sequence.finished = True
+            self._evict()
+
+    def _evict(self) -> None:
+        """Удаление завершившихся последовательностей из пакета"""
+        keep = [row for row, sequence in enumerate(self._active) if not sequence.finished]
+        if len(keep) == len(self._active):
+            return
+
+        layers = _cache_layers(self._cache)
+        total = self._mask.shape[1]
+        for row, sequence in enumerate(self._active):
+            if sequence.finished:
+                cache = None
+                if sequence.return_cache:
+                    # Выравнивание слева: токены последовательности занимают последние length позиций
+                    cache = _build_cache([(keys[row:row + 1, :, total - sequence.length:].clone(),
+                                           values[row:row + 1, :, total - sequence.length:].clone())
+                                          for keys, values in layers])
+                self._finish(sequence, cache=cache)
+
+        if not keep:
+            self._reset()
+            return
+
+        index = torch.tensor(keep, device=self._mask.device)
+        mask = self._mask[index]
+        # Позиции, которые остались выравниванием у всех оставшихся последовательностей, отбрасываются
+        start = int((mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        self._cache = _build_cache([(keys[index][:, :, start:], values[index][:, :, start:])
+                                    for keys, values in layers])
+        self._mask = mask[:, start:]
+        self._active = [self._active[row] for row in keep]
+
+    def _reset(self) -> None:
+        self._active = []
+        self._cache = None
+        self._mask = None
+
+    def _sample(self, sequence: _Sequence, logits: torch.Tensor) -> int:
+        """Выбор следующего токена последовательности с её параметрами сэмплирования"""
+        params = sequence.params
+        logits = logits.float()
+
+        if params.repetition_penalty != 1.0:
+            ids = sequence.history().unique().to(logits.device)
+            scores = logits[ids]
+            logits[ids] = torch.where(scores < 0, scores * params.repetition_penalty,
+                                      scores / params.repetition_penalty)
+
+        if sequence.logits_processor is not None:
+            logits = sequence.logits_processor(sequence.history()[None], logits[None])[0]
+
+        if not params.do_sample:
+            return int(torch.argmax(logits))
+
+        logits = logits / max(params.temperature, 1e-5)
+        if params.top_k > 0:
+            kth = torch.topk(logits, min(params.top_k, logits.shape[-1])).values[-1]
+            logits[logits < kth] = float("-inf")
+        if params.top_p < 1.0:
+            sorted_logits, order = torch.sort(logits, descending=True)
+            probs = torch.softmax(sorted_logits, dim=-1)
+            # Токен отбрасывается, если вероятность более вероятных токенов уже превысила top_p
+            sorted_logits[torch.cumsum(probs, dim=-1) - probs > params.top_p] = float("-inf")
+            logits = torch.full_like(logits, float("-inf")).scatter(0, order, sorted_logits)
+        return int(torch.multinomial(torch.softmax(logits, dim=-1), 1))
+
+    def _append(self, sequence: _Sequence, token: int) -> None:
+        """Добавление токена в последовательность и проверка условий остановки"""
+        sequence.tokens.append(token)
+        self.generated_tokens += 1
+        if sequence.streamer is not None:
+            sequence.streamer.put(torch.tensor([token]))
+
+        if token in self.eos_token_ids or len(sequence.tokens) >= sequence.params.max_new_tokens:
+            sequence.finished = True
+        elif sequence.stopping_criteria is not None:
+            done = sequence.stopping_criteria(sequence.history()[None], None)
+            sequence.finished = bool(torch.as_tensor(done).all())
+
+    def _finish(self, sequence: _Sequence, cache: DynamicCache | None = None,
+                error: Exception | None = None) -> None:
+        """Передача результата или ошибки ожидающему потоку"""
+        sequence.finished = True
+        if sequence.streamer is not None:
+            sequence.streamer.end()
+        if sequence.cancelled:
+            self.cancelled += 1
+            sequence.future.cancel()
+            return
+        if error is not None:
+            sequence.future.set_exception(error)
+            return
+        self.completed += 1
+        sequence.future.set_result(GenerationResult(sequence.tokens, cache if sequence.return_cache else None))
+
+    def stats(self) -> dict:
+        """
+        Статистика движка генерации
+
+        Returns:
+            dict: длина очереди и размер текущего пакета, количество завершённых и отменённых последовательностей и
+            сгенерированных токенов, пропускная способность, средний размер пакета и перцентили ожидания в очереди
+        """
+        with self._condition:
+            return {
+                "queued": len(self._waiting),
+                "active": len(self._active),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "generated_tokens": self.generated_tokens,
+                "tokens_per_second": round(self.generated_tokens / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+                "avg_batch_size": round(self.batch_rows / self.decode_steps, 2) if self.decode_steps else 0.0,
+                "queue_wait_ms": self.queue_wait.percentiles(),
+            }
+
+    def close(self) -> None:
+        """Остановка движка: ожидающие и активные последовательности завершаются с ошибкой"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
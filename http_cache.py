@@ -0,0 +1,184 @@
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedResponse:
+    """Запись кэша HTTP-ответов"""
+
+    body: str
+    etag: str | None
+    last_modified: str | None
+    expires: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires >= time.time()
+
+    def validators(self) -> dict[str, str]:
+        """Заголовки условного запроса для повторной проверки устаревшей записи"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Дисковый кэш HTTP-ответов (ответов поискового API и извлечённого текста страниц)
+
+    Записи хранятся в SQLite по ключу (запрос или URL). Свежая запись (моложе ttl) возвращается без обращения к
+    сети; устаревшая запись с ETag или Last-Modified проверяется условным запросом и при ответе 304 продлевается.
+    При превышении max_bytes вытесняются записи, к которым дольше всего не обращались (LRU)
+    """
+
+    def __init__(self, path: str, ttl: float = 6 * 3600, max_bytes: int = 256 * 2 ** 20) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            path: путь к файлу базы данных кэша
+            ttl: время, в течение которого запись используется без проверки, в секундах
+            max_bytes: максимальный суммарный размер записей в байтах
+        """
+        if ttl <= 0 or max_bytes < 1:
+            raise ValueError("Время жизни и размер кэша должны быть положительными числами")
+
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        # Устаревшие записи, возвращённые для условного запроса, и подтверждённые ответом 304 из них
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "body TEXT NOT NULL, "
+            "etag TEXT, "
+            "last_modified TEXT, "
+            "expires REAL NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        # Количество и суммарный размер записей считаются один раз при открытии и дальше поддерживаются при вставке
+        # и удалении, чтобы не сканировать таблицу на каждой записи
+        self.entries, self.bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def get(self, key: str) -> CachedResponse | None:
+        """
+        Поиск записи
+
+        Устаревшая запись без ETag и Last-Modified удаляется: проверить её условным запросом нельзя
+
+        Args:
+            key: ключ записи
+
+        Returns:
+            CachedResponse | None: запись (возможно, устаревшая) или None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, expires, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            entry = CachedResponse(*row[:4])
+            if not entry.fresh and not entry.etag and not entry.last_modified:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.entries -= 1
+                self.bytes -= row[4]
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+            return entry
+
+    def set(self, key: str, body: str, etag: str | None = None, last_modified: str | None = None) -> None:
+        """
+        Сохранение записи с вытеснением самых давно использованных записей
+
+        Args:
+            key: ключ записи
+            body: содержимое
+            etag: значение заголовка ETag ответа
+            last_modified: значение заголовка Last-Modified ответа
+        """
+        now = time.time()
+        size = len(body.encode("utf-8"))
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, body, etag, last_modified, expires, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, etag, last_modified, now + self.ttl, size, now),
+            )
+            if replaced is None:
+                self.entries += 1
+            else:
+                self.bytes -= replaced[0]
+            self.bytes += size
+
+            if self.bytes > self.max_bytes:
+                evicted = []
+                for old_key, old_size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    if self.bytes <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    self.entries -= 1
+                    self.bytes -= old_size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self._conn.commit()
+
+    def revalidate(self, key: str) -> None:
+        """
+        Продление записи после ответа 304 Not Modified
+
+        Args:
+            key: ключ записи
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE responses SET expires = ?, last_access = ? WHERE key = ?",
+                               (now + self.ttl, now, key))
+            self._conn.commit()
+            self.revalidated += 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика кэша
+
+        Returns:
+            dict[str, float]: количество попаданий, устаревших и подтверждённых ответом 304 записей и промахов, доля
+            ответов без загрузки содержимого, количество записей и их суммарный размер
+        """
+        with self._lock:
+            total = self.hits + self.stale + self.misses
+            return {
+                "hits": self.hits,
+                "stale": self.stale,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.revalidated) / total, 4) if total else 0.0,
+                "entries": self.entries,
+                "bytes": self.bytes,
+            }
@@ -0,0 +1,355 @@
+import hashlib
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Container, Iterable
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import TextSplitter
+
+# Маркер окончания потока данных между стадиями
+_DONE = object()
+
+
+def chunk_id(text: str) -> str:
+    """
+    Идентификатор чанка по его содержимому
+
+    Args:
+        text: текст чанка
+
+    Returns:
+        str: SHA-256 от текста чанка в шестнадцатеричном виде
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class StageStats:
+    """Счётчики пропускной способности одной стадии конвейера"""
+
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Количество обработанных элементов в секунду чистого времени работы стадии"""
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "throughput": round(self.throughput, 2),
+        }
+
+
+@dataclass
+class IngestionStats:
+    """Статистика одного прогона конвейера загрузки"""
+
+    pages: StageStats = field(default_factory=lambda: StageStats("pages"))
+    split: StageStats = field(default_factory=lambda: StageStats("split"))
+    embed: StageStats = field(default_factory=lambda: StageStats("embed"))
+    upsert: StageStats = field(default_factory=lambda: StageStats("upsert"))
+    skipped: int = 0
+    wall_seconds: float = 0.0
+
+    @property
+    def stages(self) -> list[StageStats]:
+        return [self.pages, self.split, self.embed, self.upsert]
+
+    @property
+    def bottleneck(self) -> str:
+        """Название стадии, которая дольше всех была занята работой"""
+        return max(self.stages, key=lambda stage: stage.busy_seconds).name
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "stages": {stage.name: stage.as_dict() for stage in self.stages},
+            "skipped": self.skipped,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "bottleneck": self.bottleneck,
+        }
+
+
+class IncrementalSplitter:
+    """
+    Инкрементальное разбиение постраничного потока текста на чанки
+
+    Текст страниц накапливается в буфере. Как только буфер становится достаточно длинным, он разбивается сплиттером,
+    все чанки кроме последнего отдаются дальше, а последний остаётся в буфере и склеивается со следующими страницами.
+    Так в памяти находится только хвост документа, а границы чанков совпадают с разбиением цельного текста
+    с точностью до перекрытия на стыке буфера
+    """
+
+    def __init__(self, text_splitter: TextSplitter | None = None) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            text_splitter: объект для разделения текста. Если не задан, весь текст отдаётся одним чанком
+        """
+        self.text_splitter = text_splitter
+        self._buffer = ""
+        # Смещения начала страниц в буфере: (смещение, номер страницы)
+        self._boundaries: list[tuple[int, int]] = []
+        self._threshold = 2 * getattr(text_splitter, "_chunk_size", 0)
+
+    def _page_at(self, offset: int) -> int:
+        """Номер страницы, которой принадлежит символ буфера с указанным смещением"""
+        page_no = self._boundaries[0][1]
+        for start, page in self._boundaries:
+            if start > offset:
+                break
+            page_no = page
+        return page_no
+
+    def _split(self, keep_tail: bool) -> list[tuple[str, int]]:
+        chunks = self.text_splitter.split_text(self._buffer)
+        if keep_tail:
+            chunks, tail = chunks[:-1], chunks[-1:]
+        else:
+            tail = []
+
+        result = []
+        cursor = 0
+        for chunk in chunks:
+            position = self._buffer.find(chunk, cursor)
+            if position == -1:
+                position = cursor
+            result.append((chunk, self._page_at(position)))
+            cursor = position + 1
+
+        if tail:
+            tail_start = self._buffer.find(tail[0], cursor)
+            tail_start = tail_start if tail_start != -1 else cursor
+            tail_page = self._page_at(tail_start)
+            self._buffer = self._buffer[tail_start:]
+            self._boundaries = [(0, tail_page)] + [(start - tail_start, page) for start, page in self._boundaries
+                                                   if start > tail_start]
+        else:
+            self._buffer = ""
+            self._boundaries = []
+        return result
+
+    def feed(self, page_no: int, text: str) -> list[tuple[str, int]]:
+        """
+        Добавление текста страницы
+
+        Args:
+            page_no: номер страницы
+            text: текст страницы
+
+        Returns:
+            list[tuple[str, int]]: готовые чанки и номера страниц, на которых они начинаются
+        """
+        self._boundaries.append((len(self._buffer), page_no))
+        self._buffer += text
+
+        if self.text_splitter is None or len(self._buffer) < self._threshold:
+            return []
+        return self._split(keep_tail=True)
+
+    def flush(self) -> list[tuple[str, int]]:
+        """
+        Разбиение остатка буфера после последней страницы
+
+        Returns:
+            list[tuple[str, int]]: оставшиеся чанки и номера страниц, на которых они начинаются
+        """
+        if not self._buffer.strip():
+            return []
+        if self.text_splitter is None:
+            chunks = [(self._buffer, self._boundaries[0][1])]
+            self._buffer = ""
+            self._boundaries = []
+            return chunks
+        return self._split(keep_tail=False)
+
+
+class IngestionPipeline:
+    """
+    Потоковый конвейер загрузки документа в векторную базу данных
+
+    Стадии (страницы -> разбиение -> эмбеддинги микропакетами -> пакетная запись) работают в отдельных потоках и
+    связаны очередями ограниченного размера, поэтому выполняются одновременно, а объём памяти не зависит
+    от размера документа
+    """
+
+    def __init__(self, embedding_function: Embeddings, text_splitter: TextSplitter | None = None,
+                 batch_size: int = 32, queue_size: int = 4) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            embedding_function: модель эмбеддингов
+            text_splitter: объект для разделения текста
+            batch_size: количество чанков в одном микропакете эмбеддингов и записи
+            queue_size: максимальное количество элементов в очереди между стадиями
+        """
+        if batch_size < 1 or queue_size < 1:
+            raise ValueError("Размер пакета и очереди должен быть положительным числом")
+
+        self.embedding_function = embedding_function
+        self.text_splitter = text_splitter
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    @staticmethod
+    def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        """Помещает элемент в очередь, не блокируясь навсегда, если конвейер остановлен из-за ошибки"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(q: queue.Queue, stop: threading.Event) -> Any:
+        """Забирает элемент из очереди, возвращая маркер окончания, если конвейер остановлен из-за ошибки"""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _read_stage(self, pages: Iterable[tuple[int, str]], out_q: queue.Queue, stats: IngestionStats,
+                    stop: threading.Event) -> None:
+        iterator = iter(pages)
+        while True:
+            started = time.perf_counter()
+            page = next(iterator, _DONE)
+            stats.pages.busy_seconds += time.perf_counter() - started
+            if page is _DONE or not self._put(out_q, page, stop):
+                break
+            stats.pages.items += 1
+
+    def _split_stage(self, in_q: queue.Queue, known_ids: Container[str], seen_ids: dict[str, int],
+                     out_q: queue.Queue, stats: IngestionStats, stop: threading.Event) -> None:
+        splitter = IncrementalSplitter(self.text_splitter)
+        batch = []
+        while True:
+            page = self._get(in_q, stop)
+            started = time.perf_counter()
+            chunks = splitter.flush() if page is _DONE else splitter.feed(*page)
+            new_chunks = []
+            for text, page_no in chunks:
+                text_id = chunk_id(text)
+                # Чанки, которые уже есть в коллекции или повторяются в документе, не пересчитываются
+                if text_id not in seen_ids and text_id not in known_ids:
+                    new_chunks.append((text_id, text, page_no))
+                seen_ids.setdefault(text_id, page_no)
+            stats.split.busy_seconds += time.perf_counter() - started
+            stats.split.items += len(chunks)
+            stats.skipped += len(chunks) - len(new_chunks)
+
+            for chunk in new_chunks:
+                batch.append(chunk)
+                if len(batch) == self.batch_size:
+                    if not self._put(out_q, batch, stop):
+                        return
+                    batch = []
+
+            if page is _DONE:
+                break
+
+        if batch:
+            self._put(out_q, batch, stop)
+
+    def _embed_stage(self, in_q: queue.Queue, out_q: queue.Queue, stats: IngestionStats,
+                     stop: threading.Event) -> None:
+        while True:
+            batch = self._get(in_q, stop)
+            if batch is _DONE:
+                break
+            texts = [text for _, text, _ in batch]
+            started = time.perf_counter()
+            embeddings = self.embedding_function.embed_documents(texts)
+            stats.embed.busy_seconds += time.perf_counter() - started
+            stats.embed.items += len(texts)
+            if not self._put(out_q, (batch, embeddings), stop):
+                break
+
+    def run(self, pages: Iterable[tuple[int, str]],
+            sink: Callable[[list[tuple[str, str, int]], list[list[float]]], None],
+            on_progress: Callable[[IngestionStats], None] | None = None,
+            known_ids: Container[str] = frozenset(),
+            seen_ids: dict[str, int] | None = None) -> IngestionStats:
+        """
+        Запуск конвейера
+
+        Запись в базу выполняется в вызывающем потоке, остальные стадии — в фоновых потоках. Ошибка в любой
+        стадии останавливает конвейер и пробрасывается вызывающему коду.
+        Каждый чанк идентифицируется хешем содержимого: эмбеддинги вычисляются и записываются только для чанков,
+        которых нет среди known_ids
+
+        Args:
+            pages: поток пар (номер страницы, текст страницы)
+            sink: функция записи пакета: принимает чанки (идентификатор, текст, номер страницы) и их эмбеддинги
+            on_progress: функция, вызываемая после записи каждого пакета
+            known_ids: идентификаторы чанков, которые уже сохранены и не требуют пересчёта
+            seen_ids: словарь, в который записываются идентификаторы всех чанков документа и номера их страниц
+
+        Returns:
+            IngestionStats: статистика прогона по стадиям
+        """
+        stats = IngestionStats()
+        seen_ids = {} if seen_ids is None else seen_ids
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        pages_q = queue.Queue(maxsize=self.queue_size)
+        chunks_q = queue.Queue(maxsize=self.queue_size)
+        vectors_q = queue.Queue(maxsize=self.queue_size)
+
+        def guarded(stage: Callable, *args: Any, out_q: queue.Queue) -> Callable[[], None]:
+            def target() -> None:
+                try:
+                    stage(*args, out_q, stats, stop)
+                except BaseException as e:
+                    errors.append(e)
+                    stop.set()
+                finally:
+                    self._put(out_q, _DONE, stop)
+            return target
+
+        threads = [
+            threading.Thread(target=guarded(self._read_stage, pages, out_q=pages_q), daemon=True),
+            threading.Thread(target=guarded(self._split_stage, pages_q, known_ids, seen_ids, out_q=chunks_q),
+                             daemon=True),
+            threading.Thread(target=guarded(self._embed_stage, chunks_q, out_q=vectors_q), daemon=True),
+        ]
+
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self._get(vectors_q, stop)
+                if item is _DONE:
+                    break
+                batch, embeddings = item
+                started = time.perf_counter()
+                sink(batch, embeddings)
+                stats.upsert.busy_seconds += time.perf_counter() - started
+                stats.upsert.items += len(batch)
+                if on_progress:
+                    on_progress(stats)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            if errors:
+                stop.set()
+            for thread in threads:
+                thread.join()
+            stats.wall_seconds = time.perf_counter() - started_at
+
+        if errors:
+            raise errors[0]
+        return stats
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from ingestion import IngestionStats
+from metrics import peak_rss_mb
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestionJob:
+    """Состояние фоновой задачи загрузки документа"""
+
+    job_id: str
+    collection_name: str
+    filename: str
+    total_pages: int = 0
+    file_bytes: int = 0
+    sha256: str | None = None
+    status: str = "queued"
+    pages_processed: int = 0
+    chunks_embedded: int = 0
+    chunks_skipped: int = 0
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    # Пиковый RSS процесса на момент завершения задачи и его рост за время задачи (ru_maxrss общий для процесса,
+    # поэтому при параллельных задачах рост относится ко всем выполнявшимся одновременно)
+    peak_rss_mb: float | None = None
+    rss_growth_mb: float | None = None
+    # Состояние изменяется потоком загрузки и читается обработчиками запросов статуса
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    @property
+    def finished(self) -> bool:
+        """Задача завершена успешно или с ошибкой"""
+        with self._lock:
+            return self.status in ("done", "failed")
+
+    def start(self) -> None:
+        """Отметка начала выполнения задачи"""
+        with self._lock:
+            self.status = "running"
+            self.started_at = time.time()
+
+    def finish(self, error: str | None, peak_rss_mb: float, rss_growth_mb: float) -> None:
+        """
+        Отметка завершения задачи
+
+        Args:
+            error: текст ошибки (None, если задача выполнена успешно)
+            peak_rss_mb: пиковый RSS процесса в МБ
+            rss_growth_mb: рост пикового RSS за время задачи в МБ
+        """
+        with self._lock:
+            self.status = "failed" if error is not None else "done"
+            self.error = error
+            self.finished_at = time.time()
+            self.peak_rss_mb = peak_rss_mb
+            self.rss_growth_mb = rss_growth_mb
+
+    def update(self, stats: IngestionStats) -> None:
+        """
+        Обновление прогресса по статистике конвейера загрузки
+
+        Args:
+            stats: текущая статистика конвейера
+        """
+        with self._lock:
+            self.pages_processed = stats.pages.items
+            self.chunks_embedded = stats.embed.items
+            self.chunks_skipped = stats.skipped
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        Представление задачи для API
+
+        Returns:
+            dict[str, Any]: состояние задачи, прогресс, пропускная способность (страниц в секунду) и оценка
+            оставшегося времени в секундах
+        """
+        with self._lock:
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = (self.finished_at or time.time()) - self.started_at
+
+            throughput = self.pages_processed / elapsed if elapsed else 0.0
+            eta = None
+            if self.status == "running" and throughput and self.total_pages:
+                eta = round(max(self.total_pages - self.pages_processed, 0) / throughput, 1)
+            elif self.status == "done":
+                eta = 0.0
+
+            return {
+                "job_id": self.job_id,
+                "collection_name": self.collection_name,
+                "filename": self.filename,
+                "status": self.status,
+                "total_pages": self.total_pages,
+                "file_bytes": self.file_bytes,
+                "sha256": self.sha256,
+                "pages_processed": self.pages_processed,
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_skipped": self.chunks_skipped,
+                "pages_per_second": round(throughput, 2),
+                "eta_seconds": eta,
+                "elapsed_seconds": round(elapsed, 1) if elapsed is not None else None,
+                "peak_rss_mb": self.peak_rss_mb,
+                "rss_growth_mb": self.rss_growth_mb,
+                "error": self.error,
+            }
+
+
+class IngestionJobManager:
+    """
+    Менеджер фоновых задач загрузки документов
+
+    Задачи выполняются пулом потоков с ограниченным числом одновременно работающих задач.
+    Задачи одной коллекции выполняются строго последовательно, чтобы параллельная запись не повредила коллекцию
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished_jobs: int = 1000) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            max_workers: максимальное количество одновременно выполняемых задач
+            max_finished_jobs: сколько завершённых задач хранить для запросов статуса
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs: OrderedDict[str, IngestionJob] = OrderedDict()
+        self._collection_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def collection_lock(self, collection_name: str) -> threading.Lock:
+        """
+        Блокировка, сериализующая запись в коллекцию
+
+        Args:
+            collection_name: название коллекции
+
+        Returns:
+            threading.Lock: блокировка коллекции
+        """
+        with self._lock:
+            return self._collection_locks.setdefault(collection_name, threading.Lock())
+
+    def submit(self, collection_name: str, filename: str, total_pages: int,
+               task: Callable[..., Any], file_bytes: int = 0, sha256: str | None = None) -> IngestionJob:
+        """
+        Постановка задачи в очередь
+
+        Args:
+            collection_name: название коллекции
+            filename: имя загружаемого файла
+            total_pages: количество страниц для обработки (для оценки оставшегося времени)
+            task: функция загрузки, принимающая функцию обратного вызова прогресса в аргументе on_progress
+            file_bytes: размер файла в байтах
+            sha256: хеш содержимого файла
+
+        Returns:
+            IngestionJob: созданная задача
+        """
+        job = IngestionJob(job_id=uuid.uuid4().hex, collection_name=collection_name, filename=filename,
+                           total_pages=total_pages, file_bytes=file_bytes, sha256=sha256)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict_finished()
+        self._executor.submit(self._run, job, task)
+        return job
+
+    def _run(self, job: IngestionJob, task: Callable[..., Any]) -> None:
+        with self.collection_lock(job.collection_name):
+            job.start()
+            rss_before = peak_rss_mb()
+            error = None
+            try:
+                stats = task(on_progress=job.update)
+                if isinstance(stats, IngestionStats):
+                    job.update(stats)
+            except Exception as e:
+                logger.exception("Ошибка задачи загрузки %s", job.job_id)
+                error = str(e)
+            finally:
+                rss_after = peak_rss_mb()
+                job.finish(error, peak_rss_mb=round(rss_after, 1), rss_growth_mb=round(rss_after - rss_before, 1))
+
+    def _evict_finished(self) -> None:
+        """Удаление самых старых завершённых задач сверх лимита"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        """
+        Получение задачи по идентификатору
+
+        Args:
+            job_id: идентификатор задачи
+
+        Returns:
+            IngestionJob | None: задача или None, если задача не найдена
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
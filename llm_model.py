@@ -1,19 +1,100 @@
+import copy
+import logging
+import os
+import threading
+import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, GenerationConfig
+import transformers
+from dataclasses import replace
+from typing import Iterator
+from transformers import (AutoConfig, AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, DynamicCache, GenerationConfig,
+                          LogitsProcessorList, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer)
+from generation_engine import GenerationEngine, SamplingParams
+from metrics import LatencyWindow
+from tool_decoding import VERDICT_ANSWER, VERDICT_TOOL, ToolCallLogitsProcessor, ToolCallStoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def cpu_bf16_supported() -> bool:
+    """Поддержка вычислений bf16 процессором (AVX512-BF16 / AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class CancellationCriteria(StoppingCriteria):
+    """Остановка генерации по событию отмены (например, клиент потоковой генерации отключился)"""
+
+    def __init__(self, cancelled: threading.Event) -> None:
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
 
 
 class LLMModel:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, draft_model_name: str | None = None, num_assistant_tokens: int = 5,
+                 min_acceptance: float = 0.3, fallback_generations: int = 20, precision: str = "fp32",
+                 quantized_dir: str = "quantized_models"):
         """
         Инициализация класса
 
         Args:
             model_name: Название LLM модели
+            draft_model_name: Название малой черновой модели с тем же токенизатором для ассистированного
+                (спекулятивного) декодирования
+            num_assistant_tokens: Количество токенов, предлагаемых черновой моделью за один шаг проверки
+            min_acceptance: Доля принятых токенов черновой модели (скользящее среднее), ниже которой ассистированное
+                декодирование временно отключается
+            fallback_generations: Количество генераций без черновой модели после отключения, затем доля принятых
+                токенов измеряется заново
+            precision: Точность весов при работе на CPU: fp32, bf16 (если поддерживается процессором, иначе fp32) или
+                int8 (динамическая квантизация линейных слоёв); на GPU модель всегда загружается в fp16
+            quantized_dir: Директория для квантованных в int8 моделей
         """
+        if num_assistant_tokens < 1 or not 0 <= min_acceptance <= 1:
+            raise ValueError("Количество токенов черновой модели должно быть положительным, а минимальная доля "
+                             "принятых токенов — в диапазоне [0, 1]")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Неизвестная точность '{precision}', допустимые значения: {', '.join(PRECISIONS)}")
+
         self.model_name = model_name
+        self.precision = precision
+        self.quantized_dir = quantized_dir
         self.model = None
         self.tokenizer = None
         self.generation_config = None
+        self.max_new_tokens = 8192
+        # Движок непрерывного пакетирования (включается enable_continuous_batching)
+        self.engine: GenerationEngine | None = None
+        self.ttft = LatencyWindow()
+        # Статические префиксы промптов (системные промпты), для которых хранится KV-кэш
+        self._prefix_prompts: list[str] = []
+        self._prefix_caches: dict[str, tuple[torch.Tensor, DynamicCache, float]] = {}
+        self._prefix_lock = threading.Lock()
+        self.prefix_hits = 0
+        self.prefill_tokens_saved = 0
+        self.prefill_seconds_saved = 0.0
+        # Токены словаря с кавычкой для ограниченного декодирования вызова инструмента (вычисляются лениво)
+        self._quote_token_ids: torch.Tensor | None = None
+        self._quote_id: int | None = None
+        self.tool_call_verdicts = {VERDICT_TOOL: 0, VERDICT_ANSWER: 0}
+        # Ассистированное декодирование: черновая модель предлагает токены, основная проверяет их одним проходом
+        self.draft_model_name = draft_model_name
+        self.draft_model = None
+        self.num_assistant_tokens = num_assistant_tokens
+        self.min_acceptance = min_acceptance
+        self.fallback_generations = fallback_generations
+        self._assisted_lock = threading.Lock()
+        self._forward_calls = threading.local()
+        self.acceptance_ema: float | None = None
+        self.fallback_remaining = 0
+        # Скользящие средние скорости генерации (токенов/с) с черновой моделью и без неё
+        self.tokens_per_second = {"assisted": None, "plain": None}
         # self.bnb_config = BitsAndBytesConfig(
         #     load_in_4bit=True,
         #     bnb_4bit_quant_type="nf4",
@@ -35,47 +116,494 @@ class LLMModel:
 
     def load_model(self) -> None:
         if self.model is None:
+            started = time.perf_counter()
             with torch.no_grad():
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    device_map="auto",
-                    dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-                    # quantization_config=self.bnb_config
-                )
+                if torch.cuda.is_available():
+                    self.model = AutoModelForCausalLM.from_pretrained(
+                        self.model_name,
+                        device_map="auto",
+                        dtype=torch.float16
+                        # quantization_config=self.bnb_config
+                    )
+                else:
+                    self.model = self._load_cpu_model()
 
             self.model.eval()
+            logger.info("Модель %s загружена за %.1f с", self.model_name, time.perf_counter() - started)
 
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
             self.generation_config = GenerationConfig.from_pretrained(self.model_name)
 
-    def generate(self, prompt, tool_call_mode: bool = False):
+            if self.draft_model_name is not None:
+                self._load_draft_model()
+
+            self.register_prefix(self.default_system_prompt)
+
+    def _load_cpu_model(self):
+        """Загрузка модели на CPU с выбранной точностью"""
+        if self.precision == "int8":
+            return self._load_int8_model()
+
+        dtype = torch.float32
+        if self.precision == "bf16":
+            if cpu_bf16_supported():
+                dtype = torch.bfloat16
+            else:
+                logger.warning("Процессор не поддерживает bf16, модель загружается в fp32")
+        return AutoModelForCausalLM.from_pretrained(self.model_name, dtype=dtype)
+
+    def _int8_cache_path(self, config) -> str:
+        """
+        Путь к сохранённым весам квантованной модели
+
+        Формат упакованных int8 весов зависит от версий torch и transformers, а веса — от ревизии модели, поэтому
+        всё это входит в путь: после обновления библиотек или модели квантизация выполняется заново
+        """
+        key = f"torch-{torch.__version__}_transformers-{transformers.__version__}"
+        revision = getattr(config, "_commit_hash", None)
+        if revision:
+            key += f"_{revision[:12]}"
+        return os.path.join(self.quantized_dir, self.model_name.replace("/", "__"), key.replace("+", "-"),
+                            "model_int8.pt")
+
+    def _load_int8_model(self):
+        """
+        Загрузка модели с динамической квантизацией линейных слоёв в int8
+
+        На диск сохраняется только state_dict квантованной модели, поэтому квантизация с загрузкой исходных весов
+        выполняется только при первом запуске. При следующих запусках модель строится по конфигурации, квантуется
+        заново (без весов это быстро) и получает сохранённые веса; файл загружается с weights_only=True, поэтому
+        произвольный код из каталога кэша не выполняется
+        """
+        config = AutoConfig.from_pretrained(self.model_name)
+        path = self._int8_cache_path(config)
+        if os.path.exists(path):
+            model = AutoModelForCausalLM.from_config(config, dtype=torch.float32)
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.load_state_dict(torch.load(path, weights_only=True))
+            model.eval()
+            return model
+
+        model = AutoModelForCausalLM.from_pretrained(self.model_name, dtype=torch.float32)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, path)
+        return model
+
+    def _load_draft_model(self) -> None:
+        """Загрузка черновой модели и подсчёт проходов основной модели для оценки доли принятых токенов"""
+        draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_model_name)
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            raise ValueError(f"Токенизатор черновой модели {self.draft_model_name} не совпадает с токенизатором "
+                             f"модели {self.model_name}")
+
+        with torch.no_grad():
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                self.draft_model_name,
+                device_map="auto",
+                dtype=self.model.dtype
+            )
+        self.draft_model.eval()
+        self.draft_model.generation_config.num_assistant_tokens = self.num_assistant_tokens
+        self.draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+
+        def count_forward(module, args, output) -> None:
+            self._forward_calls.count = getattr(self._forward_calls, "count", 0) + 1
+
+        self.model.register_forward_hook(count_forward)
+
+    def register_prefix(self, system_prompt: str) -> None:
+        """
+        Регистрация статического системного промпта для повторного использования его KV-кэша
+
+        KV-кэш префикса вычисляется один раз при первой генерации после загрузки модели. Каждая генерация с промптом,
+        начинающимся с этого префикса, стартует с копии кэша и выполняет prefill только для контекста и вопроса
+
+        Args:
+            system_prompt: Системный промпт
+        """
+        with self._prefix_lock:
+            if system_prompt not in self._prefix_prompts:
+                self._prefix_prompts.append(system_prompt)
+
+    def _build_prefix_caches(self) -> None:
+        """Вычисление KV-кэшей зарегистрированных префиксов, для которых кэш ещё не построен"""
+        for system_prompt in self._prefix_prompts:
+            if system_prompt in self._prefix_caches:
+                continue
+
+            prefix = self.tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt}],
+                tokenize=False,
+                add_generation_prompt=False
+            )
+            prefix_ids = self._encode(prefix)["input_ids"]
+
+            started = time.perf_counter()
+            with torch.no_grad():
+                output = self.model(input_ids=prefix_ids, past_key_values=DynamicCache(), use_cache=True)
+            cache = output.past_key_values
+            self._prefix_caches[system_prompt] = (prefix_ids[0], cache, time.perf_counter() - started)
+
+    def _prefix_kwargs(self, input_ids: torch.Tensor) -> dict:
+        """
+        Подбор KV-кэша самого длинного зарегистрированного префикса, с которого начинается промпт
+
+        Args:
+            input_ids: Токены промпта
+
+        Returns:
+            dict: {"past_key_values": копия кэша префикса} или пустой словарь, если подходящего префикса нет
+        """
+        with self._prefix_lock:
+            self._build_prefix_caches()
+            candidates = list(self._prefix_caches.values())
+
+        best = None
+        for prefix_ids, cache, prefill_seconds in candidates:
+            length = len(prefix_ids)
+            # Хотя бы один токен промпта должен остаться для prefill
+            if length < input_ids.shape[1] and torch.equal(input_ids[0, :length], prefix_ids):
+                if best is None or length > len(best[0]):
+                    best = (prefix_ids, cache, prefill_seconds)
+
+        if best is None:
+            return {}
+
+        prefix_ids, cache, prefill_seconds = best
+        with self._prefix_lock:
+            self.prefix_hits += 1
+            self.prefill_tokens_saved += len(prefix_ids)
+            self.prefill_seconds_saved += prefill_seconds
+        logger.info("Переиспользован KV-кэш префикса: %d токенов, ~%.3f с prefill", len(prefix_ids), prefill_seconds)
+        return {"past_key_values": copy.deepcopy(cache)}
+
+    def stats(self) -> dict:
+        """
+        Статистика LLM-модели
+
+        Returns:
+            dict: перцентили времени до первого фрагмента потоковой генерации, экономия prefill за счёт KV-кэша
+            префиксов, статистика движка пакетирования и ассистированного декодирования
+        """
+        with self._prefix_lock:
+            prefix = {
+                "prefixes": len(self._prefix_caches),
+                "hits": self.prefix_hits,
+                "prefill_tokens_saved": self.prefill_tokens_saved,
+                "prefill_seconds_saved": round(self.prefill_seconds_saved, 3),
+            }
+        stats = {
+            "ttft_ms": self.ttft.percentiles(),
+            "prefix_cache": prefix,
+            "tool_call_verdicts": dict(self.tool_call_verdicts),
+        }
+        if self.engine is not None:
+            stats["engine"] = self.engine.stats()
+        if self.draft_model is not None:
+            with self._assisted_lock:
+                stats["assisted_decoding"] = {
+                    "draft_model": self.draft_model_name,
+                    "num_assistant_tokens": self.num_assistant_tokens,
+                    "acceptance_ema": round(self.acceptance_ema, 3) if self.acceptance_ema is not None else None,
+                    "fallback_remaining": self.fallback_remaining,
+                    "tokens_per_second": {mode: round(value, 2) if value is not None else None
+                                          for mode, value in self.tokens_per_second.items()},
+                }
+        return stats
+
+    def _use_assistant(self) -> bool:
+        """Решение, использовать ли черновую модель в очередной генерации"""
+        if self.draft_model is None:
+            return False
+        with self._assisted_lock:
+            if self.fallback_remaining > 0:
+                self.fallback_remaining -= 1
+                if self.fallback_remaining == 0:
+                    # После паузы доля принятых токенов измеряется заново
+                    self.acceptance_ema = None
+                return False
+            return True
+
+    def _record_generation(self, new_tokens: int, target_forwards: int, seconds: float, assisted: bool) -> None:
+        """
+        Учёт доли принятых токенов черновой модели и скорости генерации
+
+        Каждый проход основной модели при ассистированном декодировании принимает часть предложенных токенов и
+        добавляет ещё один свой, поэтому доля принятых = (токенов на проход - 1) / num_assistant_tokens
+        """
+        if new_tokens <= 0 or seconds <= 0:
+            return
+        speed = new_tokens / seconds
+        mode = "assisted" if assisted else "plain"
+        with self._assisted_lock:
+            previous = self.tokens_per_second[mode]
+            self.tokens_per_second[mode] = speed if previous is None else 0.8 * previous + 0.2 * speed
+            if not assisted or target_forwards <= 0:
+                return
+
+            acceptance = min(1.0, max(0.0, (new_tokens / target_forwards - 1) / self.num_assistant_tokens))
+            self.acceptance_ema = (acceptance if self.acceptance_ema is None
+                                   else 0.8 * self.acceptance_ema + 0.2 * acceptance)
+            logger.info("Ассистированное декодирование: принято %.0f%% токенов черновой модели (в среднем %.0f%%), "
+                        "%.1f токенов/с", acceptance * 100, self.acceptance_ema * 100, speed)
+            if self.acceptance_ema < self.min_acceptance:
+                self.fallback_remaining = self.fallback_generations
+                logger.warning("Доля принятых токенов черновой модели %.0f%% ниже порога %.0f%%: ассистированное "
+                               "декодирование отключено на %d генераций", self.acceptance_ema * 100,
+                               self.min_acceptance * 100, self.fallback_generations)
+
+    def _model_generate(self, **kwargs):
+        """
+        Вызов model.generate с черновой моделью (если она задана и не отключена) и учётом скорости генерации
+
+        Args:
+            **kwargs: Аргументы model.generate
+
+        Returns:
+            Результат model.generate
+        """
+        assisted = self._use_assistant()
+        if assisted:
+            kwargs["assistant_model"] = self.draft_model
+        prompt_length = kwargs["input_ids"].shape[1]
+
+        self._forward_calls.count = 0
+        started = time.perf_counter()
+        with torch.no_grad():
+            output = self.model.generate(**kwargs)
+        elapsed = time.perf_counter() - started
+
+        sequences = output.sequences if hasattr(output, "sequences") else output
+        self._record_generation(sequences.shape[1] - prompt_length, self._forward_calls.count, elapsed, assisted)
+        return output
+
+    def enable_continuous_batching(self, max_batch_size: int = 8) -> None:
+        """
+        Включение движка непрерывного пакетирования: параллельные запросы генерации декодируются одним пакетом
+
+        Черновая модель ассистированного декодирования в движке не используется
+
+        Args:
+            max_batch_size: Максимальное количество одновременно декодируемых последовательностей
+        """
+        self.load_model()
+        eos_token_id = self.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = self.tokenizer.eos_token_id
+        eos_token_ids = eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+        self.engine = GenerationEngine(self.model, eos_token_ids, max_batch_size=max_batch_size)
+
+    def _sampling_params(self, tool_call_mode: bool) -> SamplingParams:
+        """
+        Параметры сэмплирования
+
+        Args:
+            tool_call_mode: Флаг вызова инструмента: жадная генерация вместо сэмплирования
+
+        Returns:
+            SamplingParams: Параметры генерации последовательности
+        """
+        repetition_penalty = self.generation_config.repetition_penalty or 1.0
+        if tool_call_mode:
+            return SamplingParams(max_new_tokens=self.max_new_tokens, do_sample=False,
+                                  repetition_penalty=repetition_penalty)
+        return SamplingParams(max_new_tokens=self.max_new_tokens, do_sample=True, temperature=0.2, top_p=0.9,
+                              top_k=40, repetition_penalty=repetition_penalty)
+
+    def _generation_kwargs(self, tool_call_mode: bool) -> dict:
+        """
+        Параметры генерации
+
+        Args:
+            tool_call_mode: Флаг вызова инструмента: жадная генерация вместо сэмплирования
+
+        Returns:
+            dict: Аргументы для model.generate
+        """
+        params = self._sampling_params(tool_call_mode)
+        if not params.do_sample:
+            return dict(
+                generation_config=self.generation_config,
+                max_new_tokens=params.max_new_tokens,
+                do_sample=False,
+            )
+        return dict(
+            generation_config=self.generation_config,
+            max_new_tokens=params.max_new_tokens,
+            temperature=params.temperature,
+            top_p=params.top_p,
+            top_k=params.top_k,
+        )
+
+    def _encode(self, prompt: str) -> dict:
         data = self.tokenizer(prompt, return_tensors="pt", add_special_tokens=False)
         data = {k: v.to(self.model.device) for k, v in data.items()}
         data.pop("token_type_ids", None)
+        return data
 
-        with torch.no_grad():
-            if tool_call_mode:
-                output_ids = self.model.generate(
-                    **data,
-                    generation_config=self.generation_config,
-                    max_new_tokens=8192,
-                    do_sample=False,
-                )[0]
+    def generate(self, prompt, tool_call_mode: bool = False, max_new_tokens: int | None = None):
+        data = self._encode(prompt)
 
-            else:
-                output_ids = self.model.generate(
-                    **data,
-                    generation_config=self.generation_config,
-                    max_new_tokens=8192,
-                    temperature=0.2,
-                    top_p=0.9,
-                    top_k=40,
-                )[0]
+        if self.engine is not None:
+            params = self._sampling_params(tool_call_mode)
+            if max_new_tokens is not None:
+                params = replace(params, max_new_tokens=min(params.max_new_tokens, max_new_tokens))
+            result = self.engine.submit(data["input_ids"][0], params, **self._prefix_kwargs(data["input_ids"])).result()
+            return self.tokenizer.decode(result.tokens, skip_special_tokens=True).strip()
+
+        kwargs = self._generation_kwargs(tool_call_mode)
+        if max_new_tokens is not None:
+            kwargs["max_new_tokens"] = min(kwargs["max_new_tokens"], max_new_tokens)
+        output_ids = self._model_generate(**data, **kwargs, **self._prefix_kwargs(data["input_ids"]))[0]
 
         output_ids = output_ids[len(data["input_ids"][0]):]
         output = self.tokenizer.decode(output_ids, skip_special_tokens=True)
         return output.strip()
 
+    def _tool_call_logits_processor(self, prompt_length: int) -> ToolCallLogitsProcessor:
+        """Ограничитель декодирования вызова инструмента схемой web_search"""
+        if self._quote_token_ids is None:
+            tokens = self.tokenizer.convert_ids_to_tokens(list(range(len(self.tokenizer))))
+            self._quote_token_ids = torch.tensor([i for i, token in enumerate(tokens) if token and '"' in token])
+            self._quote_id = self.tokenizer.encode('"', add_special_tokens=False)[0]
+        return ToolCallLogitsProcessor(self.tokenizer, prompt_length, self._quote_token_ids, self._quote_id)
+
+    def generate_tool_call(self, prompt: str, constrained: bool = False) -> str:
+        """
+        Генерация в режиме вызова инструмента с ранней остановкой
+
+        Генерация останавливается, как только закрылся JSON-объект вызова инструмента. Если ответ начинается не с
+        `{`, модель сразу считается отвечающей без инструмента: генерация продолжается с уже вычисленного KV-кэша
+        (без повторного prefill) с параметрами сэмплирования обычного ответа
+
+        Args:
+            prompt: Промпт
+            constrained: Ограничить декодирование схемой вызова web_search, чтобы вызов всегда был корректным
+
+        Returns:
+            str: Вызов инструмента в виде JSON или ответ модели
+        """
+        data = self._encode(prompt)
+        prompt_length = data["input_ids"].shape[1]
+        criteria = ToolCallStoppingCriteria(self.tokenizer, prompt_length)
+        logits_processor = LogitsProcessorList([self._tool_call_logits_processor(prompt_length)] if constrained else [])
+
+        if self.engine is not None:
+            tokens = self._engine_tool_call(data["input_ids"], criteria, logits_processor)
+        else:
+            output = self._model_generate(**data, **self._generation_kwargs(tool_call_mode=True),
+                                          **self._prefix_kwargs(data["input_ids"]),
+                                          stopping_criteria=StoppingCriteriaList([criteria]),
+                                          logits_processor=logits_processor, return_dict_in_generate=True)
+            sequences = output.sequences
+
+            if criteria.verdict == VERDICT_ANSWER:
+                # Кэш покрывает все токены, кроме последнего сгенерированного: prefill выполняется для одного токена
+                answer_kwargs = self._generation_kwargs(tool_call_mode=False)
+                answer_kwargs["max_new_tokens"] -= sequences.shape[1] - prompt_length
+                sequences = self._model_generate(input_ids=sequences, attention_mask=torch.ones_like(sequences),
+                                                 past_key_values=output.past_key_values, **answer_kwargs)
+            tokens = sequences[0, prompt_length:]
+
+        if criteria.verdict is not None:
+            self.tool_call_verdicts[criteria.verdict] += 1
+        text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+        return text.strip()
+
+    def _engine_tool_call(self, input_ids: torch.Tensor, criteria: ToolCallStoppingCriteria,
+                          logits_processor: LogitsProcessorList) -> list[int]:
+        """Генерация в режиме вызова инструмента через движок непрерывного пакетирования"""
+        result = self.engine.submit(input_ids[0], self._sampling_params(tool_call_mode=True),
+                                    stopping_criteria=StoppingCriteriaList([criteria]),
+                                    logits_processor=logits_processor, return_cache=True,
+                                    **self._prefix_kwargs(input_ids)).result()
+        if criteria.verdict != VERDICT_ANSWER:
+            return result.tokens
+
+        params = self._sampling_params(tool_call_mode=False)
+        params = replace(params, max_new_tokens=params.max_new_tokens - len(result.tokens))
+        continuation = torch.cat([input_ids[0].cpu(), torch.tensor(result.tokens, dtype=input_ids.dtype)])
+        answer = self.engine.submit(continuation, params, past_key_values=result.past_key_values).result()
+        return result.tokens + answer.tokens
+
+    def generate_stream(self, prompt: str, tool_call_mode: bool = False) -> Iterator[str]:
+        """
+        Потоковая генерация: фрагменты текста отдаются по мере декодирования токенов
+
+        Генерация выполняется в отдельном потоке, время до первого фрагмента учитывается в метрике ttft. В режиме
+        вызова инструмента генерация останавливается сразу после закрытия JSON-объекта вызова. Если генератор
+        закрыт досрочно (клиент отключился), генерация прекращается на следующем токене
+
+        Args:
+            prompt: Промпт
+            tool_call_mode: Флаг вызова инструмента: жадная генерация вместо сэмплирования
+
+        Yields:
+            str: Очередной фрагмент ответа
+        """
+        started = time.perf_counter()
+        data = self._encode(prompt)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        kwargs = self._prefix_kwargs(data["input_ids"])
+        stopping_criteria = StoppingCriteriaList()
+        if tool_call_mode:
+            # Вызов инструмента обрывается сразу после закрытия JSON-объекта, обычный ответ генерируется полностью
+            stopping_criteria.append(ToolCallStoppingCriteria(self.tokenizer, data["input_ids"].shape[1],
+                                                              stop_on_answer=False))
+        cancelled = threading.Event()
+        if self.engine is None:
+            # Движок отменяет последовательность сам (engine.cancel)
+            stopping_criteria.append(CancellationCriteria(cancelled))
+        if stopping_criteria:
+            kwargs["stopping_criteria"] = stopping_criteria
+        errors = []
+
+        def target() -> None:
+            try:
+                self._model_generate(**data, **self._generation_kwargs(tool_call_mode), **kwargs, streamer=streamer)
+            except Exception as e:
+                errors.append(e)
+                # Завершаем итерацию стримера, иначе потребитель будет ждать бесконечно
+                streamer.end()
+
+        if self.engine is not None:
+            # Движок сам завершает стример, в том числе при ошибке
+            future = self.engine.submit(data["input_ids"][0], self._sampling_params(tool_call_mode),
+                                        streamer=streamer, **kwargs)
+        else:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+
+        try:
+            first = True
+            for text in streamer:
+                if not text:
+                    continue
+                if first:
+                    self.ttft.add(time.perf_counter() - started)
+                    first = False
+                yield text
+
+            if self.engine is not None:
+                future.result()
+                return
+            thread.join()
+            if errors:
+                raise errors[0]
+        finally:
+            # Без отмены генерация продолжалась бы до max_new_tokens вне ограничения параллельности llm_executor
+            cancelled.set()
+            if self.engine is not None:
+                if not future.done():
+                    self.engine.cancel(future)
+            else:
+                # Поток генерации завершается на следующем токене: слот исполнителя освобождается после остановки
+                thread.join()
+
     def answer_question(self, query, context):
         content = ('Используй только следующий контекст, чтобы ответить на вопрос в конце. Не пытайся выдумывать ответ.'
                    + f"\nКонтекст:\n===========\n{context}Вопрос:\n===========\n{query}")
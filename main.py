@@ -1,15 +1,33 @@
+import hashlib
+import json
 import os
+import threading
+import time
+import uuid
 import aiofiles
 import uvicorn
 from agent import Agent
+from context_builder import ContextBuilder
+from executors import BoundedExecutor, QueueFullError, QueueTimeoutError
 from dataclasses import dataclass
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from functools import partial
 from pathlib import Path
+from typing import AsyncIterator, Iterator
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pdf_to_db import PDFVecDataBase
 from dotenv import load_dotenv
 from reranker import Rerank
 from llm_model import LLMModel
+from jobs import IngestionJobManager
+from router import RetrievalRouter
+from query_cache import MISSING, QueryCache, SemanticAnswerCache
+from metrics import LatencyWindow, peak_rss_mb
+from searcher import get_extraction_pool, get_fetch_engine, get_http_cache
+from web_passages import WebPassageRanker
 
 # Загружаем переменные из .env файла
 load_dotenv()
@@ -18,18 +36,70 @@ load_dotenv()
 EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL')
 RERANK_MODEL = os.getenv('RERANK_MODEL')
 LLM_MODEL = os.getenv('LLM_MODEL')
+LLM_DRAFT_MODEL = os.getenv('LLM_DRAFT_MODEL')
+LLM_ASSISTANT_TOKENS = int(os.getenv('LLM_ASSISTANT_TOKENS', 5))
+LLM_PRECISION = os.getenv('LLM_PRECISION', 'fp32')
 PATH_DB = os.getenv('PATH_DB')
 UPLOAD_DIR = os.getenv('UPLOAD_DIR')
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 1024 * 2 ** 20))
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 2 ** 20))
+UPLOAD_HASH = os.getenv('UPLOAD_HASH', '1') == '1'
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', os.cpu_count() or 1))
+EMBEDDINGS_CACHE_PATH = os.getenv('EMBEDDINGS_CACHE_PATH')
+EMBEDDINGS_BACKEND = os.getenv('EMBEDDINGS_BACKEND', 'torch')
+INGEST_JOBS_WORKERS = int(os.getenv('INGEST_JOBS_WORKERS', 2))
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', 600))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9))
+RERANK_MAX_LENGTH = int(os.getenv('RERANK_MAX_LENGTH', 512))
+RERANK_TRUNCATION = os.getenv('RERANK_TRUNCATION', 'head')
+RERANK_BATCH_WINDOW_MS = float(os.getenv('RERANK_BATCH_WINDOW_MS', 5))
+RERANK_MAX_BATCH_PAIRS = int(os.getenv('RERANK_MAX_BATCH_PAIRS', 64))
+TOOL_CALL_CONSTRAINED = os.getenv('TOOL_CALL_CONSTRAINED', '0') == '1'
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', 0))
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 4096))
+WEB_CONTEXT_MAX_TOKENS = int(os.getenv('WEB_CONTEXT_MAX_TOKENS', CONTEXT_MAX_TOKENS))
+WEB_PASSAGE_CANDIDATES = int(os.getenv('WEB_PASSAGE_CANDIDATES', 20))
+WEB_PROMPT_STATS = os.getenv('WEB_PROMPT_STATS', '0') == '1'
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', 2))
+# При включённом пакетировании реранкинга поток занят ожиданием пакета, поэтому потоков должно хватать, чтобы
+# параллельные запросы (по 10 документов) заполняли пакет RerankBatcher целиком
+RERANK_WORKERS = int(os.getenv('RERANK_WORKERS', max(RERANK_MAX_BATCH_PAIRS // 10, 2) if RERANK_BATCH_WINDOW_MS > 0
+                               else 2))
+LLM_WORKERS = int(os.getenv('LLM_WORKERS', max(LLM_BATCH_SIZE, 1)))
+NETWORK_WORKERS = int(os.getenv('NETWORK_WORKERS', 8))
+EXECUTOR_MAX_QUEUE = int(os.getenv('EXECUTOR_MAX_QUEUE', 32))
+EXECUTOR_QUEUE_TIMEOUT = float(os.getenv('EXECUTOR_QUEUE_TIMEOUT', 30))
 
 pdf_db = PDFVecDataBase(embeddings_model=EMBEDDINGS_MODEL,
-                        path_db=PATH_DB)
+                        path_db=PATH_DB,
+                        extract_workers=EXTRACT_WORKERS,
+                        embedding_cache_path=EMBEDDINGS_CACHE_PATH,
+                        embeddings_backend=EMBEDDINGS_BACKEND)
 
-reranker = Rerank(RERANK_MODEL, top_n=5)
+reranker = Rerank(RERANK_MODEL, top_n=5, max_length=RERANK_MAX_LENGTH, truncation=RERANK_TRUNCATION)
+if RERANK_BATCH_WINDOW_MS > 0:
+    reranker.enable_batching(window_ms=RERANK_BATCH_WINDOW_MS, max_batch_pairs=RERANK_MAX_BATCH_PAIRS)
 
-llm_model = LLMModel(LLM_MODEL)
+llm_model = LLMModel(LLM_MODEL, draft_model_name=LLM_DRAFT_MODEL, num_assistant_tokens=LLM_ASSISTANT_TOKENS,
+                     precision=LLM_PRECISION)
 llm_model.load_model()
+if LLM_BATCH_SIZE > 0:
+    llm_model.enable_continuous_batching(max_batch_size=LLM_BATCH_SIZE)
 
-agent = Agent(llm=llm_model)
+context_builder = ContextBuilder(llm_model.tokenizer, max_tokens=CONTEXT_MAX_TOKENS)
+
+# Блокирующая работа выполняется в отдельных пулах по классам ресурсов: перегрузка одного ресурса не останавливает
+# цикл событий и обработку запросов, которым этот ресурс не нужен
+embedding_executor = BoundedExecutor("embedding", EMBEDDING_WORKERS, EXECUTOR_MAX_QUEUE, EXECUTOR_QUEUE_TIMEOUT)
+rerank_executor = BoundedExecutor("rerank", RERANK_WORKERS, EXECUTOR_MAX_QUEUE, EXECUTOR_QUEUE_TIMEOUT)
+llm_executor = BoundedExecutor("llm", LLM_WORKERS, EXECUTOR_MAX_QUEUE, EXECUTOR_QUEUE_TIMEOUT)
+network_executor = BoundedExecutor("network", NETWORK_WORKERS, EXECUTOR_MAX_QUEUE, EXECUTOR_QUEUE_TIMEOUT)
+web_ranker = WebPassageRanker(pdf_db.embedding_model, reranker, candidates=WEB_PASSAGE_CANDIDATES)
+
+agent = Agent(llm=llm_model, router=RetrievalRouter(), constrained_tool_calls=TOOL_CALL_CONSTRAINED,
+              context_builder=context_builder, web_max_tokens=WEB_CONTEXT_MAX_TOKENS, web_ranker=web_ranker,
+              network_executor=network_executor, web_prompt_stats=WEB_PROMPT_STATS)
 
 splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=1500,
                                           separators=["\n\n", "\n", ",", " ", ""])
@@ -37,6 +107,15 @@ splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=1500,
 upload_dir = Path(UPLOAD_DIR)
 upload_dir.mkdir(exist_ok=True)
 
+ingestion_jobs = IngestionJobManager(max_workers=INGEST_JOBS_WORKERS)
+
+query_cache = QueryCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+# Время от получения потокового запроса до первого фрагмента ответа
+request_ttft = LatencyWindow()
+
+semantic_cache = SemanticAnswerCache(threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=QUERY_CACHE_SIZE,
+                                     ttl=QUERY_CACHE_TTL)
+
 app = FastAPI()
 
 
@@ -44,6 +123,7 @@ app = FastAPI()
 class UserRequest:
     collection_name: str
     question: str
+    use_cache: bool = True
 
 
 @dataclass
@@ -51,12 +131,102 @@ class UserResponse:
     answer: str
 
 
+@dataclass
+class QuestionState:
+    """Промежуточное состояние обработки вопроса, общее для обычного и потокового ответа"""
+
+    key: tuple[str, int, str]
+    version: int
+    embedding: list[float] | None = None
+    answer: str | None = None
+
+
+# Количество задач загрузки, использующих сохранённый файл: файл удаляется, когда завершится последняя из них
+_upload_users: dict[Path, int] = {}
+_upload_users_lock = threading.Lock()
+
+
+def _release_upload(file_path: Path) -> None:
+    """Освобождение сохранённого файла задачей загрузки (файл удаляется, если он больше никому не нужен)"""
+    with _upload_users_lock:
+        users = _upload_users.pop(file_path) - 1
+        if users:
+            _upload_users[file_path] = users
+        else:
+            file_path.unlink(missing_ok=True)
+
+
+def _ingest_upload(file_path: Path, **kwargs):
+    """Загрузка сохранённого файла в коллекцию (выполняется в задаче загрузки) с последующим освобождением файла"""
+    try:
+        return pdf_db.add_pdf_to_db(file_path=str(file_path), **kwargs)
+    finally:
+        _release_upload(file_path)
+
+
+async def _save_upload(file: UploadFile) -> tuple[Path, int, str | None]:
+    """
+    Потоковое сохранение загружаемого файла на диск
+
+    Файл читается блоками UPLOAD_CHUNK_SIZE, поэтому в памяти одновременно находится не больше одного блока. Каждая
+    загрузка получает собственный путь <имя>.<SHA-256>.pdf (или <имя>.<uuid>.pdf без хеширования): задачи загрузки
+    читают страницы по пути файла, поэтому повторная загрузка файла с тем же именем не должна подменять файл, который
+    обрабатывает другая задача. Файл с тем же содержимым не перезаписывается, а используется совместно.
+    Файл нужен только на время загрузки: вызывающий обязан освободить его через _release_upload, после чего файл,
+    не используемый другими задачами, удаляется
+
+    Args:
+        file: загружаемый файл
+
+    Returns:
+        tuple[Path, int, str | None]: путь к сохранённому файлу, размер файла в байтах и SHA-256 содержимого (None,
+        если UPLOAD_HASH отключён)
+
+    Raises:
+        HTTPException: 413, если файл больше UPLOAD_MAX_BYTES
+    """
+    stem = Path(file.filename).stem
+    upload_id = uuid.uuid4().hex
+    tmp_path = upload_dir / f".{stem}.{upload_id}.part"
+    digest = hashlib.sha256() if UPLOAD_HASH else None
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413,
+                                        detail=f"Файл {file.filename} больше {UPLOAD_MAX_BYTES} байт")
+                if digest is not None:
+                    digest.update(chunk)
+                await buffer.write(chunk)
+
+        file_hash = digest.hexdigest() if digest is not None else None
+        file_path = upload_dir / f"{stem}.{file_hash or upload_id}.pdf"
+        with _upload_users_lock:
+            if not file_path.exists():
+                os.replace(tmp_path, file_path)
+            _upload_users[file_path] = _upload_users.get(file_path, 0) + 1
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return file_path, size, file_hash
+
+
 @app.post("/add_pdf_to_db")
 async def add_pdf_to_db(collection_name: str = Form(..., description="Название коллекции"),
                         start_page: int = Form(1, description="Страница, с которой начать обработку (по умолчанию 1)"),
                         overwrite: bool = Form(False,
                                                description="Перезаписать коллекцию если существует (по умолчанию False)"),
-                        file: UploadFile = File(..., description="PDF файл для загрузки")) -> dict[str, str]:
+                        file: UploadFile = File(..., description="PDF файл для загрузки")) -> dict:
+    """
+    Загрузка PDF файла в коллекцию
+
+    Ответ асинхронный: файл сохраняется на диск, а извлечение текста и вычисление эмбеддингов выполняются в фоновой
+    задаче. Ответ содержит job_id и status "queued"; ход и результат загрузки возвращает GET /jobs/{job_id}
+    (status "running", "done" или "failed", прогресс по страницам и чанкам, текст ошибки)
+    """
     if not file:
         raise HTTPException(status_code=400, detail="Файл не передан")
 
@@ -66,41 +236,61 @@ async def add_pdf_to_db(collection_name: str = Form(..., description="Назва
     if not filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail=f"Файл {filename} не имеет расширения .pdf")
 
-    file_path = upload_dir / filename
-
-    # Асинхронное сохранение файла
+    # Асинхронное потоковое сохранение файла
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
     try:
-        async with aiofiles.open(file_path, 'wb') as buffer:
-            content = await file.read()
-            await buffer.write(content)
+        file_path, file_bytes, file_hash = await _save_upload(file)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Файл {filename} не загружен: {e}")
 
     try:
-        pdf_db.add_pdf_to_db(file_path=str(file_path), collection_name=collection_name, text_splitter=splitter,
-                             start_page=start_page, overwrite=overwrite)
+        total_pages = max(await run_in_threadpool(pdf_db.page_count, str(file_path)) - start_page, 0)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Ошибка на этапе извлечения текста из PDF файла и добавления в "
-                                                    f"векторную базу данных: {e}")
-
-    if overwrite:
-        return {
-            "message": f"Коллекция '{collection_name}' перезаписана. Файл {filename} загружен в коллекцию",
-            "collection_name": collection_name,
-            "filename": filename,
-            "status": "success",
-            "action": "overwritten"
-        }
+        _release_upload(file_path)
+        raise HTTPException(status_code=400, detail=f"Файл {filename} не является корректным PDF файлом: {e}")
+
+    upload_seconds = time.perf_counter() - started
+    rss_after = peak_rss_mb()
+
+    # Извлечение текста и вычисление эмбеддингов выполняются в фоновой задаче, PDF открывается прямо из файла
+    job = ingestion_jobs.submit(
+        collection_name=collection_name,
+        filename=filename,
+        total_pages=total_pages,
+        task=partial(_ingest_upload, file_path, collection_name=collection_name, text_splitter=splitter,
+                     start_page=start_page, overwrite=overwrite, file_hash=file_hash, source=filename),
+        file_bytes=file_bytes,
+        sha256=file_hash,
+    )
+
     return {
-        "message": f"Файл {filename} загружен в коллекцию '{collection_name}'",
+        "message": f"Файл {filename} поставлен в очередь на загрузку в коллекцию '{collection_name}'",
         "collection_name": collection_name,
         "filename": filename,
-        "status": "success",
-        "action": "added"
+        "job_id": job.job_id,
+        "status": job.as_dict()["status"],
+        "action": "overwrite" if overwrite else "add",
+        "file_bytes": file_bytes,
+        "sha256": file_hash,
+        "upload_seconds": round(upload_seconds, 3),
+        "upload_peak_rss_mb": round(rss_after, 1),
+        "upload_rss_growth_mb": round(rss_after - rss_before, 1),
     }
 
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> dict:
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача '{job_id}' не найдена")
+
+    return job.as_dict()
+
+
 @app.get("/get_existing_collections")
 async def get_existing_collections() -> dict[str, list[str]]:
     existing_collections = pdf_db.list_collection()
@@ -110,10 +300,34 @@ async def get_existing_collections() -> dict[str, list[str]]:
     }
 
 
+@app.get("/stats")
+async def get_stats() -> dict[str, dict]:
+    return {
+        "vector_db": pdf_db.stats(),
+        "reranker": reranker.stats(),
+        "agent": agent.stats(),
+        "llm": {**llm_model.stats(), "request_ttft_ms": request_ttft.percentiles()},
+        "context": context_builder.stats(),
+        "web_fetch": get_fetch_engine().stats(),
+        "web_extract": get_extraction_pool().stats(),
+        "web_cache": web_cache.stats() if (web_cache := get_http_cache()) is not None else {},
+        "query_cache": query_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "executors": {executor.name: executor.stats()
+                      for executor in (embedding_executor, rerank_executor, llm_executor, network_executor)},
+    }
+
+
+def _delete_collection_locked(collection_name: str) -> None:
+    with ingestion_jobs.collection_lock(collection_name):
+        pdf_db.delete_collection(collection_name=collection_name)
+
+
 @app.post("/delete_collection")
 async def delete_collection(collection_name: str = Form(..., description="Название коллекции")) -> dict[str, str]:
     try:
-        pdf_db.delete_collection(collection_name=collection_name)
+        # Удаление ждёт завершения задач загрузки в эту коллекцию
+        await run_in_threadpool(_delete_collection_locked, collection_name)
     except Exception as e:
         raise HTTPException(status_code=400,
                             detail=f"Ошибка удаления коллекции '{collection_name}' из векторной базы данных: {e}")
@@ -125,34 +339,212 @@ async def delete_collection(collection_name: str = Form(..., description="Наз
     }
 
 
+def _validate_request(data: UserRequest) -> None:
+    """
+    Проверка запроса на ответ
+
+    Args:
+        data: запрос пользователя
+
+    Raises:
+        HTTPException: если не указаны коллекция или вопрос, либо коллекции не существует
+    """
+    if not data.collection_name:
+        raise HTTPException(status_code=422, detail="Отсутствует название коллекции")
+    if not data.question:
+        raise HTTPException(status_code=422, detail="Отсутствует вопрос")
+
+    existing_collections = pdf_db.list_collection()
+    if data.collection_name not in existing_collections:
+        raise HTTPException(status_code=400, detail=f"Отсутствует коллекция с названием '{data.collection_name}'")
+
+
+def _overloaded(error: Exception) -> HTTPException:
+    """
+    Ответ на отказ исполнителя
+
+    Args:
+        error: QueueFullError или QueueTimeoutError
+
+    Returns:
+        HTTPException: 429, если очередь заполнена, и 503, если задача не дождалась выполнения
+    """
+    if isinstance(error, QueueFullError):
+        return HTTPException(status_code=429, detail=f"Сервис перегружен: {error}", headers={"Retry-After": "1"})
+    return HTTPException(status_code=503, detail=f"Сервис перегружен: {error}", headers={"Retry-After": "5"})
+
+
+async def _lookup_answer(data: UserRequest) -> QuestionState:
+    """
+    Поиск готового ответа в кэшах (точное совпадение вопроса, затем смысловая близость)
+
+    Args:
+        data: запрос пользователя
+
+    Returns:
+        QuestionState: ключи кэша, эмбеддинг вопроса и найденный ответ (если он есть)
+    """
+    # Версия коллекции в ключе гарантирует, что после изменения коллекции кэш не вернёт устаревший результат
+    version = pdf_db.collection_version(data.collection_name)
+    state = QuestionState(key=query_cache.key(data.collection_name, version, data.question), version=version)
+
+    # Флаг use_cache отключает только чтение готовых ответов, свежий ответ всё равно сохраняется
+    if data.use_cache:
+        answer = query_cache.answer.get(state.key)
+        if answer is not MISSING:
+            state.answer = answer
+            return state
+
+    embedding = query_cache.embedding.get(data.question)
+    if embedding is MISSING:
+        embedding = await embedding_executor.run(pdf_db.embed_query, data.question)
+        query_cache.embedding.set(data.question, embedding)
+    state.embedding = embedding
+
+    if data.use_cache:
+        answer = semantic_cache.get(data.collection_name, version, embedding)
+        if answer is not MISSING:
+            state.answer = answer
+    return state
+
+
+async def _retrieve(data: UserRequest, state: QuestionState) -> list[Document]:
+    """
+    Векторный поиск по коллекции
+
+    Args:
+        data: запрос пользователя
+        state: состояние обработки вопроса
+
+    Returns:
+        list[Document]: найденные документы
+    """
+    collection_documents = query_cache.retrieval.get(state.key)
+    if collection_documents is MISSING:
+        collection_documents = await embedding_executor.run(pdf_db.search_by_vector,
+                                                            collection_name=data.collection_name,
+                                                            embedding=state.embedding, k=10)
+        query_cache.retrieval.set(state.key, collection_documents)
+    return collection_documents
+
+
+async def _rerank(data: UserRequest, state: QuestionState, documents: list[Document]) -> list[Document]:
+    """
+    Повторное ранжирование найденных документов
+
+    Args:
+        data: запрос пользователя
+        state: состояние обработки вопроса
+        documents: найденные документы
+
+    Returns:
+        list[Document]: наиболее релевантные документы
+    """
+    second_docs = await rerank_executor.run(reranker.compress_documents, query=data.question, documents=documents)
+    query_cache.rerank.set(state.key, second_docs)
+    return second_docs
+
+
+def _build_context(documents: list[Document]) -> str:
+    return context_builder.build(documents)
+
+
+def _answer(data: UserRequest, documents: list[Document]) -> str:
+    return agent.run(query=data.question, context=_build_context(documents), documents=documents)
+
+
+def _answer_stream(data: UserRequest, documents: list[Document]) -> Iterator[tuple[str, str]]:
+    yield from agent.run_stream(query=data.question, context=_build_context(documents), documents=documents)
+
+
+def _store_answer(data: UserRequest, state: QuestionState, answer: str) -> None:
+    query_cache.answer.set(state.key, answer)
+    semantic_cache.set(data.collection_name, state.version, state.embedding, answer)
+
+
 @app.post("/question")
 async def answers_questions(data: UserRequest) -> UserResponse:
     try:
-        collection_name = data.collection_name
-        question = data.question
+        _validate_request(data)
 
-        if not collection_name:
-            raise HTTPException(status_code=422, detail="Отсутствует название коллекции")
-        if not question:
-            raise HTTPException(status_code=422, detail="Отсутствует вопрос")
+        state = await _lookup_answer(data)
+        if state.answer is not None:
+            return UserResponse(answer=state.answer)
 
-        existing_collections = pdf_db.list_collection()
-        if collection_name not in existing_collections:
-            raise HTTPException(status_code=400, detail=f"Отсутствует коллекция с названием '{collection_name}'")
+        second_docs = query_cache.rerank.get(state.key)
+        if second_docs is MISSING:
+            second_docs = await _rerank(data, state, await _retrieve(data, state))
 
-        collection_documents = pdf_db.load_collection(collection_name=collection_name).invoke(question)
+        # Генерация выполняется вне цикла событий, чтобы параллельные запросы попадали в общий пакет движка
+        answer = await llm_executor.run(_answer, data, second_docs)
+        _store_answer(data, state, answer)
 
-        second_docs = reranker.compress_documents(query=question, documents=collection_documents)
+        return UserResponse(answer=answer)
 
-        separator = "\n===========\n"
-        context = separator.join(doc.page_content for doc in second_docs)
+    except (QueueFullError, QueueTimeoutError) as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка выполнения запроса: {e}")
 
-        answer = agent.run(query=question, context=context)
 
-        return UserResponse(answer=answer)
+def _sse(event: str, data) -> str:
+    """Форматирование события server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_answer(data: UserRequest) -> AsyncIterator[str]:
+    """
+    Генератор событий потокового ответа
+
+    Блокирующие этапы выполняются в исполнителях соответствующих ресурсов и не останавливают цикл событий
+
+    Args:
+        data: запрос пользователя
+
+    Yields:
+        str: события "status" (этап обработки), "token" (фрагмент ответа), "done" (время до первого фрагмента)
+        и "error"
+    """
+    started = time.perf_counter()
+    ttft = None
+    try:
+        state = await _lookup_answer(data)
+        if state.answer is not None:
+            yield _sse("token", state.answer)
+            yield _sse("done", {"cached": True, "ttft_ms": round((time.perf_counter() - started) * 1000, 1)})
+            return
+
+        second_docs = query_cache.rerank.get(state.key)
+        if second_docs is MISSING:
+            yield _sse("status", "retrieval")
+            documents = await _retrieve(data, state)
+            yield _sse("status", "rerank")
+            second_docs = await _rerank(data, state, documents)
+
+        parts = []
+        async for event, value in llm_executor.iterate(_answer_stream, data, second_docs):
+            if event == "token":
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    request_ttft.add(ttft)
+                parts.append(value)
+            yield _sse(event, value)
+
+        _store_answer(data, state, "".join(parts).strip())
+        yield _sse("done", {"cached": False, "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None})
 
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Ошибка выполнения запроса: {e}")
+        yield _sse("error", f"Ошибка выполнения запроса: {e}")
+
+
+@app.post("/question/stream")
+async def answers_questions_stream(data: UserRequest) -> StreamingResponse:
+    _validate_request(data)
+    # После начала потока код ответа изменить нельзя, поэтому при заполненных очередях запрос отклоняется сразу
+    for executor in (embedding_executor, rerank_executor, llm_executor):
+        if executor.saturated():
+            raise _overloaded(QueueFullError(f"Очередь '{executor.name}' заполнена"))
+    return StreamingResponse(_stream_answer(data), media_type="text/event-stream")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+import json
+import os
+
+
+class CollectionManifest:
+    """
+    Манифест коллекции: какие чанки (по хешу содержимого) получены из каких файлов и страниц
+
+    Хранится в JSON файле рядом с данными Chroma в директории коллекции
+    """
+
+    FILE_NAME = "manifest.json"
+
+    def __init__(self, collection_path: str) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            collection_path: путь к директории коллекции
+        """
+        self.path = os.path.join(collection_path, self.FILE_NAME)
+        # Имя файла -> {идентификатор чанка: номер страницы}
+        self.files: dict[str, dict[str, int]] = {}
+        # Имя файла -> {"sha256": хеш содержимого файла, "start_page": страница, с которой он загружен}
+        self.hashes: dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, collection_path: str) -> "CollectionManifest":
+        """
+        Загрузка манифеста коллекции
+
+        Args:
+            collection_path: путь к директории коллекции
+
+        Returns:
+            CollectionManifest: манифест (пустой, если файла манифеста нет)
+        """
+        manifest = cls(collection_path)
+        if os.path.exists(manifest.path):
+            with open(manifest.path, encoding="utf-8") as f:
+                data = json.load(f)
+            manifest.files = data.get("files", {})
+            manifest.hashes = data.get("hashes", {})
+        return manifest
+
+    def save(self) -> None:
+        """Атомарное сохранение манифеста на диск"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "hashes": self.hashes}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def referenced_ids(self, exclude: str | None = None) -> set[str]:
+        """
+        Идентификаторы чанков, на которые ссылаются файлы коллекции
+
+        Args:
+            exclude: имя файла, ссылки которого не учитываются
+
+        Returns:
+            set[str]: множество идентификаторов чанков
+        """
+        return {text_id for source, ids in self.files.items() if source != exclude for text_id in ids}
+
+    def is_unchanged(self, source: str, file_hash: str, start_page: int) -> bool:
+        """
+        Проверка, что файл с тем же содержимым уже загружен в коллекцию с той же страницы
+
+        Args:
+            source: имя файла
+            file_hash: SHA-256 содержимого файла
+            start_page: номер страницы, с которой начинается загрузка
+
+        Returns:
+            bool: True, если повторная загрузка ничего не изменит
+        """
+        return (source in self.files
+                and self.hashes.get(source) == {"sha256": file_hash, "start_page": start_page})
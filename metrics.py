@@ -0,0 +1,53 @@
+import resource
+import threading
+import numpy as np
+from collections import deque
+
+
+class LatencyWindow:
+    """Скользящее окно последних измерений задержки с расчётом перцентилей"""
+
+    def __init__(self, size: int = 1000) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            size: количество последних измерений, по которым считаются перцентили
+        """
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        """
+        Добавление измерения
+
+        Args:
+            seconds: задержка в секундах
+        """
+        with self._lock:
+            self._values.append(seconds)
+            self.count += 1
+
+    def percentiles(self) -> dict[str, float]:
+        """
+        Перцентили задержки
+
+        Returns:
+            dict[str, float]: p50, p90 и p99 в миллисекундах (пустой словарь, если измерений нет)
+        """
+        with self._lock:
+            values = np.array(self._values) * 1000
+        if not len(values):
+            return {}
+        return {f"p{p}": round(float(np.percentile(values, p)), 2) for p in (50, 90, 99)}
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковый объём резидентной памяти процесса с момента запуска
+
+    Returns:
+        float: пиковый RSS в МБ (ru_maxrss в Linux измеряется в КБ)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,222 @@
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+from langchain_core.embeddings import Embeddings
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Модель эмбеддингов sentence-transformers, выполняемая через ONNX Runtime на CPU
+
+    При первом запуске модель экспортируется в ONNX (и при необходимости квантуется в int8 динамической
+    квантизацией) и сохраняется в cache_dir, последующие запуски загружают готовую модель. Тексты сортируются по
+    длине перед разбиением на пакеты, чтобы минимизировать выравнивание (padding) внутри пакета
+
+    Структура директории модели: model.onnx (и model_int8.onnx), tokenizer/ — файлы токенизатора, settings.json —
+    параметры пулинга и нормализации. Экспорт выполняется во временную директорию, которая переименовывается в
+    директорию модели только после записи всех файлов, поэтому прерванный экспорт не оставляет неполную модель
+    """
+
+    SETTINGS_FILE = "settings.json"
+
+    def __init__(self, model_name: str, cache_dir: str = "onnx_models", quantize: bool = False,
+                 intra_op_threads: int | None = None, batch_size: int = 32) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            model_name: имя модели sentence-transformers
+            cache_dir: директория для экспортированных моделей
+            quantize: динамическая квантизация весов в int8
+            intra_op_threads: количество потоков ONNX Runtime внутри одной операции (по умолчанию — число ядер CPU)
+            batch_size: количество текстов в одном пакете
+        """
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("Для ONNX бэкенда эмбеддингов необходимо установить onnxruntime и transformers") from e
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.model_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+
+        model_path = self._export()
+        with open(os.path.join(self.model_dir, self.SETTINGS_FILE), encoding="utf-8") as f:
+            settings = json.load(f)
+        self.pooling = settings["pooling"]
+        self.normalize = settings["normalize"]
+        self.max_length = settings["max_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.join(self.model_dir, "tokenizer"))
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _export_to(self, export_dir: str) -> None:
+        """Экспорт модели, токенизатора и параметров пулинга в директорию"""
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        st_model = SentenceTransformer(self.model_name, device="cpu")
+        pooling_mode = st_model[1].get_pooling_mode_str()
+        if pooling_mode not in ("mean", "cls"):
+            raise ValueError(f"Режим пулинга '{pooling_mode}' не поддерживается ONNX бэкендом")
+
+        transformer = st_model[0].auto_model.eval()
+        tokenizer = st_model.tokenizer
+        sample = tokenizer(["пример текста"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(sample[name] for name in input_names),
+                os.path.join(export_dir, "model.onnx"),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+                opset_version=17,
+            )
+
+        tokenizer.save_pretrained(os.path.join(export_dir, "tokenizer"))
+        # Файл параметров записывается последним: по его наличию экспорт считается завершённым
+        with open(os.path.join(export_dir, self.SETTINGS_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "pooling": pooling_mode,
+                "normalize": any(type(module).__name__ == "Normalize" for module in st_model),
+                "max_length": st_model.max_seq_length,
+            }, f)
+
+    def _export(self) -> str:
+        """
+        Экспорт модели в ONNX и квантизация, если они ещё не выполнены
+
+        Returns:
+            str: путь к ONNX модели
+        """
+        fp32_path = os.path.join(self.model_dir, "model.onnx")
+        int8_path = os.path.join(self.model_dir, "model_int8.onnx")
+
+        if not os.path.exists(os.path.join(self.model_dir, self.SETTINGS_FILE)):
+            parent = os.path.dirname(self.model_dir)
+            os.makedirs(parent, exist_ok=True)
+            export_dir = tempfile.mkdtemp(prefix=os.path.basename(self.model_dir) + ".", dir=parent)
+            try:
+                self._export_to(export_dir)
+                # Директория от прерванного экспорта или старого формата без файла параметров
+                shutil.rmtree(self.model_dir, ignore_errors=True)
+                try:
+                    os.replace(export_dir, self.model_dir)
+                except OSError:
+                    # Экспорт параллельно завершил другой процесс
+                    if not os.path.exists(os.path.join(self.model_dir, self.SETTINGS_FILE)):
+                        raise
+            finally:
+                shutil.rmtree(export_dir, ignore_errors=True)
+
+        if not self.quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            tmp_path = os.path.join(self.model_dir, f"model_int8.{os.getpid()}.tmp.onnx")
+            try:
+                quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+                os.replace(tmp_path, int8_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return int8_path
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        """Вычисление эмбеддингов пакетами из текстов близкой длины"""
+        if not texts:
+            return []
+
+        lengths = [len(ids) for ids in self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]]
+        order = np.argsort(lengths, kind="stable")
+        embeddings = np.empty((len(texts), 0), dtype=np.float32)
+
+        for start in range(0, len(texts), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            inputs = self.tokenizer([texts[i] for i in indices], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = inputs["attention_mask"][..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+            if embeddings.shape[1] == 0:
+                embeddings = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            embeddings[indices] = pooled
+
+        return embeddings.tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Эмбеддинги документов
+
+        Args:
+            texts: список текстов
+
+        Returns:
+            list[list[float]]: эмбеддинги в порядке исходных текстов
+        """
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Эмбеддинг запроса
+
+        Args:
+            text: текст запроса
+
+        Returns:
+            list[float]: эмбеддинг запроса
+        """
+        return self._embed([text])[0]
+
+
+def recall_parity(reference: Embeddings, candidate: Embeddings, corpus: list[str], queries: list[str],
+                  k: int = 10) -> float:
+    """
+    Совпадение результатов поиска двух моделей эмбеддингов
+
+    Для каждого запроса сравниваются top-k ближайших (по косинусной близости) документов корпуса
+
+    Args:
+        reference: эталонная модель (PyTorch)
+        candidate: проверяемая модель (ONNX)
+        corpus: тексты документов
+        queries: тексты запросов
+        k: количество ближайших документов
+
+    Returns:
+        float: средняя доля общих документов в top-k (1.0 — полное совпадение)
+    """
+    def top_k(embeddings: Embeddings) -> list[set[int]]:
+        docs = np.asarray(embeddings.embed_documents(corpus), dtype=np.float32)
+        docs /= np.clip(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12, None)
+        result = []
+        for query in queries:
+            vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            result.append(set(np.argsort(-(docs @ vector))[:k].tolist()))
+        return result
+
+    k = min(k, len(corpus))
+    overlaps = [len(a & b) / k for a, b in zip(top_k(reference), top_k(candidate))]
+    return float(np.mean(overlaps)) if overlaps else 1.0
@@ -1,48 +1,185 @@
 import chromadb
 import fitz
+import logging
+import multiprocessing
 import os
 import shutil
+import threading
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator
+from langchain_core.documents import Document
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
+from collection_pool import CollectionHandlePool
+from embedding_cache import CachedEmbeddings, PrecomputedEmbeddings
+from ingestion import IngestionPipeline, IngestionStats, chunk_id
+from manifest import CollectionManifest
+from onnx_embeddings import OnnxEmbeddings
+
+logger = logging.getLogger(__name__)
+
+
+def _extract_page_range(file_path: str, first_page: int, last_page: int) -> list[tuple[int, str]]:
+    """
+    Извлечение текста из диапазона страниц PDF файла (выполняется в процессе-воркере)
+
+    Каждый воркер открывает собственный экземпляр документа, так как объекты fitz нельзя передавать между процессами
+
+    Args:
+        file_path: путь к PDF файлу
+        first_page: номер первой страницы диапазона
+        last_page: номер страницы, на которой диапазон заканчивается (не включительно)
+
+    Returns:
+        list[tuple[int, str]]: список пар (номер страницы, текст страницы)
+
+    Raises:
+        ValueError: если страницы не удалось прочитать (исключения fitz приводятся к ошибке последовательного режима)
+    """
+    try:
+        with fitz.open(file_path) as doc:
+            return [(page_num, doc[page_num].get_text()) for page_num in range(first_page, last_page)]
+    except RuntimeError as e:
+        # fitz.FileDataError и ошибки MuPDF наследуются от RuntimeError
+        raise ValueError(f"Ошибка чтения PDF файла: {str(e)}") from None
+
+
+# Долгоживущие пулы процессов извлечения текста (по количеству процессов)
+_extract_pools: dict[int, ProcessPoolExecutor] = {}
+_extract_pools_lock = threading.Lock()
+
+
+def _get_extract_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Пул процессов для извлечения текста из PDF
+
+    Процессы запускаются через forkserver, а не fork: пул создаётся из потока конвейера загрузки в процессе, где
+    уже работают потоки torch, uvicorn и aiohttp, и fork такого процесса медленный и может унаследовать захваченные
+    блокировки. Сервер форков один раз импортирует этот модуль, а пул переиспользуется между документами
+
+    Args:
+        workers: количество процессов
+
+    Returns:
+        ProcessPoolExecutor: пул процессов
+    """
+    with _extract_pools_lock:
+        pool = _extract_pools.get(workers)
+        if pool is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            pool = _extract_pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return pool
+
+
+def _discard_extract_pool(workers: int, pool: ProcessPoolExecutor) -> None:
+    """Удаление пула, процесс которого завершился аварийно (следующий документ создаст новый пул)"""
+    with _extract_pools_lock:
+        if _extract_pools.get(workers) is pool:
+            del _extract_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
 
 
 class PDFVecDataBase:
     """Класс для парсинга и добавления pdf в базу данных"""
 
-    def __init__(self, embeddings_model: str, path_db: str) -> None:
+    def __init__(self, embeddings_model: str, path_db: str, extract_workers: int | None = None,
+                 ingest_batch_size: int = 32, ingest_queue_size: int = 4, embedding_cache_path: str | None = None,
+                 embedding_cache_size: int = 1_000_000, max_open_collections: int = 16,
+                 embeddings_backend: str = "torch", onnx_dir: str = "onnx_models") -> None:
         """
         Инициализация класса
 
         Args:
             embeddings_model: имя модели эмбеддингов
             path_db: путь до векторной базы данных
+            extract_workers: количество процессов для извлечения текста из PDF (по умолчанию — число ядер CPU)
+            ingest_batch_size: количество чанков в одном микропакете эмбеддингов и записи в базу
+            ingest_queue_size: размер очередей между стадиями конвейера загрузки
+            embedding_cache_path: путь к файлу дискового кэша эмбеддингов (если не задан, кэш не используется)
+            embedding_cache_size: максимальное количество векторов в кэше эмбеддингов
+            max_open_collections: максимальное количество одновременно открытых коллекций
+            embeddings_backend: бэкенд модели эмбеддингов: "torch", "onnx" или "onnx-int8" (ONNX Runtime с
+                динамической квантизацией весов)
+            onnx_dir: директория для экспортированных ONNX моделей
+
+        Raises:
+            ValueError: если embeddings_backend некорректен
         """
 
         # Инициализация модели эмбеддингов (будет на CPU)
-        self.embedding_function = HuggingFaceEmbeddings(
-            model_name=embeddings_model,
-            model_kwargs={"device": "cpu"}
-        )
+        if embeddings_backend == "torch":
+            self.embedding_function = HuggingFaceEmbeddings(
+                model_name=embeddings_model,
+                model_kwargs={"device": "cpu"}
+            )
+        elif embeddings_backend in ("onnx", "onnx-int8"):
+            self.embedding_function = OnnxEmbeddings(
+                model_name=embeddings_model,
+                cache_dir=onnx_dir,
+                quantize=embeddings_backend == "onnx-int8",
+            )
+        else:
+            raise ValueError(f"Неизвестный бэкенд модели эмбеддингов: {embeddings_backend}")
+
+        # Модель без дискового кэша — для одноразовых текстов (фрагментов интернет страниц), которые не должны
+        # вытеснять из кэша векторы чанков коллекций
+        self.embedding_model = self.embedding_function
+
+        # Кэш эмбеддингов общий для всех коллекций: повторная загрузка тех же чанков не пересчитывает векторы
+        if embedding_cache_path:
+            # Векторы разных бэкендов немного отличаются, поэтому кэшируются раздельно
+            cache_model_name = embeddings_model
+            if embeddings_backend != "torch":
+                cache_model_name = f"{embeddings_model}:{embeddings_backend}"
+
+            self.embedding_function = CachedEmbeddings(
+                embeddings=self.embedding_function,
+                model_name=cache_model_name,
+                path=embedding_cache_path,
+                max_entries=embedding_cache_size,
+            )
+
+        # Функция эмбеддингов коллекций: при записи через add_texts отдаёт векторы, уже вычисленные конвейером
+        self._collection_embeddings = PrecomputedEmbeddings(self.embedding_function)
 
         self.path_db = path_db
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.ingest_batch_size = ingest_batch_size
+        self.ingest_queue_size = ingest_queue_size
+        self.collections = CollectionHandlePool(self._open_collection, max_size=max_open_collections)
+
+        # Версии коллекций увеличиваются при каждом изменении и используются как часть ключей кэшей запросов
+        self._versions: dict[str, int] = {}
+        self._versions_lock = threading.Lock()
 
     @staticmethod
-    def extract_text_from_pdf(file_path: str, start_page: int = 1) -> str:
+    def iter_pages_from_pdf(file_path: str, start_page: int = 1, workers: int = 1,
+                            pages_per_task: int = 16) -> Iterator[tuple[int, str]]:
         """
-        Извлечение текста из PDF файла
+        Постраничное извлечение текста из PDF файла
+
+        Диапазоны страниц распределяются по пулу процессов, результаты отдаются строго по порядку страниц по мере
+        готовности, поэтому вызывающий код может начинать обработку до того, как прочитана последняя страница.
+        Одновременно в работе находится не больше 2 * workers диапазонов
 
         Args:
             file_path: путь к PDF файлу
             start_page: номер страницы с которой начинать извлечение (по умолчанию 1)
+            workers: количество процессов (1 — последовательное извлечение в текущем процессе)
+            pages_per_task: количество страниц в одной задаче для процесса
 
-        Returns:
-            str: извлеченный текст
+        Yields:
+            tuple[int, str]: номер страницы и её текст (пустые страницы пропускаются)
 
         Raises:
             FileNotFoundError: если файл не существует
-            ValueError: если file_path или start_page некорректен
+            ValueError: если file_path, start_page, workers или pages_per_task некорректны
         """
         # Проверка корректности start_page
         if start_page < 1:
@@ -52,45 +189,123 @@ class PDFVecDataBase:
         if not isinstance(file_path, str) or not file_path:
             raise ValueError("Некорректный путь к файлу")
 
+        # Проверка параметров пула
+        if workers < 1 or pages_per_task < 1:
+            raise ValueError("Количество процессов и страниц в задаче должно быть положительным числом")
+
         # Проверка существования файла
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Файл не найден: {file_path}")
 
-        doc = None
         try:
-            doc = fitz.open(file_path)
-
-            # Проверка корректности start_page
-            if start_page > len(doc):
-                raise ValueError(f"Стартовая страница {start_page} превышает количество страниц {len(doc)}")
+            with fitz.open(file_path) as doc:
+                page_count = len(doc)
 
-            # Сбор текста
-            text_parts = []
-            for page_num in range(start_page, len(doc)):
-                page = doc[page_num]
-                page_text = page.get_text()
-                if page_text:  # Добавляем только непустой текст
-                    text_parts.append(page_text)
+                # Проверка корректности start_page
+                if start_page > page_count:
+                    raise ValueError(f"Стартовая страница {start_page} превышает количество страниц {page_count}")
 
-            return "".join(text_parts)
+                # Небольшие документы и последовательный режим обрабатываются в текущем процессе
+                if workers == 1 or page_count - start_page <= pages_per_task:
+                    for page_num in range(start_page, page_count):
+                        page_text = doc[page_num].get_text()
+                        if page_text:  # Отдаём только непустой текст
+                            yield page_num, page_text
+                    return
 
         except fitz.FileDataError as e:
             raise ValueError(f"Ошибка чтения PDF файла: {str(e)}")
+
+        ranges = deque((first, min(first + pages_per_task, page_count))
+                       for first in range(start_page, page_count, pages_per_task))
+        pending = deque()
+        executor = _get_extract_pool(workers)
+        try:
+            while ranges or pending:
+                # Поддерживаем ограниченное число задач в работе, чтобы не держать в памяти весь документ
+                while ranges and len(pending) < 2 * workers:
+                    pending.append(executor.submit(_extract_page_range, file_path, *ranges.popleft()))
+
+                try:
+                    pages = pending.popleft().result()
+                except BrokenProcessPool:
+                    _discard_extract_pool(workers, executor)
+                    raise ValueError("Ошибка чтения PDF файла: процесс извлечения текста завершился аварийно")
+                for page_num, page_text in pages:
+                    if page_text:
+                        yield page_num, page_text
         finally:
-            if doc:
-                doc.close()
+            # Генератор мог быть закрыт досрочно — отменяем оставшиеся задачи этого документа
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def page_count(file_path: str) -> int:
+        """
+        Количество страниц в PDF файле
+
+        Args:
+            file_path: путь к PDF файлу
+
+        Returns:
+            int: количество страниц
+
+        Raises:
+            ValueError: если файл не является корректным PDF
+        """
+        try:
+            with fitz.open(file_path) as doc:
+                return len(doc)
+        except fitz.FileDataError as e:
+            raise ValueError(f"Ошибка чтения PDF файла: {str(e)}")
+
+    @staticmethod
+    def extract_text_from_pdf(file_path: str, start_page: int = 1, workers: int = 1) -> str:
+        """
+        Извлечение текста из PDF файла
+
+        Args:
+            file_path: путь к PDF файлу
+            start_page: номер страницы с которой начинать извлечение (по умолчанию 1)
+            workers: количество процессов извлечения (по умолчанию 1 — в текущем процессе)
+
+        Returns:
+            str: извлеченный текст
+
+        Raises:
+            FileNotFoundError: если файл не существует
+            ValueError: если file_path или start_page некорректен
+        """
+        pages = PDFVecDataBase.iter_pages_from_pdf(file_path=file_path, start_page=start_page, workers=workers)
+        return "".join(page_text for _, page_text in pages)
 
     def add_pdf_to_db(self, file_path: str, collection_name: str, text_splitter: RecursiveCharacterTextSplitter = None,
-                      start_page: int = 1, overwrite: bool = False) -> None:
+                      start_page: int = 1, overwrite: bool = False,
+                      on_progress: Callable[[IngestionStats], None] | None = None,
+                      file_hash: str | None = None, source: str | None = None) -> IngestionStats:
         """
         Извлечение текста из PDF файла и добавление в векторную базу данных
 
+        Извлечение страниц, разбиение на чанки, вычисление эмбеддингов и запись в базу выполняются потоковым
+        конвейером, поэтому потребление памяти не растёт с размером документа.
+        Идентификатор чанка в Chroma — хеш его содержимого, а манифест коллекции хранит, какие чанки получены из
+        какого файла. Поэтому при повторной загрузке эмбеддинги вычисляются только для новых чанков, а удаляются
+        только исчезнувшие
+
         Args:
             file_path: путь к PDF файлу
             collection_name: название коллекции
             text_splitter: объект для разделения текста
             start_page: номер страницы с которой начинать извлечение (по умолчанию 1)
-            overwrite: перезапись существующей коллекции или добавление к ней
+            overwrite: перезапись существующей коллекции (в ней останутся только чанки этого файла)
+                или добавление к ней (заменяются только чанки файла с тем же именем)
+            on_progress: функция, вызываемая с текущей статистикой после записи каждого пакета
+            file_hash: SHA-256 содержимого файла. Если файл с тем же хешем уже загружен в коллекцию с той же
+                страницы, повторная загрузка без перезаписи пропускается
+            source: имя файла в манифесте и метаданных чанков (по умолчанию — имя файла из file_path)
+
+        Returns:
+            IngestionStats: статистика пропускной способности стадий конвейера (пустая, если загрузка пропущена)
 
         Raises:
             ValueError: если файл или collection_name пустые
@@ -99,24 +314,116 @@ class PDFVecDataBase:
         if collection_name == "":
             raise ValueError(f"Название коллекции не должно быть пустым")
 
-        # Извлечение текста из PDF файла
-        text = self.extract_text_from_pdf(file_path=file_path, start_page=start_page)
+        # Постраничное извлечение текста из PDF файла
+        pages = self.iter_pages_from_pdf(file_path=file_path, start_page=start_page, workers=self.extract_workers)
 
-        # Проверка, что PDF не пустой
-        if not text or text.strip() == "":
-            raise ValueError(f"PDF файл {file_path} не содержит текст")
+        collection_path = self._collection_path(collection_name)
+        source = source or os.path.basename(file_path)
+        manifest = CollectionManifest.load(collection_path)
+        if file_hash is not None and not overwrite and manifest.is_unchanged(source, file_hash, start_page):
+            logger.info("Файл %s не изменился с прошлой загрузки в коллекцию '%s', загрузка пропущена", source,
+                        collection_name)
+            return IngestionStats()
+
+        # Коллекция удерживается до конца загрузки, чтобы пул не закрыл её при вытеснении
+        with ExitStack() as stack:
+            db = None
+            if os.path.exists(collection_path):
+                db = stack.enter_context(self.collections.acquire(collection_path))
+            existing_ids = set(db.get(include=[])["ids"]) if db is not None else set()
+
+            def sink(batch: list[tuple[str, str, int]], embeddings: list[list[float]]) -> None:
+                nonlocal db
+                if db is None:
+                    db = stack.enter_context(self.collections.acquire(collection_path))
+                texts = [text for _, text, _ in batch]
+                # add_texts с ids выполняет upsert, векторы берутся из конвейера, а не вычисляются повторно
+                with self._collection_embeddings.provide(texts, embeddings):
+                    db.add_texts(
+                        texts=texts,
+                        metadatas=[{"source": source, "page": page_no} for _, _, page_no in batch],
+                        ids=[text_id for text_id, _, _ in batch],
+                    )
+
+            pipeline = IngestionPipeline(
+                embedding_function=self.embedding_function,
+                text_splitter=text_splitter,
+                batch_size=self.ingest_batch_size,
+                queue_size=self.ingest_queue_size,
+            )
+            seen_ids: dict[str, int] = {}
+            try:
+                stats = pipeline.run(pages, sink, on_progress=on_progress, known_ids=existing_ids,
+                                     seen_ids=seen_ids)
+
+                # Проверка, что PDF не пустой
+                if not seen_ids:
+                    raise ValueError(f"PDF файл {file_path} не содержит текст")
+
+                # Уже существовавшие чанки не записывались заново, поэтому их метаданные обновляются отдельно
+                self._update_metadata(db, existing_ids & seen_ids.keys(), seen_ids, source, overwrite)
+
+                # Удаляем чанки, которые больше не встречаются ни в одном файле коллекции
+                if overwrite:
+                    vanished_ids = existing_ids - seen_ids.keys()
+                    manifest.files = {}
+                    manifest.hashes = {}
+                else:
+                    vanished_ids = (manifest.files.get(source, {}).keys() - seen_ids.keys()
+                                    - manifest.referenced_ids(exclude=source))
+                manifest.files[source] = seen_ids
+                if file_hash is not None:
+                    manifest.hashes[source] = {"sha256": file_hash, "start_page": start_page}
+                else:
+                    manifest.hashes.pop(source, None)
+
+                if vanished_ids:
+                    db.delete(ids=list(vanished_ids))
+                manifest.save()
+            finally:
+                # Даже неудачная загрузка могла записать часть чанков: кэши запросов не должны отдавать результаты
+                # для прежнего состояния коллекции
+                self._bump_version(collection_name)
+
+        logger.info("Файл %s загружен в коллекцию '%s' (удалено чанков: %d): %s", source, collection_name,
+                    len(vanished_ids), stats.as_dict())
+        return stats
+
+    def _update_metadata(self, db: Chroma, ids: set[str], seen_ids: dict[str, int], source: str,
+                         overwrite: bool, batch_size: int = 500) -> None:
+        """
+        Обновление метаданных уже существовавших чанков, которые встретились в загружаемом файле
 
-        if text_splitter:
-            split_text = text_splitter.split_text(text=text)
-        else:
-            split_text = [text]
+        При перезаписи коллекции все её чанки принадлежат загружаемому файлу. При добавлении обновляются только
+        чанки этого же файла (например, если страницы сдвинулись), чанки, общие с другими файлами, не меняются
 
-        # Добавляем в базу данных
-        self.add_texts_to_db(
-            text=split_text,
-            collection_name=collection_name,
-            overwrite=overwrite
-        )
+        Args:
+            db: коллекция
+            ids: идентификаторы существовавших чанков, найденных в файле
+            seen_ids: номера страниц чанков файла
+            source: имя файла
+            overwrite: режим перезаписи коллекции
+            batch_size: количество чанков в одном запросе
+        """
+        ids = sorted(ids)
+        for i in range(0, len(ids), batch_size):
+            found = db.get(ids=ids[i:i + batch_size], include=["embeddings", "documents", "metadatas"])
+            changed = [
+                (text_id, text, vector, {**(metadata or {}), "source": source, "page": seen_ids[text_id]})
+                for text_id, text, vector, metadata in zip(found["ids"], found["documents"], found["embeddings"],
+                                                           found["metadatas"])
+                if (overwrite or (metadata or {}).get("source") == source)
+                and ((metadata or {}).get("source"), (metadata or {}).get("page")) != (source, seen_ids[text_id])
+            ]
+            if not changed:
+                continue
+            texts = [text for _, text, _, _ in changed]
+            # update_documents снова вычисляет эмбеддинги, поэтому ему отдаются сохранённые векторы
+            with self._collection_embeddings.provide(texts, [list(vector) for _, _, vector, _ in changed]):
+                db.update_documents(
+                    ids=[text_id for text_id, _, _, _ in changed],
+                    documents=[Document(page_content=text, metadata=metadata) for _, text, _, metadata in changed],
+                )
 
     def _collection_path(self, collection_name: str) -> str:
         """
@@ -130,6 +437,44 @@ class PDFVecDataBase:
         """
         return os.path.join(self.path_db, collection_name)
 
+    def _bump_version(self, collection_name: str) -> None:
+        """
+        Увеличение версии коллекции после её изменения
+
+        Args:
+            collection_name: название коллекции
+        """
+        with self._versions_lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+
+    def collection_version(self, collection_name: str) -> int:
+        """
+        Текущая версия коллекции
+
+        Args:
+            collection_name: название коллекции
+
+        Returns:
+            int: номер версии, увеличивающийся при каждом изменении коллекции
+        """
+        with self._versions_lock:
+            return self._versions.get(collection_name, 0)
+
+    def _open_collection(self, collection_path: str) -> Chroma:
+        """
+        Открытие (или создание) коллекции Chroma
+
+        Args:
+            collection_path: путь к директории коллекции
+
+        Returns:
+            Chroma: объект векторной базы данных
+        """
+        return Chroma(
+            persist_directory=collection_path,
+            embedding_function=self._collection_embeddings,
+        )
+
     def add_texts_to_db(self, text: str | list[str], collection_name: str, overwrite: bool = False) -> None:
         """
         Сохранение текста в векторную базу данных с разделением по коллекциям
@@ -143,34 +488,42 @@ class PDFVecDataBase:
         if not isinstance(text, list):
             text = [text]
 
+        # Идентификатор чанка — хеш содержимого, повторяющиеся тексты сохраняются один раз
+        text = list(dict.fromkeys(text))
+        ids = [chunk_id(t) for t in text]
+
         collection_path = self._collection_path(collection_name)
 
         if overwrite and os.path.exists(collection_path):
+            self.collections.invalidate(collection_path)
             shutil.rmtree(collection_path)
 
         if overwrite:
             # Создание новой коллекции или перезаписывание существующей
             Chroma.from_texts(
                 texts=text,
+                ids=ids,
                 persist_directory=collection_path,
                 embedding=self.embedding_function,
             )
         else:
             # Добавление в существующую коллекцию
-            db = Chroma(
-                persist_directory=collection_path,
-                embedding_function=self.embedding_function,
-            )
-            db.add_texts(text)
+            with self.collections.acquire(collection_path) as db:
+                db.add_texts(text, ids=ids)
+
+        self._bump_version(collection_name)
 
-    def load_collection(self, collection_name: str) -> VectorStoreRetriever:
+    @contextmanager
+    def load_collection(self, collection_name: str) -> Iterator[VectorStoreRetriever]:
         """
         Загрузка существующей коллекции
 
+        Коллекция удерживается в пуле, пока контекст не завершён: retriever можно использовать только внутри контекста
+
         Args:
             collection_name: название коллекции
 
-        Returns:
+        Yields:
             retriever: объект для поиска по векторной базе
 
         Raises:
@@ -180,14 +533,75 @@ class PDFVecDataBase:
         if collection_name == "":
             raise ValueError(f"Название коллекции не должно быть пустым")
 
-        db = Chroma(
-            persist_directory=self._collection_path(collection_name),
-            embedding_function=self.embedding_function,
-        )
+        with self.collections.acquire(self._collection_path(collection_name)) as db:
+            # Создание объекта для поиска по векторной базе (топ 10 похожих результатов)
+            yield db.as_retriever(search_kwargs={"k": 10})
 
-        # Создание объекта для поиска по векторной базе (топ 10 похожих результатов)
-        db_retriever = db.as_retriever(search_kwargs={"k": 10})
-        return db_retriever
+    def embed_query(self, query: str) -> list[float]:
+        """
+        Эмбеддинг поискового запроса
+
+        Args:
+            query: поисковый запрос
+
+        Returns:
+            list[float]: эмбеддинг запроса
+        """
+        return self.embedding_function.embed_query(query)
+
+    def search_by_vector(self, collection_name: str, embedding: list[float], k: int = 10) -> list[Document]:
+        """
+        Поиск документов в коллекции по эмбеддингу запроса с сохранением расстояний
+
+        Args:
+            collection_name: название коллекции
+            embedding: эмбеддинг запроса
+            k: количество возвращаемых документов
+
+        Returns:
+            list[Document]: найденные документы, в метаданных каждого добавлено поле 'distance'
+
+        Raises:
+            ValueError: если collection_name пустой
+        """
+        if collection_name == "":
+            raise ValueError(f"Название коллекции не должно быть пустым")
+
+        documents = []
+        with self.collections.acquire(self._collection_path(collection_name)) as db:
+            for doc, distance in db.similarity_search_by_vector_with_relevance_scores(embedding, k=k):
+                doc.metadata["distance"] = distance
+                documents.append(doc)
+        return documents
+
+    def search(self, collection_name: str, query: str, k: int = 10) -> list[Document]:
+        """
+        Поиск документов в коллекции с сохранением расстояний
+
+        Args:
+            collection_name: название коллекции
+            query: поисковый запрос
+            k: количество возвращаемых документов
+
+        Returns:
+            list[Document]: найденные документы, в метаданных каждого добавлено поле 'distance'
+
+        Raises:
+            ValueError: если collection_name пустой
+        """
+        return self.search_by_vector(collection_name, self.embed_query(query), k=k)
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Статистика работы векторной базы данных
+
+        Returns:
+            dict[str, dict]: статистика по компонентам
+        """
+        stats = {"collections": self.collections.stats()}
+        if isinstance(self.embedding_function, CachedEmbeddings):
+            stats["embedding_cache"] = self.embedding_function.stats()
+        return stats
 
     def list_collection(self) -> list[str]:
         """
@@ -219,7 +633,9 @@ class PDFVecDataBase:
         if not os.path.exists(collection_path):
             raise ValueError(f"Коллекция '{collection_name}' не существует")
 
+        self.collections.invalidate(collection_path)
         shutil.rmtree(collection_path)
+        self._bump_version(collection_name)
 
 
 if __name__ == "__main__":
@@ -234,6 +650,7 @@ if __name__ == "__main__":
 
     # pdf_db.add_texts_to_db(text="text", collection_name="collection_1", overwrite=True)
 
-    # retriever = pdf_db.load_collection(collection_name="collection_1")
+    # with pdf_db.load_collection(collection_name="collection_1") as retriever:
+    #     retriever.invoke("вопрос")
 
     pdf_db.delete_collection(collection_name="collection_1")
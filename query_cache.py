@@ -0,0 +1,256 @@
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# Маркер отсутствия значения в кэше (None может быть корректным значением)
+MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            max_size: максимальное количество записей
+            ttl: время жизни записи в секундах
+        """
+        if max_size < 1 or ttl <= 0:
+            raise ValueError("Размер кэша и время жизни записей должны быть положительными числами")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Получение значения
+
+        Args:
+            key: ключ
+
+        Returns:
+            Any: значение или MISSING, если записи нет или её время жизни истекло
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Сохранение значения с вытеснением самых давно использованных записей
+
+        Args:
+            key: ключ
+            value: значение
+        """
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика кэша
+
+        Returns:
+            dict[str, float]: количество записей, попаданий, промахов и доля попаданий
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class QueryCache:
+    """
+    Многоуровневый кэш обработки вопроса: эмбеддинг вопроса -> результат поиска -> контекст после реранкинга ->
+    итоговый ответ
+
+    Ключи уровней поиска, реранкинга и ответа включают версию коллекции, которая увеличивается при каждом
+    изменении коллекции, поэтому устаревшие записи никогда не возвращаются
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0, answer_ttl: float | None = None) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            max_size: максимальное количество записей на каждом уровне
+            ttl: время жизни записей в секундах
+            answer_ttl: время жизни итоговых ответов в секундах (по умолчанию равно ttl)
+        """
+        self.embedding = TTLCache(max_size=max_size, ttl=ttl)
+        self.retrieval = TTLCache(max_size=max_size, ttl=ttl)
+        self.rerank = TTLCache(max_size=max_size, ttl=ttl)
+        self.answer = TTLCache(max_size=max_size, ttl=answer_ttl or ttl)
+
+    @staticmethod
+    def key(collection_name: str, version: int, question: str) -> tuple[str, int, str]:
+        """
+        Ключ записи уровней поиска, реранкинга и ответа
+
+        Args:
+            collection_name: название коллекции
+            version: версия коллекции
+            question: вопрос пользователя
+
+        Returns:
+            tuple[str, int, str]: ключ записи
+        """
+        return collection_name, version, question.strip()
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Статистика по уровням кэша
+
+        Returns:
+            dict[str, dict[str, float]]: статистика каждого уровня
+        """
+        return {
+            "embedding": self.embedding.stats(),
+            "retrieval": self.retrieval.stats(),
+            "rerank": self.rerank.stats(),
+            "answer": self.answer.stats(),
+        }
+
+
+class SemanticAnswerCache:
+    """
+    Кэш ответов по смысловой близости вопросов
+
+    Для каждой коллекции хранится компактный индекс: матрица нормализованных эмбеддингов вопросов (float32) и
+    соответствующие ответы. Если косинусная близость нового вопроса к сохранённому не ниже порога, возвращается
+    сохранённый ответ. Записи старых версий коллекции удаляются при появлении новой версии
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 1024, ttl: float = 600.0) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            threshold: минимальная косинусная близость вопросов для возврата сохранённого ответа
+            max_entries: максимальное количество ответов на одну коллекцию
+            ttl: время жизни записи в секундах
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError("Порог близости должен быть в диапазоне (0, 1]")
+        if max_entries < 1 or ttl <= 0:
+            raise ValueError("Размер кэша и время жизни записей должны быть положительными числами")
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Название коллекции -> (версия, матрица эмбеддингов, ответы, время последнего обращения, срок жизни)
+        self._indexes: dict[str, tuple[int, np.ndarray, list[str], np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _index(self, collection_name: str, version: int, dim: int) -> tuple:
+        """Индекс коллекции нужной версии (индекс устаревшей версии заменяется пустым)"""
+        index = self._indexes.get(collection_name)
+        if index is None or index[0] != version:
+            empty = (version, np.empty((0, dim), dtype=np.float32), [], np.empty(0), np.empty(0))
+            # Запрос, начатый до изменения коллекции, не должен стирать индекс новой версии
+            if index is not None and index[0] > version:
+                return empty
+            index = self._indexes[collection_name] = empty
+        return index
+
+    def get(self, collection_name: str, version: int, embedding: list[float]) -> Any:
+        """
+        Поиск ответа на близкий вопрос
+
+        Args:
+            collection_name: название коллекции
+            version: версия коллекции
+            embedding: эмбеддинг вопроса
+
+        Returns:
+            Any: сохранённый ответ или MISSING, если близкого вопроса нет
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            _, vectors, answers, last_used, expires = self._index(collection_name, version, query.shape[0])
+            if len(answers):
+                similarities = vectors @ query
+                similarities[expires < time.monotonic()] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    last_used[best] = time.monotonic()
+                    self.hits += 1
+                    return answers[best]
+            self.misses += 1
+            return MISSING
+
+    def set(self, collection_name: str, version: int, embedding: list[float], answer: str) -> None:
+        """
+        Сохранение ответа с вытеснением записи, к которой дольше всего не обращались
+
+        Args:
+            collection_name: название коллекции
+            version: версия коллекции
+            embedding: эмбеддинг вопроса
+            answer: ответ
+        """
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if collection_name in self._indexes and self._indexes[collection_name][0] > version:
+                return
+            _, vectors, answers, last_used, expires = self._index(collection_name, version, query.shape[0])
+
+            # Сначала удаляются просроченные записи, затем — давно не использованные
+            keep = np.flatnonzero(expires >= now)
+            if len(keep) >= self.max_entries:
+                keep = keep[np.argsort(last_used[keep])[len(keep) - self.max_entries + 1:]]
+
+            self._indexes[collection_name] = (
+                version,
+                np.vstack([vectors[keep], query[None, :]]),
+                [answers[i] for i in keep] + [answer],
+                np.append(last_used[keep], now),
+                np.append(expires[keep], now + self.ttl),
+            )
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика кэша
+
+        Returns:
+            dict[str, float]: количество записей, попаданий, промахов и доля попаданий
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": sum(len(index[2]) for index in self._indexes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
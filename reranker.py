@@ -1,21 +1,307 @@
-from typing import Sequence
+import bisect
+import queue
+import threading
+import time
+import torch
+from concurrent.futures import Future
+from typing import Callable, Sequence
 from langchain_core.documents import Document
 from sentence_transformers import CrossEncoder
+from ingestion import chunk_id
+from metrics import LatencyWindow
+from query_cache import MISSING, TTLCache
+
+TRUNCATION_POLICIES = ("head", "head_tail")
+
+
+def _histogram_bucket(value: int) -> str:
+    """Корзина гистограммы по степеням двойки: 1, 2, 3-4, 5-8, ..."""
+    upper = 1
+    while upper < value:
+        upper *= 2
+    lower = upper // 2 + 1
+    return str(upper) if lower >= upper else f"{lower}-{upper}"
+
+
+class RerankBatcher:
+    """
+    Планировщик реранкинга, объединяющий пары параллельных запросов в один прямой проход модели
+
+    Первый запрос открывает окно накопления: пары запросов, поступивших в течение окна, добавляются в тот же пакет,
+    пока не наберётся max_batch_pairs пар (запрос большего размера делится на части). Пакет оценивается одним
+    вызовом, каждый запрос получает свои оценки
+    """
+
+    def __init__(self, score_pairs: Callable[[list[tuple[str, str]]], list[float]], window_ms: float = 5.0,
+                 max_batch_pairs: int = 64) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            score_pairs: функция оценки списка пар (запрос, документ)
+            window_ms: максимальное время ожидания пар других запросов в миллисекундах
+            max_batch_pairs: максимальное количество пар в пакете
+        """
+        if window_ms < 0 or max_batch_pairs < 1:
+            raise ValueError("Окно накопления не может быть отрицательным, а размер пакета должен быть положительным")
+
+        self._score_pairs = score_pairs
+        self.window = window_ms / 1000
+        self.max_batch_pairs = max_batch_pairs
+        self._queue: queue.Queue[tuple[list[tuple[str, str]], Future]] = queue.Queue()
+        # Запрос, отложенный до следующего пакета (используется только потоком накопления)
+        self._carry: tuple[list[tuple[str, str]], Future] | None = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.batch_pairs_histogram: dict[str, int] = {}
+        self.batch_requests_histogram: dict[str, int] = {}
+        self._thread = threading.Thread(target=self._loop, name="rerank-batcher", daemon=True)
+        self._thread.start()
+
+    def score_pairs(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """
+        Оценка пар в составе общего пакета (блокирует вызывающий поток до готовности оценок)
+
+        Args:
+            pairs: список пар (запрос, текст документа)
+
+        Returns:
+            list[float]: оценки релевантности в порядке исходных пар
+        """
+        # Запрос больше пакета раскладывается на части, чтобы ни один пакет не превысил max_batch_pairs
+        futures = []
+        for start in range(0, len(pairs), self.max_batch_pairs):
+            future = Future()
+            self._queue.put((pairs[start:start + self.max_batch_pairs], future))
+            futures.append(future)
+        return [score for future in futures for score in future.result()]
+
+    def _collect(self) -> list[tuple[list[tuple[str, str]], Future]]:
+        """
+        Сбор пакета: ожидание первого запроса и добавление запросов, поступивших в течение окна
+
+        Запрос, не помещающийся в оставшееся место пакета, откладывается и открывает следующий пакет
+        """
+        if self._carry is not None:
+            batch, self._carry = [self._carry], None
+        else:
+            batch = [self._queue.get()]
+        pairs = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while pairs < self.max_batch_pairs:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if pairs + len(item[0]) > self.max_batch_pairs:
+                self._carry = item
+                break
+            batch.append(item)
+            pairs += len(item[0])
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+
+            with self._lock:
+                self.batches += 1
+                self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize() + len(batch))
+                pairs_bucket = _histogram_bucket(len(all_pairs))
+                requests_bucket = _histogram_bucket(len(batch))
+                self.batch_pairs_histogram[pairs_bucket] = self.batch_pairs_histogram.get(pairs_bucket, 0) + 1
+                self.batch_requests_histogram[requests_bucket] = (
+                    self.batch_requests_histogram.get(requests_bucket, 0) + 1
+                )
+
+            try:
+                scores = self._score_pairs(all_pairs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for pairs, future in batch:
+                future.set_result(scores[offset:offset + len(pairs)])
+                offset += len(pairs)
+
+    def stats(self) -> dict:
+        """
+        Статистика накопления пакетов
+
+        Returns:
+            dict: текущая и максимальная глубина очереди, количество пакетов и гистограммы размеров пакетов в парах
+            и в запросах
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize() + (self._carry is not None),
+                "max_queue_depth": self.max_queue_depth,
+                "batches": self.batches,
+                "batch_pairs_histogram": dict(self.batch_pairs_histogram),
+                "batch_requests_histogram": dict(self.batch_requests_histogram),
+            }
 
 
 class Rerank:
     """Класс для повторного ранжирования документов"""
 
-    def __init__(self, model_name: str, top_n: int = 5):
+    def __init__(self, model_name: str, top_n: int = 5, max_length: int = 512, truncation: str = "head",
+                 bucket_bounds: Sequence[int] = (64, 128, 256, 512), tokens_per_batch: int = 8192,
+                 score_cache_size: int = 8192, score_cache_ttl: float = 3600.0):
         """
         Инициализация класса
 
         Args:
             model_name: Название модели для повторного ранжирования
             top_n: Количество возвращаемых наиболее релевантных результатов
+            max_length: Максимальная длина пары (запрос, документ) в токенах
+            truncation: Политика обрезки длинных документов: "head" — начало документа, "head_tail" — начало и
+                конец документа
+            bucket_bounds: Границы корзин по длине пары в токенах
+            tokens_per_batch: Количество токенов в одном пакете; размер пакета корзины равен
+                tokens_per_batch // граница корзины
+            score_cache_size: Максимальное количество оценок в кэше
+            score_cache_ttl: Время жизни оценки в кэше в секундах
         """
-        self.model = CrossEncoder(model_name, device="cpu")
+        if truncation not in TRUNCATION_POLICIES:
+            raise ValueError(f"Неизвестная политика обрезки: {truncation}")
+
+        self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
         self.top_n = top_n
+        self.max_length = max_length
+        self.truncation = truncation
+        self.bucket_bounds = sorted(bound for bound in bucket_bounds if bound < max_length) + [max_length]
+        self.tokens_per_batch = tokens_per_batch
+        self.score_cache = TTLCache(max_size=score_cache_size, ttl=score_cache_ttl)
+        self.latencies = LatencyWindow()
+        self.batcher: RerankBatcher | None = None
+
+    def _encode(self, query_ids: list[int], document: str) -> dict[str, list[int]]:
+        """
+        Токенизация пары (запрос, документ) с обрезкой документа под максимальную длину пары согласно политике обрезки
+
+        Обрезанная пара передаётся модели токенами, без обратного декодирования в текст и повторной токенизации
+
+        Args:
+            query_ids: Токены запроса
+            document: Текст документа
+
+        Returns:
+            dict[str, list[int]]: Признаки пары для модели (input_ids, attention_mask и, если нужны модели,
+            token_type_ids)
+        """
+        tokenizer = self.model.tokenizer
+        # Запас под специальные токены пары (например, [CLS], [SEP], [SEP])
+        special_tokens = tokenizer.num_special_tokens_to_add(pair=True)
+        budget = max(self.max_length - len(query_ids) - special_tokens, 1)
+        doc_ids = tokenizer(document, add_special_tokens=False)["input_ids"]
+
+        if len(doc_ids) > budget:
+            if self.truncation == "head_tail":
+                head = budget * 2 // 3
+                doc_ids = doc_ids[:head] + doc_ids[len(doc_ids) - (budget - head):]
+            else:
+                doc_ids = doc_ids[:budget]
+
+        # Слишком длинный запрос обрезается токенизатором
+        return tokenizer.prepare_for_model(query_ids, doc_ids, truncation="longest_first", max_length=self.max_length)
+
+    def _predict(self, features: list[dict[str, list[int]]], batch_size: int) -> list[float]:
+        """
+        Оценка токенизированных пар моделью кросс-энкодера
+
+        Args:
+            features: Признаки пар, полученные _encode
+            batch_size: Размер пакета
+
+        Returns:
+            list[float]: Оценки релевантности в порядке пар
+        """
+        # Функция активации называется по-разному в разных версиях sentence-transformers
+        activation = getattr(self.model, "activation_fn", None) or self.model.default_activation_function
+        scores = []
+        with torch.inference_mode():
+            for start in range(0, len(features), batch_size):
+                batch = self.model.tokenizer.pad(features[start:start + batch_size], padding=True, return_tensors="pt")
+                logits = self.model.model(**batch, return_dict=True).logits
+                scores.extend(activation(logits).view(-1).tolist())
+        return scores
+
+    def score_pairs(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """
+        Оценка релевантности пар (запрос, документ)
+
+        Пары сортируются по длине и раскладываются по корзинам, для каждой корзины выбирается свой размер пакета,
+        чтобы не тратить вычисления на выравнивание. Оценки кэшируются по (хеш запроса, хеш документа)
+
+        Args:
+            pairs: Список пар (запрос, текст документа), запросы в парах могут различаться
+
+        Returns:
+            list[float]: Оценки релевантности в порядке исходных пар
+        """
+        keys = [(chunk_id(query), chunk_id(document)) for query, document in pairs]
+        scores = [self.score_cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is MISSING]
+        if not missing:
+            return scores
+
+        query_ids = {}
+        buckets: dict[int, list[tuple[int, int, dict[str, list[int]]]]] = {}
+        for i in missing:
+            query, document = pairs[i]
+            if query not in query_ids:
+                query_ids[query] = self.model.tokenizer(query, add_special_tokens=False)["input_ids"]
+            features = self._encode(query_ids[query], document)
+            length = len(features["input_ids"])
+            bound = self.bucket_bounds[min(bisect.bisect_left(self.bucket_bounds, length),
+                                           len(self.bucket_bounds) - 1)]
+            buckets.setdefault(bound, []).append((length, i, features))
+
+        for bound, items in buckets.items():
+            items.sort(key=lambda item: item[:2])
+            predicted = self._predict([features for _, _, features in items],
+                                      batch_size=max(self.tokens_per_batch // bound, 1))
+            for (_, i, _), score in zip(items, predicted):
+                scores[i] = float(score)
+                self.score_cache.set(keys[i], scores[i])
+
+        return scores
+
+    def score(self, query: str, documents: list[str]) -> list[float]:
+        """
+        Оценка релевантности документов запросу
+
+        Если включено накопление пакетов, пары отправляются в общий пакет с парами параллельных запросов
+
+        Args:
+            query: Поисковый запрос
+            documents: Список текстов документов
+
+        Returns:
+            list[float]: Оценки релевантности в порядке исходных документов
+        """
+        pairs = [(query, document) for document in documents]
+        if self.batcher is not None:
+            return self.batcher.score_pairs(pairs)
+        return self.score_pairs(pairs)
+
+    def enable_batching(self, window_ms: float = 5.0, max_batch_pairs: int = 64) -> None:
+        """
+        Включение накопления пар параллельных запросов в общий пакет
+
+        Args:
+            window_ms: Максимальное время ожидания пар других запросов в миллисекундах
+            max_batch_pairs: Максимальное количество пар в пакете
+        """
+        self.batcher = RerankBatcher(self.score_pairs, window_ms=window_ms, max_batch_pairs=max_batch_pairs)
 
     def rerank(self, query: str, documents: list[str]) -> list[tuple[int, float]]:
         """
@@ -31,11 +317,27 @@ class Rerank:
                 - оценка релевантности (чем выше, тем релевантнее)
                 Список отсортирован по убыванию релевантности и обрезан до top_n
         """
-        model_inputs = [[query, document] for document in documents]
-        scores = self.model.predict(model_inputs)
+        started = time.perf_counter()
+        scores = self.score(query, documents)
         results = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
+        self.latencies.add(time.perf_counter() - started)
         return results[:self.top_n]
 
+    def stats(self) -> dict[str, dict]:
+        """
+        Статистика реранкера
+
+        Returns:
+            dict[str, dict]: перцентили задержки rerank в миллисекундах, статистика кэша оценок и накопления пакетов
+        """
+        stats = {
+            "latency_ms": self.latencies.percentiles(),
+            "score_cache": self.score_cache.stats(),
+        }
+        if self.batcher is not None:
+            stats["batcher"] = self.batcher.stats()
+        return stats
+
     def compress_documents(self, query: str, documents: Sequence[Document]) -> Sequence[Document]:
         """
         Фильтрует и ранжирует документы, оставляя только наиболее релевантные запросу.
@@ -50,7 +352,8 @@ class Rerank:
 
         Returns:
             final_results: Отфильтрованная и отсортированная последовательность документов. Документы упорядочены по
-            убыванию релевантности. В метаданных каждого документа добавлено поле 'relevance_score'
+            убыванию релевантности. Возвращаются копии документов с полем 'relevance_score' в метаданных, исходные
+            документы не изменяются
         """
         if len(documents) == 0:
             return []
@@ -58,8 +361,9 @@ class Rerank:
         _docs = [d.page_content for d in doc_list]
         results = self.rerank(query, _docs)
         final_results = []
-        for r in results:
-            doc = doc_list[r[0]]
-            doc.metadata["relevance_score"] = r[1]
-            final_results.append(doc)
+        for index, score in results:
+            # Оценка записывается в копию: исходные документы могут принадлежать кэшу или другому запросу
+            doc = doc_list[index]
+            final_results.append(Document(page_content=doc.page_content,
+                                          metadata={**doc.metadata, "relevance_score": score}))
         return final_results
@@ -0,0 +1,127 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import Protocol, Sequence
+from langchain_core.documents import Document
+
+ROUTE_LOCAL = "local"
+ROUTE_SEARCH = "search"
+ROUTE_AMBIGUOUS = "ambiguous"
+
+# Признаки вопросов об актуальной информации, которой заведомо нет в загруженных документах
+FRESHNESS_PATTERN = re.compile(
+    r"\b(сегодня|сейчас|вчера|завтра|актуальн\w*|последн\w*|новост\w*|свеж\w*|курс\w*|погод\w*|"
+    r"today|now|latest|current|news|20[2-9]\d)\b",
+    re.IGNORECASE,
+)
+WORD_PATTERN = re.compile(r"\w{4,}")
+
+
+@dataclass
+class RouteDecision:
+    """Решение маршрутизатора"""
+
+    route: str
+    reason: str
+    top_score: float | None = None
+
+
+class Router(Protocol):
+    """Интерфейс маршрутизатора: решает до вызова LLM, отвечать по контексту или искать в интернете"""
+
+    def route(self, query: str, documents: Sequence[Document]) -> RouteDecision:
+        ...
+
+
+class RetrievalRouter:
+    """
+    Маршрутизатор по уверенности поиска
+
+    Использует оценки релевантности реранкера (`relevance_score`), расстояния векторного поиска (`distance`) из
+    метаданных документов и дешёвые эвристики по тексту вопроса. Уверенные случаи решаются без LLM, для
+    неоднозначных возвращается ROUTE_AMBIGUOUS — решение принимает LLM в режиме вызова инструментов
+    """
+
+    def __init__(self, answer_threshold: float = 0.7, search_threshold: float = 0.2,
+                 max_distance: float | None = None, min_term_overlap: float = 0.3) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            answer_threshold: оценка реранкера, начиная с которой ответ строится только по контексту
+            search_threshold: оценка реранкера, ниже которой сразу выполняется поиск в интернете
+            max_distance: расстояние векторного поиска, выше которого контекст считается нерелевантным
+                (если не задано, расстояния не учитываются)
+            min_term_overlap: минимальная доля слов вопроса, встречающихся в лучшем документе, для ответа по контексту
+        """
+        if search_threshold > answer_threshold:
+            raise ValueError("Порог поиска не может превышать порог ответа по контексту")
+
+        self.answer_threshold = answer_threshold
+        self.search_threshold = search_threshold
+        self.max_distance = max_distance
+        self.min_term_overlap = min_term_overlap
+        self.counts = {ROUTE_LOCAL: 0, ROUTE_SEARCH: 0, ROUTE_AMBIGUOUS: 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _term_overlap(query: str, text: str) -> float:
+        """Доля значимых слов вопроса, которые встречаются в тексте"""
+        terms = {word.lower() for word in WORD_PATTERN.findall(query)}
+        if not terms:
+            return 1.0
+        text = text.lower()
+        # Сравнение по основе слова грубо учитывает словоформы
+        return sum(term[:max(4, len(term) - 2)] in text for term in terms) / len(terms)
+
+    def _decide(self, query: str, documents: Sequence[Document]) -> RouteDecision:
+        if not documents:
+            return RouteDecision(ROUTE_SEARCH, "нет документов")
+
+        scores = [doc.metadata["relevance_score"] for doc in documents if "relevance_score" in doc.metadata]
+        top_score = float(max(scores)) if scores else None
+        distances = [doc.metadata["distance"] for doc in documents if "distance" in doc.metadata]
+
+        if self.max_distance is not None and distances and min(distances) > self.max_distance:
+            return RouteDecision(ROUTE_SEARCH, "векторный поиск не нашёл близких документов", top_score)
+
+        if top_score is None:
+            return RouteDecision(ROUTE_AMBIGUOUS, "нет оценок реранкера")
+
+        if top_score < self.search_threshold:
+            return RouteDecision(ROUTE_SEARCH, "низкая оценка реранкера", top_score)
+
+        if FRESHNESS_PATTERN.search(query):
+            return RouteDecision(ROUTE_AMBIGUOUS, "вопрос об актуальной информации", top_score)
+
+        best = max(documents, key=lambda doc: doc.metadata.get("relevance_score", float("-inf")))
+        if top_score >= self.answer_threshold and self._term_overlap(query, best.page_content) >= self.min_term_overlap:
+            return RouteDecision(ROUTE_LOCAL, "высокая оценка реранкера", top_score)
+
+        return RouteDecision(ROUTE_AMBIGUOUS, "оценка реранкера в пограничной зоне", top_score)
+
+    def route(self, query: str, documents: Sequence[Document]) -> RouteDecision:
+        """
+        Выбор маршрута обработки вопроса
+
+        Args:
+            query: вопрос пользователя
+            documents: документы после реранкинга
+
+        Returns:
+            RouteDecision: маршрут (ROUTE_LOCAL, ROUTE_SEARCH или ROUTE_AMBIGUOUS) и причина решения
+        """
+        decision = self._decide(query, documents)
+        with self._lock:
+            self.counts[decision.route] += 1
+        return decision
+
+    def stats(self) -> dict[str, int]:
+        """
+        Статистика решений маршрутизатора
+
+        Returns:
+            dict[str, int]: количество решений по каждому маршруту
+        """
+        with self._lock:
+            return dict(self.counts)
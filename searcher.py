@@ -1,9 +1,25 @@
+import aiohttp
+import asyncio
+import codecs
+import json
+import multiprocessing
 import os
+import queue
 import re
 import requests
+import signal
+import threading
+import time
 import trafilatura
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from dotenv import load_dotenv
+from hashlib import sha256
 from html import unescape
+from requests.adapters import HTTPAdapter
+from typing import Any, Iterator
+from http_cache import HttpCache
 
 # Загружаем переменные из .env файла
 load_dotenv()
@@ -11,6 +27,240 @@ load_dotenv()
 SEARCH_ID = os.getenv('SEARCH_ID')
 API_KEY = os.getenv('API_KEY')
 
+FETCH_DEADLINE = float(os.getenv('FETCH_DEADLINE', 8))
+FETCH_PER_HOST = int(os.getenv('FETCH_PER_HOST', 2))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', 2 * 2 ** 20))
+EXTRACT_HTML_WORKERS = int(os.getenv('EXTRACT_HTML_WORKERS', min(4, os.cpu_count() or 1)))
+EXTRACT_MAX_HTML_CHARS = int(os.getenv('EXTRACT_MAX_HTML_CHARS', 1_000_000))
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', 2))
+WEB_CACHE_PATH = os.getenv('WEB_CACHE_PATH')
+WEB_CACHE_TTL = float(os.getenv('WEB_CACHE_TTL', 6 * 3600))
+WEB_CACHE_MAX_BYTES = int(os.getenv('WEB_CACHE_MAX_BYTES', 256 * 2 ** 20))
+
+# Разделитель текстов страниц в результате collect_for_llm
+WEB_SEPARATOR = "\n===========\n"
+
+_WS_RE = re.compile(r"\s+")
+
+
+@dataclass
+class FetchedPage:
+    """Результат загрузки страницы"""
+
+    url: str
+    # HTML-код страницы (None, если страница не изменилась — ответ 304)
+    html: str | None
+    status: int
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class FetchEngine:
+    """
+    Параллельная асинхронная загрузка страниц
+
+    Загрузка выполняется в цикле событий на отдельном фоновом потоке, поэтому движок можно вызывать из любого потока,
+    в том числе из обработчика FastAPI. Для всех запросов действует общий срок: страницы, загруженные к сроку,
+    возвращаются, остальные загрузки отменяются. Количество одновременных соединений с одним хостом ограничено, тело
+    ответа читается потоково и обрезается по размеру
+    """
+
+    def __init__(self, deadline: float = FETCH_DEADLINE, per_host_limit: int = FETCH_PER_HOST,
+                 max_bytes: int = FETCH_MAX_BYTES, connect_timeout: float = 3.0, max_connections: int = 32) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            deadline: общий срок загрузки всех страниц одного вызова в секундах
+            per_host_limit: максимальное количество одновременных соединений с одним хостом
+            max_bytes: максимальный размер тела ответа в байтах (остаток не читается)
+            connect_timeout: время ожидания соединения в секундах
+            max_connections: максимальное общее количество одновременных соединений
+        """
+        if deadline <= 0 or per_host_limit < 1 or max_bytes < 1:
+            raise ValueError("Срок загрузки, лимит соединений на хост и размер ответа должны быть положительными")
+
+        self.deadline = deadline
+        self.per_host_limit = per_host_limit
+        self.max_bytes = max_bytes
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.fetched = 0
+        self.not_modified = 0
+        self.failed = 0
+        self.truncated = 0
+        self.cancelled = 0
+        self._session: aiohttp.ClientSession | None = None
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fetch-engine", daemon=True)
+        self._thread.start()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Общая сессия с пулом соединений (создаётся в цикле событий движка)"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host_limit),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout),
+                headers={"User-Agent": "Mozilla/5.0"},
+            )
+        return self._session
+
+    async def _fetch(self, url: str, headers: dict[str, str] | None = None) -> FetchedPage | None:
+        """Загрузка одной страницы с ограничением размера тела ответа"""
+        try:
+            async with self._get_session().get(url, headers=headers, allow_redirects=True) as response:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                if response.status == 304:
+                    self._count("not_modified")
+                    return FetchedPage(url, None, 304, etag, last_modified)
+                if response.status >= 400:
+                    self._count("failed")
+                    return None
+
+                chunks = []
+                size = 0
+                truncated = False
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    if size + len(chunk) > self.max_bytes:
+                        chunks.append(chunk[:self.max_bytes - size])
+                        truncated = True
+                        self._count("truncated")
+                        break
+                    chunks.append(chunk)
+                    size += len(chunk)
+
+                self._count("fetched")
+                # Обрезка может разрезать многобайтовый символ: незавершённая последовательность в конце
+                # отбрасывается (final=False), а не заменяется символом U+FFFD, который длиннее в байтах
+                decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+                html = decoder.decode(b"".join(chunks), final=not truncated)
+                return FetchedPage(url, html, response.status, etag, last_modified)
+        except (aiohttp.ClientError, asyncio.TimeoutError, LookupError, ValueError):
+            self._count("failed")
+            return None
+
+    async def _fetch_all(self, urls: list[str], deadline: float, results: queue.Queue,
+                         validators: dict[str, dict[str, str]]) -> None:
+        """Загрузка страниц до срока: результаты передаются в очередь по мере готовности"""
+        async def fetch(url: str) -> None:
+            page = await self._fetch(url, validators.get(url))
+            if page is not None and (page.html or page.status == 304):
+                results.put(page)
+
+        tasks = [asyncio.create_task(fetch(url)) for url in dict.fromkeys(urls)]
+        try:
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=deadline)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                self._count("cancelled", len(pending))
+        finally:
+            results.put(None)
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def fetch_iter(self, urls: list[str], deadline: float | None = None,
+                   validators: dict[str, dict[str, str]] | None = None) -> Iterator[FetchedPage]:
+        """
+        Параллельная загрузка страниц с выдачей результатов по мере готовности
+
+        Args:
+            urls: URL страниц
+            deadline: общий срок загрузки в секундах (по умолчанию — заданный при инициализации)
+            validators: заголовки условных запросов (If-None-Match, If-Modified-Since) по URL
+
+        Yields:
+            FetchedPage: успешно загруженная или не изменившаяся (304) страница
+        """
+        results = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._fetch_all(urls, deadline or self.deadline, results, validators or {}),
+                                         self._loop)
+        while (page := results.get()) is not None:
+            yield page
+
+    def fetch_many(self, urls: list[str], deadline: float | None = None) -> dict[str, str]:
+        """
+        Параллельная загрузка страниц
+
+        Args:
+            urls: URL страниц
+            deadline: общий срок загрузки в секундах (по умолчанию — заданный при инициализации)
+
+        Returns:
+            dict[str, str]: HTML-код страниц, загруженных к сроку, по URL
+        """
+        return {page.url: page.html for page in self.fetch_iter(urls, deadline) if page.html}
+
+    def stats(self) -> dict[str, int]:
+        """
+        Статистика загрузок
+
+        Returns:
+            dict[str, int]: количество загруженных, не изменившихся (304), неудачных, обрезанных по размеру и
+            отменённых по сроку загрузок
+        """
+        with self._lock:
+            return {
+                "fetched": self.fetched,
+                "not_modified": self.not_modified,
+                "failed": self.failed,
+                "truncated": self.truncated,
+                "cancelled": self.cancelled,
+            }
+
+    def close(self) -> None:
+        """Закрытие сессии и остановка цикла событий"""
+        async def close_session() -> None:
+            if self._session is not None:
+                await self._session.close()
+
+        asyncio.run_coroutine_threadsafe(close_session(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_fetch_engine: FetchEngine | None = None
+_fetch_engine_lock = threading.Lock()
+
+# Сессии с соединениями keep-alive для запросов к поисковому API: requests.Session не гарантирует
+# потокобезопасность, поэтому у каждого потока (их количество ограничено пулами исполнителей) своя сессия
+_sessions = threading.local()
+
+_http_cache: HttpCache | None = None
+
+
+def get_fetch_engine() -> FetchEngine:
+    """Общий движок загрузки страниц (создаётся при первом обращении)"""
+    global _fetch_engine
+    with _fetch_engine_lock:
+        if _fetch_engine is None:
+            _fetch_engine = FetchEngine()
+        return _fetch_engine
+
+
+def get_search_session() -> requests.Session:
+    """Сессия keep-alive текущего потока (создаётся при первом обращении)"""
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        _sessions.session = session
+    return session
+
+
+def get_http_cache() -> HttpCache | None:
+    """Общий дисковый кэш ответов поискового API и текста страниц (None, если WEB_CACHE_PATH не задан)"""
+    global _http_cache
+    with _fetch_engine_lock:
+        if _http_cache is None and WEB_CACHE_PATH:
+            _http_cache = HttpCache(WEB_CACHE_PATH, ttl=WEB_CACHE_TTL, max_bytes=WEB_CACHE_MAX_BYTES)
+        return _http_cache
+
 
 def fetch_html(url: str) -> str | None:
     """
@@ -22,16 +272,7 @@ def fetch_html(url: str) -> str | None:
     Returns:
         str | None: HTML-код страницы в виде строки или None при ошибке
     """
-    try:
-        r = requests.get(
-            url,
-            timeout=10,
-            headers={"User-Agent": "Mozilla/5.0"}
-        )
-        r.raise_for_status()
-        return r.text
-    except Exception:
-        return None
+    return get_fetch_engine().fetch_many([url], deadline=10).get(url)
 
 
 def normalize_text(text: str) -> str:
@@ -45,7 +286,7 @@ def normalize_text(text: str) -> str:
         str: Нормализованный текст
     """
     text = unescape(text)
-    text = re.sub(r"\s+", " ", text)
+    text = _WS_RE.sub(" ", text)
     return text.strip()
 
 
@@ -69,42 +310,344 @@ def extract_main_text(html: str) -> str | None:
     return normalize_text(text)
 
 
-def collect_for_llm(search_response: dict) -> str:
+# Сработал ли таймер извлечения в текущем процессе пула
+_extract_alarm = False
+
+
+def _on_extract_timeout(signum, frame) -> None:
+    global _extract_alarm
+    _extract_alarm = True
+    raise TimeoutError("Превышено время извлечения текста")
+
+
+def _extract_with_timeout(html: str, timeout: float) -> str | None:
     """
-    Формирует текст из результатов поисковой выдачи для передачи в LLM
+    Извлечение текста в процессе пула с ограничением времени через SIGALRM (где он поддерживается)
+
+    trafilatura перехватывает исключения широкими except, поэтому TimeoutError из обработчика сигнала может
+    превратиться в пустой результат. Срабатывание таймера запоминается отдельно, и такой результат тоже считается
+    превышением времени
+    """
+    global _extract_alarm
+    if not hasattr(signal, "setitimer"):
+        return extract_main_text(html)
+
+    _extract_alarm = False
+    previous = signal.signal(signal.SIGALRM, _on_extract_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        text = extract_main_text(html)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+    if _extract_alarm:
+        raise TimeoutError("Превышено время извлечения текста")
+    return text
+
+
+class ExtractionPool:
+    """
+    Извлечение основного текста страниц в пуле процессов
+
+    trafilatura нагружает CPU на сотни миллисекунд на тяжёлых страницах, поэтому извлечение выполняется вне потока
+    обработчика и параллельно для разных страниц. HTML обрезается по размеру, время извлечения одного документа
+    ограничено, результаты выдаются по мере готовности.
+
+    Время ограничивается дважды: SIGALRM в процессе пула прерывает извлечение, а родительский процесс перестаёт
+    ждать документ, если результата нет к сроку с учётом очереди (например, извлечение зависло в C-коде lxml, где
+    сигнал не обрабатывается). Такие документы считаются отдельно (abandoned), а процессы их пула завершаются,
+    чтобы зависшее извлечение не занимало процесс навсегда.
+    Если процесс пула завершился аварийно (например, из-за ошибки в lxml) или пул остановлен из-за зависшего
+    документа, пул пересоздаётся, а документы, прерванные вместе с ним, извлекаются повторно один раз, каждый в
+    отдельном процессе: документ, снова завершивший процесс аварийно, пропускается.
+    Процессы запускаются через forkserver: пул создаётся лениво из потока обработчика, когда в процессе уже
+    работают потоки aiohttp и torch, и fork такого процесса может унаследовать захваченные блокировки
+    """
+
+    def __init__(self, workers: int = EXTRACT_HTML_WORKERS, max_html_chars: int = EXTRACT_MAX_HTML_CHARS,
+                 timeout: float = EXTRACT_TIMEOUT) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            workers: количество процессов
+            max_html_chars: максимальный размер HTML в символах (остаток отбрасывается)
+            timeout: максимальное время извлечения текста одного документа в секундах
+        """
+        if workers < 1 or max_html_chars < 1 or timeout <= 0:
+            raise ValueError("Количество процессов, размер HTML и время извлечения должны быть положительными")
+
+        self.workers = workers
+        self.max_html_chars = max_html_chars
+        self.timeout = timeout
+        self.extracted = 0
+        self.empty = 0
+        self.truncated = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.abandoned = 0
+        self.restarts = 0
+        self._in_flight = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def _create_executor(self, workers: int) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Текущий пул процессов (создаётся при первом обращении и после остановки предыдущего, под блокировкой)"""
+        if self._executor is None:
+            self._executor = self._create_executor(self.workers)
+        return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Остановка пула с аварийно завершившимся или зависшим процессом (следующий документ создаст новый пул)
+
+        Процессы пула завершаются принудительно: зависшее в C-коде извлечение не реагирует на SIGALRM и не завершится
+        само. Незавершённые задачи этого пула получают BrokenProcessPool
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        # ProcessPoolExecutor не позволяет завершить процессы через публичный API (до Python 3.14)
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_shared(self, html: str) -> tuple[Future, ProcessPoolExecutor, int]:
+        """Постановка документа в общий пул (пул, сломанный до постановки, пересоздаётся)"""
+        while True:
+            with self._lock:
+                executor = self._get_executor()
+                # Срок результата учитывает документы, уже ожидающие извлечения: они обрабатываются волнами по
+                # числу процессов
+                waves = self._in_flight // self.workers + 1
+                self._in_flight += 1
+            try:
+                return executor.submit(_extract_with_timeout, html, self.timeout), executor, waves
+            except BrokenProcessPool:
+                self._count("_in_flight", -1)
+                self._discard(executor)
+
+    def submit(self, html: str, retry: bool = False) -> Future:
+        """
+        Постановка документа в очередь извлечения
+
+        Args:
+            html: HTML-код страницы
+            retry: повторное извлечение документа, прерванного остановкой пула (в отдельном процессе)
+
+        Returns:
+            Future: Future с текстом страницы или None
+        """
+        if len(html) > self.max_html_chars:
+            html = html[:self.max_html_chars]
+            if not retry:
+                self._count("truncated")
+
+        if retry:
+            # Повтор выполняется в отдельном процессе: если документ снова завершит процесс аварийно, это не
+            # затронет другие документы, и виновный документ определяется однозначно
+            executor = self._create_executor(1)
+            future = executor.submit(_extract_with_timeout, html, self.timeout)
+            future.add_done_callback(lambda _: executor.shutdown(wait=False))
+            self._count("_in_flight")
+            waves = 1
+        else:
+            future, executor, waves = self._submit_shared(html)
+
+        future.deadline = time.monotonic() + self.timeout * waves + 1
+        future.executor = executor
+        future.html = html
+        future.retry = retry
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future) -> None:
+        self._count("_in_flight", -1)
+
+    def iter_results(self, futures: dict[Future, Any]) -> Iterator[tuple[Any, str]]:
+        """
+        Результаты извлечения по мере готовности
+
+        Документы, не обработанные за отведённое время, пропускаются. Документы, прерванные остановкой пула,
+        извлекаются повторно один раз
+
+        Args:
+            futures: Future извлечения и соответствующие ключи (например, URL или загруженная страница)
+
+        Yields:
+            tuple[Any, str]: ключ и извлечённый текст
+        """
+        keys = dict(futures)
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            expired = {future for future in pending if future.deadline <= now and not future.done()}
+            for future in expired:
+                # Документ, ещё ждущий в очереди, снимается; зависший в процессе пула — больше не ожидается, а пул
+                # останавливается, чтобы освободить процесс
+                if future.cancel():
+                    self._count("timed_out")
+                else:
+                    self._count("abandoned")
+                    self._discard(future.executor)
+            pending -= expired
+            if not pending:
+                break
+
+            done, pending = wait(pending, timeout=max(min(future.deadline for future in pending) - now, 0),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    if future.cancelled():
+                        # Задача снята из очереди при остановке пула другим документом
+                        raise BrokenProcessPool
+                    text = future.result()
+                except BrokenProcessPool:
+                    self._discard(future.executor)
+                    if future.retry:
+                        self._count("failed")
+                    else:
+                        retried = self.submit(future.html, retry=True)
+                        keys[retried] = keys[future]
+                        pending.add(retried)
+                    continue
+                except TimeoutError:
+                    self._count("timed_out")
+                    continue
+                except Exception:
+                    self._count("failed")
+                    continue
+                if not text:
+                    self._count("empty")
+                    continue
+                self._count("extracted")
+                yield keys[future], text
+
+    def extract_many(self, pages: dict[str, str]) -> dict[str, str]:
+        """
+        Извлечение текста нескольких страниц
+
+        Args:
+            pages: HTML-код страниц по ключу
+
+        Returns:
+            dict[str, str]: непустой извлечённый текст по ключу
+        """
+        return dict(self.iter_results({self.submit(html): key for key, html in pages.items()}))
+
+    def stats(self) -> dict[str, int]:
+        """
+        Статистика извлечения
+
+        Returns:
+            dict[str, int]: количество извлечённых, пустых, обрезанных по размеру, прерванных по времени в процессе
+            пула, брошенных родительским процессом по сроку и завершившихся ошибкой документов и количество
+            пересозданий пула
+        """
+        with self._lock:
+            return {
+                "extracted": self.extracted,
+                "empty": self.empty,
+                "truncated": self.truncated,
+                "timed_out": self.timed_out,
+                "abandoned": self.abandoned,
+                "failed": self.failed,
+                "restarts": self.restarts,
+            }
+
+
+_extraction_pool: ExtractionPool | None = None
+
+
+def get_extraction_pool() -> ExtractionPool:
+    """Общий пул извлечения текста страниц (создаётся при первом обращении)"""
+    global _extraction_pool
+    with _fetch_engine_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ExtractionPool()
+        return _extraction_pool
+
+
+def collect_pages(search_response: dict, deadline: float | None = None) -> list[tuple[str, str]]:
+    """
+    Загружает страницы из результатов поисковой выдачи и извлекает из них основной текст
+
+    Страницы загружаются параллельно с общим сроком, страницы, не загруженные к сроку, пропускаются. Если задан
+    WEB_CACHE_PATH, извлечённый текст страниц берётся из кэша, а устаревшие записи проверяются условными запросами
 
     Args:
         search_response: Ответ поискового API
+        deadline: Общий срок загрузки страниц в секундах (по умолчанию FETCH_DEADLINE)
 
     Returns:
-        str: Объединённый текст, пригодный для передачи в LLM
+        list[tuple[str, str]]: Пары (URL, текст страницы) в порядке поисковой выдачи
     """
-    documents = []
+    urls = [item.get("link") for item in search_response.get("items", []) if item.get("link")]
+    cache = get_http_cache()
+    texts = {}
+    stale = {}
 
-    for item in search_response.get("items", []):
-        url = item.get("link")
-        if not url:
-            continue
+    if cache is not None:
+        for url in urls:
+            entry = cache.get(f"page:{url}")
+            if entry is None:
+                continue
+            if entry.fresh:
+                texts[url] = entry.body
+            else:
+                stale[url] = entry
 
-        html = fetch_html(url)
-        if not html:
-            continue
+    to_fetch = [url for url in urls if url not in texts]
+    validators = {url: entry.validators() for url, entry in stale.items()}
+    pool = get_extraction_pool()
+    # Извлечение текста страницы начинается сразу после её загрузки, параллельно с загрузкой остальных
+    extracting = {}
+    for page in get_fetch_engine().fetch_iter(to_fetch, deadline, validators):
+        if page.status == 304 and page.url in stale:
+            cache.revalidate(f"page:{page.url}")
+            texts[page.url] = stale[page.url].body
+        elif page.html:
+            extracting[pool.submit(page.html)] = page
 
-        text = extract_main_text(html)
-        if not text:
-            continue
+    for page, text in pool.iter_results(extracting):
+        texts[page.url] = text
+        if cache is not None:
+            cache.set(f"page:{page.url}", text, page.etag, page.last_modified)
 
-        documents.append(
-            f"Источник: {url}\n{text}"
-        )
+    return [(url, texts[url]) for url in dict.fromkeys(urls) if url in texts]
 
-    return "\n===========\n".join(documents)
+
+def collect_for_llm(search_response: dict, deadline: float | None = None) -> str:
+    """
+    Формирует текст из результатов поисковой выдачи для передачи в LLM
+
+    Args:
+        search_response: Ответ поискового API
+        deadline: Общий срок загрузки страниц в секундах (по умолчанию FETCH_DEADLINE)
+
+    Returns:
+        str: Объединённый текст, пригодный для передачи в LLM
+    """
+    documents = [f"Источник: {url}\n{text}" for url, text in collect_pages(search_response, deadline)]
+    return WEB_SEPARATOR.join(documents)
 
 
 def google_search(query, search_id: str, api_key: str) -> dict:
     """
     Выполняет поисковый запрос к Google Custom Search API и возвращает результаты поиска
 
+    Запросы идут через общую сессию с keep-alive, ответы кэшируются на диске, если задан WEB_CACHE_PATH
+
     Args:
         query: Поисковый запрос
         search_id: Идентификатор поисковой системы
@@ -121,8 +664,23 @@ def google_search(query, search_id: str, api_key: str) -> dict:
         'q': query,
         'num': 5
     }
-    response = requests.get(url, params=params, timeout=10)
+
+    # API-ключ в ключ кэша не входит
+    cache = get_http_cache()
+    key = "search:" + sha256(f"{search_id}\n{params['num']}\n{query}".encode("utf-8")).hexdigest()
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None and entry.fresh:
+        return json.loads(entry.body)
+
+    headers = entry.validators() if entry is not None else {}
+    response = get_search_session().get(url, params=params, headers=headers, timeout=10)
+    if response.status_code == 304 and entry is not None:
+        cache.revalidate(key)
+        return json.loads(entry.body)
     response.raise_for_status()
+
+    if cache is not None:
+        cache.set(key, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
     return response.json()
 
 
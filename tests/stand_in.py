@@ -0,0 +1,72 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Локальный стенд вместо внешних сайтов: /page?delay=<с>&size=<байт> отдаёт HTML с задержкой, /fail — ошибку 500
+
+    Стенд запоминает наибольшее количество одновременно обрабатываемых запросов
+    """
+
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls.lock:
+            cls.active = 0
+            cls.max_active = 0
+
+    def do_GET(self) -> None:
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            self._respond()
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def _respond(self) -> None:
+        path, _, query = self.path.partition("?")
+        params = dict(parse_qsl(query))
+        time.sleep(float(params.get("delay", 0)))
+        if path == "/fail":
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        paragraph = "<p>Текст страницы стенда для проверки загрузки и извлечения основного текста.</p>"
+        size = int(params.get("size", 20000))
+        body = f"<html><body><article>{paragraph * (size // len(paragraph) + 1)}</article></body></html>"
+        body = body.encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент отменил загрузку
+            pass
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_stand_in() -> tuple[ThreadingHTTPServer, str]:
+    """
+    Запуск стенда на свободном порту
+
+    Returns:
+        tuple[ThreadingHTTPServer, str]: сервер и его базовый URL
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,73 @@
+import time
+import pytest
+from tests.stand_in import StandInHandler, start_stand_in
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("trafilatura")
+pytest.importorskip("dotenv")
+
+from searcher import FetchEngine  # noqa: E402
+
+
+@pytest.fixture
+def base_url():
+    StandInHandler.reset()
+    server, url = start_stand_in()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def engine():
+    engine = FetchEngine(deadline=1.0, per_host_limit=2, max_bytes=64 * 1024)
+    yield engine
+    engine.close()
+
+
+def test_deadline_cancels_stragglers(base_url, engine):
+    urls = [f"{base_url}/page?delay=0.05", f"{base_url}/page?delay=60"]
+
+    started = time.perf_counter()
+    pages = list(engine.fetch_iter(urls))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < engine.deadline + 0.5
+    assert [page.url for page in pages] == [urls[0]]
+    assert engine.stats()["cancelled"] == 1
+
+
+def test_per_host_limit(base_url, engine):
+    urls = [f"{base_url}/page?delay=0.2&n={i}" for i in range(6)]
+
+    pages = list(engine.fetch_iter(urls, deadline=5.0))
+
+    assert len(pages) == len(urls)
+    assert StandInHandler.max_active == engine.per_host_limit
+
+
+def test_failed_and_oversize_responses(base_url, engine):
+    fail_url = f"{base_url}/fail"
+    big_url = f"{base_url}/page?size={4 * 2 ** 20}"
+
+    pages = {page.url: page for page in engine.fetch_iter([fail_url, big_url], deadline=5.0)}
+
+    # Ошибка сервера не попадает в результат, а тело большого ответа читается только до max_bytes
+    assert fail_url not in pages
+    assert len(pages[big_url].html.encode()) <= engine.max_bytes
+    stats = engine.stats()
+    assert stats["failed"] == 1
+    assert stats["truncated"] == 1
+
+
+def test_first_page_streams_before_slow_pages(base_url, engine):
+    fast_url = f"{base_url}/page?delay=0.05"
+    slow_url = f"{base_url}/page?delay=1.5"
+
+    started = time.perf_counter()
+    arrivals = [(page.url, time.perf_counter() - started)
+                for page in engine.fetch_iter([slow_url, fast_url], deadline=3.0)]
+
+    assert [url for url, _ in arrivals] == [fast_url, slow_url]
+    assert arrivals[0][1] < 1.0
+    assert arrivals[1][1] >= 1.5
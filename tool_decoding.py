@@ -0,0 +1,183 @@
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+# Шаблон вызова инструмента web_search: строки — фиксированные фрагменты JSON, None — значение строкового аргумента
+WEB_SEARCH_TEMPLATE = ('{"name": "web_search", "arguments": {"query": "', None, '", "reason": "', None, '"}}')
+
+VERDICT_TOOL = "tool"
+VERDICT_ANSWER = "answer"
+
+
+def json_object_end(text: str) -> int | None:
+    """
+    Позиция конца первого JSON-объекта в тексте с учётом строк и экранирования
+
+    Args:
+        text: Текст, начинающийся с `{` (ведущие пробелы допускаются)
+
+    Returns:
+        int | None: Индекс символа, следующего за закрывающей `}`, или None, если объект ещё не закрыт
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+class ToolCallStoppingCriteria(StoppingCriteria):
+    """
+    Критерий остановки генерации в режиме вызова инструмента
+
+    Останавливает генерацию, как только закрылся JSON-объект вызова инструмента. Если первый непробельный символ
+    ответа не `{`, сразу фиксирует вердикт «без инструмента» и (при stop_on_answer) тоже останавливает генерацию
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, stop_on_answer: bool = True) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            tokenizer: Токенизатор LLM-модели
+            prompt_length: Длина промпта в токенах
+            stop_on_answer: Останавливать генерацию, если ответ не является вызовом инструмента
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_on_answer = stop_on_answer
+        self.verdict: str | None = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = False
+        if self.verdict is None:
+            text = self.tokenizer.decode(input_ids[0, self.prompt_length:], skip_special_tokens=True).lstrip()
+            if text and not text.startswith("{"):
+                self.verdict = VERDICT_ANSWER
+            elif text and json_object_end(text) is not None:
+                self.verdict = VERDICT_TOOL
+                done = True
+
+        if self.verdict == VERDICT_ANSWER:
+            done = self.stop_on_answer
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+
+class ToolCallLogitsProcessor(LogitsProcessor):
+    """
+    Ограничение декодирования схемой вызова инструмента web_search
+
+    Пока ответ не начался с `{`, модель генерирует свободно (и может ответить без инструмента). После `{`
+    фиксированные фрагменты шаблона подставляются принудительно, а внутри строковых аргументов запрещены токены с
+    кавычкой, кроме одиночной закрывающей кавычки. Поэтому вызов инструмента всегда получается корректным
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, quote_token_ids: torch.Tensor, quote_id: int,
+                 template: tuple[str | None, ...] = WEB_SEARCH_TEMPLATE) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            tokenizer: Токенизатор LLM-модели
+            prompt_length: Длина промпта в токенах
+            quote_token_ids: Идентификаторы токенов словаря, содержащих `"`
+            quote_id: Идентификатор токена, состоящего из одной `"`
+            template: Шаблон вызова инструмента
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.quote_token_ids = quote_token_ids[quote_token_ids != quote_id]
+        self.template = template
+        self._forced_ids: dict[str, int | None] = {}
+
+    def _forced_token(self, rest: str) -> int | None:
+        """
+        Токен, продолжающий фиксированный фрагмент шаблона
+
+        Первый токен кодировки фрагмента подходит, только если его текст является началом фрагмента: токенизатор
+        может, например, добавить к первому токену пробел. Иначе выбирается самое длинное начало фрагмента,
+        кодируемое одним токеном
+
+        Args:
+            rest: оставшаяся часть фиксированного фрагмента
+
+        Returns:
+            int | None: идентификатор токена или None, если подходящего токена нет
+        """
+        if rest not in self._forced_ids:
+            forced = None
+            ids = self.tokenizer.encode(rest, add_special_tokens=False)
+            piece = self.tokenizer.decode(ids[:1]) if ids else ""
+            if piece and rest.startswith(piece):
+                forced = ids[0]
+            else:
+                for end in range(len(rest), 0, -1):
+                    ids = self.tokenizer.encode(rest[:end], add_special_tokens=False)
+                    if len(ids) == 1 and self.tokenizer.decode(ids) == rest[:end]:
+                        forced = ids[0]
+                        break
+            self._forced_ids[rest] = forced
+        return self._forced_ids[rest]
+
+    def _state(self, text: str) -> tuple[str, str | None]:
+        """
+        Положение сгенерированного текста в шаблоне (пробелы вне строк игнорируются)
+
+        Returns:
+            tuple[str, str | None]: ("literal", оставшаяся часть фиксированного фрагмента), ("string", None),
+            ("done", None) или ("invalid", None)
+        """
+        pos = 0
+        for part in self.template:
+            if part is None:
+                end = pos
+                while end < len(text) and (text[end] != '"' or text[end - 1] == "\\"):
+                    end += 1
+                if end == len(text):
+                    return "string", None
+                pos = end
+                continue
+
+            for j, ch in enumerate(part):
+                if ch.isspace():
+                    continue
+                while pos < len(text) and text[pos].isspace():
+                    pos += 1
+                if pos == len(text):
+                    return "literal", part[j:]
+                if text[pos] != ch:
+                    return "invalid", None
+                pos += 1
+        return "done", None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row in range(input_ids.shape[0]):
+            text = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True).lstrip()
+            if not text.startswith("{"):
+                continue
+
+            kind, rest = self._state(text)
+            if kind == "literal":
+                forced = self._forced_token(rest)
+                if forced is None:
+                    continue
+                value = scores[row, forced].clone()
+                scores[row, :] = float("-inf")
+                scores[row, forced] = value
+            elif kind == "string":
+                scores[row, self.quote_token_ids.to(scores.device)] = float("-inf")
+        return scores
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+
+class WebPassageRanker:
+    """
+    Отбор фрагментов интернет страниц, релевантных запросу
+
+    1. Текст страниц нарезается на фрагменты, у каждого фрагмента в metadata["source"] сохраняется URL страницы
+    2. Если фрагментов больше candidates, они индексируются во временном индексе в памяти (матрица эмбеддингов),
+       и для реранкинга остаются candidates фрагментов, ближайших к запросу по косинусному сходству
+    3. Кандидаты переранжируются кросс-энкодером, остаются top_n фрагментов реранкера с оценкой в
+       metadata["relevance_score"]
+    """
+
+    def __init__(self, embeddings: Embeddings, reranker, chunk_size: int = 1000, chunk_overlap: int = 150,
+                 candidates: int = 20) -> None:
+        """
+        Инициализация класса
+
+        Args:
+            embeddings: модель эмбеддингов (без дискового кэша: фрагменты одноразовые)
+            reranker: реранкер с методом compress_documents (Rerank)
+            chunk_size: размер фрагмента в символах
+            chunk_overlap: перекрытие соседних фрагментов в символах
+            candidates: количество фрагментов, передаваемых реранкеру после векторного отбора
+        """
+        if candidates < 1 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("Количество кандидатов должно быть положительным, а перекрытие — меньше размера фрагмента")
+
+        self.embeddings = embeddings
+        self.reranker = reranker
+        self.candidates = candidates
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                                       separators=["\n\n", "\n", ".", " ", ""])
+        self.requests = 0
+        self.passages = 0
+        self.selected = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _split(self, pages: list[tuple[str, str]]) -> list[Document]:
+        return [Document(page_content=chunk, metadata={"source": url})
+                for url, text in pages for chunk in self.splitter.split_text(text)]
+
+    def _nearest(self, query: str, passages: list[Document]) -> list[Document]:
+        """Отбор фрагментов, ближайших к запросу по косинусному сходству эмбеддингов"""
+        index = np.asarray(self.embeddings.embed_documents([doc.page_content for doc in passages]), dtype=np.float32)
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        index /= np.linalg.norm(index, axis=1, keepdims=True) + 1e-12
+        query_vector /= np.linalg.norm(query_vector) + 1e-12
+        scores = index @ query_vector
+        top = np.argpartition(-scores, self.candidates - 1)[:self.candidates]
+        # Исходный порядок сохраняется: он не влияет на реранкинг, но делает результат детерминированным
+        return [passages[i] for i in sorted(top.tolist())]
+
+    def select(self, query: str, pages: list[tuple[str, str]]) -> list[Document]:
+        """
+        Отбор фрагментов
+
+        Args:
+            query: поисковый запрос
+            pages: пары (URL, текст страницы)
+
+        Returns:
+            list[Document]: фрагменты по убыванию релевантности
+        """
+        started = time.perf_counter()
+        passages = self._split(pages)
+        if not passages:
+            return []
+
+        candidates = self._nearest(query, passages) if len(passages) > self.candidates else passages
+        selected = list(self.reranker.compress_documents(query=query, documents=candidates))
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.requests += 1
+            self.passages += len(passages)
+            self.selected += len(selected)
+            self.seconds += elapsed
+        logger.info("Интернет источники: %d страниц, %d фрагментов -> %d кандидатов -> %d за %.2f с",
+                    len(pages), len(passages), len(candidates), len(selected), elapsed)
+        return selected
+
+    def stats(self) -> dict[str, float]:
+        """
+        Статистика отбора фрагментов
+
+        Returns:
+            dict[str, float]: количество запросов, среднее количество фрагментов до и после отбора и среднее время
+            отбора
+        """
+        with self._lock:
+            if not self.requests:
+                return {"requests": 0, "avg_passages": 0.0, "avg_selected": 0.0, "avg_seconds": 0.0}
+            return {
+                "requests": self.requests,
+                "avg_passages": round(self.passages / self.requests, 1),
+                "avg_selected": round(self.selected / self.requests, 1),
+                "avg_seconds": round(self.seconds / self.requests, 3),
+            }